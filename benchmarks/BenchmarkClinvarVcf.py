@@ -0,0 +1,109 @@
+"""
+BenchmarkClinvarVcf.py
+This script measures the throughput of utils/ParseClinvarVcf.py on a ClinVar VCF release against the
+previous implementation, which read an uncompressed VCF line by line, split every field and scanned
+INFO once per key. The streaming parser is timed on the uncompressed and the gzipped release, and its
+TSV is compared with the previous one; only records with several ALT alleles may differ, as they are
+now split into one row per allele. Throughput is in records and uncompressed megabytes per second.
+Usage:
+    python BenchmarkClinvarVcf.py -i <clinvar.vcf.gz> [--repeat 3]
+
+Arguments:
+    -i        ClinVar VCF release, plain or (b)gzipped (required)
+    --repeat  Timed runs of each parser; the best is reported (default: 3)
+"""
+import argparse
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+import ParseClinvarVcf
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-i', required=True, help="ClinVar VCF release")
+parser.add_argument('--repeat', type=int, default=3, help="Timed runs of each parser")
+
+def previous_parse(infile, outfile):
+    """
+    the parser this benchmark compares against, as it was before the streaming rewrite
+    """
+    with open(infile) as vcf, open(outfile, 'w') as tsv:
+        tsv.write(ParseClinvarVcf.HEADER)
+        for line in vcf:
+            if not line.startswith('#'):
+                data = line.strip().split('\t')
+                chromosome, position, variant_id, reference, alternate = data[0:5]
+                info = data[7].split(';')
+                review_status = [x.split('=')[1] for x in info if x.startswith('CLNREVSTAT')]
+                assertions = [x.split('=')[1] for x in info if x.startswith('CLNSIG')]
+                conditions = [x.split('=')[1] for x in info if x.startswith('CLNDN')]
+                tsv.write('\t'.join([chromosome, position, reference, alternate, variant_id,
+                                     ','.join(assertions), ','.join(review_status), ','.join(conditions)]) + '\n')
+
+def streaming_parse(infile, outfile):
+    ParseClinvarVcf.main(ParseClinvarVcf.parser.parse_args(['-i', infile, '-o', outfile]))
+
+def best_time(function, infile, outfile, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(infile, outfile)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def compare(previous, streaming):
+    """
+    returns the number of input records whose rows differ, and the number of multi-allelic records
+    """
+    differing = multi_allelic = 0
+    with open(previous, encoding='utf-8') as before, open(streaming, encoding='utf-8') as after:
+        for old in before:
+            fields = old.split('\t')
+            alternates = fields[3].split(',')
+            if len(alternates) > 1:
+                multi_allelic += 1
+            rows = [after.readline() for _ in alternates]
+            expected = ['\t'.join(fields[:3] + [alternate] + fields[4:]) for alternate in alternates]
+            if rows != expected:
+                differing += 1
+        if after.readline():
+            differing += 1
+    return differing, multi_allelic
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        plain, compressed = os.path.join(tmp, 'clinvar.vcf'), os.path.join(tmp, 'clinvar.vcf.gz')
+        if ParseClinvarVcf.is_gzip(args.i):
+            with gzip.open(args.i, 'rb') as infile, open(plain, 'wb') as outfile:
+                shutil.copyfileobj(infile, outfile)
+            compressed = args.i
+        else:
+            shutil.copyfile(args.i, plain)
+            with open(plain, 'rb') as infile, gzip.open(compressed, 'wb', compresslevel=6) as outfile:
+                shutil.copyfileobj(infile, outfile)
+        megabytes = os.path.getsize(plain) / 1e6
+        with open(plain, 'rb') as infile:
+            records = sum(1 for line in infile if not line.startswith(b'#'))
+        print(f"{records:,} records, {megabytes:,.1f} MB uncompressed, "
+              f"{os.path.getsize(compressed) / 1e6:,.1f} MB gzipped")
+        runs = [("previous, plain", previous_parse, plain, 'previous.tsv'),
+                ("streaming, plain", streaming_parse, plain, 'plain.tsv'),
+                ("streaming, gzip", streaming_parse, compressed, 'gzip.tsv')]
+        baseline = None
+        for name, function, infile, outfile in runs:
+            elapsed = best_time(function, infile, os.path.join(tmp, outfile), args.repeat)
+            baseline = baseline or elapsed
+            print(f"{name + ':':18}{elapsed:9.2f} s  {records / elapsed:12,.0f} records/s  "
+                  f"{megabytes / elapsed:8.1f} MB/s  {baseline / elapsed:5.2f}x")
+        for outfile in ('plain.tsv', 'gzip.tsv'):
+            differing, multi_allelic = compare(os.path.join(tmp, 'previous.tsv'), os.path.join(tmp, outfile))
+            print(f"{outfile}: {differing:,} records differ from the previous parser, "
+                  f"{multi_allelic:,} records have several ALT alleles")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
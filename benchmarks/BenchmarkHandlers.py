@@ -0,0 +1,460 @@
+"""
+BenchmarkHandlers.py
+This script measures the lambda handlers and the ClinVar parsers offline. Upstream responses are recorded
+once from the live services into a fixture file, then replayed from a local stub HTTP server (through the
+HTTP_UPSTREAM_OVERRIDE of lambda_functions/HttpClient.py) and from stub Athena and S3 clients, so runs
+are repeatable and need no network. Reports latency percentiles, throughput and tracemalloc allocations.
+Usage:
+    python BenchmarkHandlers.py record [-v variants.json] [-f upstreams.json]
+    python BenchmarkHandlers.py run [-v variants.json] [-f upstreams.json] [-n 20] [--warm]
+                                    [--clinvar-xml <xml>] [--clinvar-vcf <vcf>]
+                                    [--save <results.json>] [--compare <results.json>] [--tolerance 0.2]
+
+Arguments:
+    record         Call the live upstreams once per variant and write the fixture file
+                   (needs network access, AWS credentials and the OncoKB API_KEY)
+    run            Replay the fixture file and benchmark every handler
+    -v             Variants to query (default: fixtures/variants.json)
+    -f             Fixture file (default: fixtures/upstreams.json). It is not committed, as it holds live
+                   upstream and OncoKB responses: record it once before the first run
+    -n             Timed calls per handler and variant (default: 20); each parser runs 3 times
+    --warm         Keep the VEP annotation cache between calls instead of clearing it before each one
+    --clinvar-xml  ClinVar XML release to benchmark ParseClinvarXml on
+    --clinvar-vcf  ClinVar VCF release to benchmark ParseClinvarVcf on
+    --save         Write the results as JSON
+    --compare      Results of an earlier run; exits with status 1 if a median latency regressed
+    --tolerance    Allowed median latency increase over --compare (default: 0.2)
+"""
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, '..', 'lambda_functions'))
+sys.path.insert(0, os.path.join(BENCHMARKS, '..', 'utils'))
+
+parser = argparse.ArgumentParser()
+parser.add_argument('mode', choices=['record', 'run'], help="record fixtures or replay them")
+parser.add_argument('-v', default=os.path.join(BENCHMARKS, 'fixtures', 'variants.json'), help="Variants to query")
+parser.add_argument('-f', default=os.path.join(BENCHMARKS, 'fixtures', 'upstreams.json'), help="Fixture file")
+parser.add_argument('-n', type=int, default=20, help="Timed calls per handler and variant")
+parser.add_argument('--warm', action='store_true', help="Keep the VEP annotation cache between calls")
+parser.add_argument('--clinvar-xml', help="ClinVar XML release for ParseClinvarXml")
+parser.add_argument('--clinvar-vcf', help="ClinVar VCF release for ParseClinvarVcf")
+parser.add_argument('--save', help="Write the results as JSON")
+parser.add_argument('--compare', help="Results of an earlier run to compare against")
+parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed median latency increase")
+
+# response headers that describe the original transfer rather than the content
+HOP_HEADERS = {'connection', 'content-encoding', 'content-length', 'keep-alive', 'transfer-encoding'}
+
+def request_key(method, url, body=None):
+    """
+    fixture key of an upstream request: method, host, path and query, plus a digest of the body
+    """
+    parts = urlsplit(url)
+    key = f"{method} {parts.netloc}{unquote(parts.path)}"
+    if parts.query:
+        key += f"?{unquote(parts.query)}"
+    if body:
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        key += f" {hashlib.sha256(body).hexdigest()[:16]}"
+    return key
+
+def encode_value(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, dict):
+        return {k: encode_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(x) for x in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    # datetimes in the Athena responses
+    return str(value)
+
+def decode_value(value):
+    if isinstance(value, dict):
+        if '__bytes__' in value:
+            return base64.b64decode(value['__bytes__'])
+        return {k: decode_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [decode_value(x) for x in value]
+    return value
+
+class Fixtures:
+    """
+    Recorded upstream responses. HTTP responses are keyed by request_key and AWS
+    responses by client, operation and parameters; each key holds the responses
+    in the order they were recorded.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.http = {}
+        self.aws = {}
+        self.missing = set()
+
+    def load(self):
+        with open(self.path) as infile:
+            data = json.load(infile)
+        self.http = data['http']
+        self.aws = data['aws']
+        return self
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'w') as outfile:
+            json.dump({'http': self.http, 'aws': self.aws}, outfile, indent=1, sort_keys=True)
+
+def aws_key(service, operation, kwargs):
+    return f"{service}.{operation} {json.dumps(kwargs, sort_keys=True, default=str)}"
+
+class RecordingHttp:
+    """
+    Wraps HttpClient.http.request while recording.
+    """
+    def __init__(self, request, fixtures):
+        self.request = request
+        self.fixtures = fixtures
+
+    def __call__(self, method, url, **kwargs):
+        response = self.request(method, url, **kwargs)
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in HOP_HEADERS}
+        self.fixtures.http.setdefault(request_key(method, url, kwargs.get('body')), []).append(
+            {'status': response.status, 'headers': headers, 'body': encode_value(response.data)})
+        return response
+
+class ReplayServer(ThreadingHTTPServer):
+    """
+    Local HTTP server answering upstream requests from the fixtures. Requests arrive as
+    /host/path?query, as rewritten by HttpClient.upstream_url.
+    """
+    daemon_threads = True
+
+    def __init__(self, fixtures):
+        super().__init__(('127.0.0.1', 0), ReplayHandler)
+        self.fixtures = fixtures
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately; without this every keep-alive
+    # response waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def replay(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        key = request_key(self.command, f"https:/{self.path}", body)
+        responses = self.server.fixtures.http.get(key)
+        if not responses:
+            self.server.fixtures.missing.add(key)
+            response = {'status': 599, 'headers': {}, 'body': f"No fixture for {key}"}
+        else:
+            # repeated requests get the last recorded response
+            response = responses[-1]
+        data = decode_value(response['body'])
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.send_response(response['status'])
+        for name, value in response['headers'].items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = replay
+    do_POST = replay
+
+class RecordingPaginator:
+    def __init__(self, paginator, service, operation, fixtures):
+        self.paginator = paginator
+        self.key = (service, f"{operation}.paginate")
+        self.fixtures = fixtures
+
+    def paginate(self, **kwargs):
+        pages = [encode_value(page) for page in self.paginator.paginate(**kwargs)]
+        self.fixtures.aws.setdefault(aws_key(*self.key, kwargs), []).append(pages)
+        return iter(decode_value(pages))
+
+class RecordingClient:
+    """
+    Wraps a boto3 client while recording. S3 bodies are read into the fixture.
+    """
+    def __init__(self, client, service, fixtures):
+        self.client = client
+        self.service = service
+        self.fixtures = fixtures
+
+    def get_paginator(self, operation):
+        return RecordingPaginator(self.client.get_paginator(operation), self.service, operation, self.fixtures)
+
+    def __getattr__(self, operation):
+        from botocore.exceptions import ClientError
+        method = getattr(self.client, operation)
+
+        def call(**kwargs):
+            key = aws_key(self.service, operation, kwargs)
+            try:
+                response = method(**kwargs)
+            except ClientError as e:
+                self.fixtures.aws.setdefault(key, []).append({'__error__': encode_value(e.response)})
+                raise
+            if 'Body' in response:
+                response['Body'] = io.BytesIO(response['Body'].read())
+            recorded = encode_value({k: v.getvalue() if k == 'Body' else v for k, v in response.items()})
+            self.fixtures.aws.setdefault(key, []).append(recorded)
+            return response
+        return call
+
+class StubPaginator:
+    def __init__(self, client, operation):
+        self.client = client
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        return iter(self.client.replay(f"{self.operation}.paginate", kwargs))
+
+class StubClient:
+    """
+    Replays recorded boto3 responses. Repeated calls walk through the recorded responses
+    (e.g. RUNNING before SUCCEEDED) and stay on the last; reset() starts over.
+    """
+    def __init__(self, service, fixtures):
+        self.service = service
+        self.fixtures = fixtures
+        self.calls = {}
+
+    def reset(self):
+        self.calls = {}
+
+    def replay(self, operation, kwargs):
+        from botocore.exceptions import ClientError
+        key = aws_key(self.service, operation, kwargs)
+        responses = self.fixtures.aws.get(key)
+        if not responses:
+            self.fixtures.missing.add(key)
+            raise ClientError({'Error': {'Code': 'NoFixture', 'Message': key}}, operation)
+        index = self.calls.get(key, 0)
+        self.calls[key] = index + 1
+        response = decode_value(responses[min(index, len(responses) - 1)])
+        if isinstance(response, dict) and '__error__' in response:
+            raise ClientError(response['__error__'], operation)
+        if isinstance(response, dict) and 'Body' in response:
+            response['Body'] = io.BytesIO(response['Body'])
+        return response
+
+    def get_paginator(self, operation):
+        return StubPaginator(self, operation)
+
+    def __getattr__(self, operation):
+        if operation.startswith('_'):
+            raise AttributeError(operation)
+        return lambda **kwargs: self.replay(operation, kwargs)
+
+def load_handlers():
+    import Metrics
+    # one EMF log line per invocation would drown the report
+    Metrics.LOG_STREAM = open(os.devnull, 'w')
+    # keep the benchmark's cached responses out of a deployed cache database
+    import ResponseCache
+    ResponseCache.DISK_PATH = os.path.join(tempfile.gettempdir(), 'benchmark-response-cache.sqlite')
+    import QueryGeneInformation
+    import QueryGnomAD
+    import QueryOncoKb
+    import QueryPrism
+    import QueryVcfFromAthena
+    import QueryVep
+    hgvsg = lambda v: {'hgvsg': v['hgvsg']}
+    coordinates = lambda v: {x: v[x] for x in ('chromosome', 'position', 'reference', 'variant')}
+    return [('QueryVep', QueryVep.lambda_handler, hgvsg),
+            ('QueryOncoKb', QueryOncoKb.lambda_handler, hgvsg),
+            ('QueryGeneInformation', QueryGeneInformation.lambda_handler, hgvsg),
+            ('QueryGnomAD', QueryGnomAD.lambda_handler, coordinates),
+            ('QueryPrism', QueryPrism.lambda_handler, coordinates),
+            ('QueryVcfFromAthena', QueryVcfFromAthena.lambda_handler, coordinates)]
+
+def install_clients(clients):
+    """
+    point the handlers at the given Athena and S3 clients
+    """
+    import QueryOncoKb
+    import QueryVcfFromAthena
+    QueryVcfFromAthena.get_client = lambda: clients['athena']
+    QueryOncoKb.get_s3_client = lambda: clients['s3']
+
+def clear_caches():
+    import QueryOncoKb
+    import ResponseCache
+    ResponseCache.clear()
+    with QueryOncoKb._results_lock:
+        QueryOncoKb._results.clear()
+
+def record(args):
+    import boto3
+    import HttpClient
+    fixtures = Fixtures(args.f)
+    install_clients({service: RecordingClient(boto3.client(service), service, fixtures)
+                     for service in ('athena', 's3')})
+    HttpClient.http.request = RecordingHttp(HttpClient.http.request, fixtures)
+    with open(args.v) as infile:
+        variants = json.load(infile)
+    for name, handler, params in load_handlers():
+        for variant in variants:
+            clear_caches()
+            response = handler({'queryStringParameters': params(variant)}, None)
+            print(f"{name} {variant['hgvsg']}: {response['statusCode']}")
+    fixtures.save()
+    print(f"Recorded {sum(len(x) for x in fixtures.http.values())} HTTP and "
+          f"{sum(len(x) for x in fixtures.aws.values())} AWS responses to {args.f}")
+
+def percentile(values, fraction):
+    """
+    nearest-rank percentile of a sorted list
+    """
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))]
+
+def measure(name, calls, iterations, work=1):
+    """
+    time every call the given number of times, then run each once more under tracemalloc.
+    work is the number of items (requests or records) handled by each call.
+    """
+    timings = []
+    for _ in range(iterations):
+        for call in calls:
+            started = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - started)
+    peak = retained = 0
+    tracemalloc.start()
+    for call in calls:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        call()
+        current, call_peak = tracemalloc.get_traced_memory()
+        peak = max(peak, call_peak - before)
+        retained += current - before
+    tracemalloc.stop()
+    timings.sort()
+    return {'name': name,
+            'calls': len(timings),
+            'p50_ms': 1000 * percentile(timings, 0.5),
+            'p90_ms': 1000 * percentile(timings, 0.9),
+            'p99_ms': 1000 * percentile(timings, 0.99),
+            'max_ms': 1000 * timings[-1],
+            'throughput': work * len(timings) / sum(timings),
+            'peak_kib': peak / 1024,
+            'retained_kib': retained / 1024}
+
+def benchmark_handlers(args, clients):
+    with open(args.v) as infile:
+        variants = json.load(infile)
+    results = []
+    for name, handler, params in load_handlers():
+        def invoke(event):
+            if not args.warm:
+                clear_caches()
+            for client in clients.values():
+                client.reset()
+            return handler(event, None)
+        calls = [lambda event={'queryStringParameters': params(variant)}: invoke(event) for variant in variants]
+        results.append(measure(name, calls, args.n))
+    return results
+
+def benchmark_parsers(args):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.clinvar_xml:
+            import ParseClinvarXml
+            xml_args = ParseClinvarXml.parser.parse_args(['-i', args.clinvar_xml, '-o', os.path.join(tmp, 'xml.tsv')])
+            ParseClinvarXml.main(xml_args)
+            with open(xml_args.o) as infile:
+                records = sum(1 for _ in infile)
+            results.append(measure('ParseClinvarXml', [lambda: ParseClinvarXml.main(xml_args)], 3, records))
+        if args.clinvar_vcf:
+            import ParseClinvarVcf
+            vcf_args = ParseClinvarVcf.parser.parse_args(['-i', args.clinvar_vcf, '-o', os.path.join(tmp, 'vcf.tsv')])
+            ParseClinvarVcf.main(vcf_args)
+            with open(vcf_args.o) as infile:
+                records = sum(1 for _ in infile) - 1
+            results.append(measure('ParseClinvarVcf', [lambda: ParseClinvarVcf.main(vcf_args)], 3, records))
+    return results
+
+def report(results):
+    print(f"{'benchmark':22}{'calls':>6}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+          f"{'items/s':>12}{'peak KiB':>11}{'kept KiB':>10}")
+    for x in results:
+        print(f"{x['name']:22}{x['calls']:6d}{x['p50_ms']:10.2f}{x['p90_ms']:10.2f}{x['p99_ms']:10.2f}"
+              f"{x['max_ms']:10.2f}{x['throughput']:12,.1f}{x['peak_kib']:11,.1f}{x['retained_kib']:10,.1f}")
+
+def compare(results, path, tolerance):
+    """
+    returns the benchmarks whose median latency regressed beyond the tolerance
+    """
+    with open(path) as infile:
+        baseline = {x['name']: x for x in json.load(infile)}
+    regressions = []
+    for x in results:
+        before = baseline.get(x['name'])
+        if before and x['p50_ms'] > before['p50_ms'] * (1 + tolerance):
+            regressions.append(f"{x['name']}: median {before['p50_ms']:.2f} ms -> {x['p50_ms']:.2f} ms")
+    return regressions
+
+def run(args):
+    if not os.path.exists(args.f):
+        # the fixture file holds live responses from every upstream and is not part of the repository
+        sys.exit(f"No fixture file at {args.f}. Record one first with 'python BenchmarkHandlers.py record "
+                 f"-f {args.f}', which needs network access, AWS credentials and the OncoKB API_KEY.")
+    import HttpClient
+    fixtures = Fixtures(args.f).load()
+    server = ReplayServer(fixtures)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    HttpClient.UPSTREAM_OVERRIDE = server.url
+    HttpClient.RATE_LIMITED = False
+    clients = {service: StubClient(service, fixtures) for service in ('athena', 's3')}
+    install_clients(clients)
+    try:
+        results = benchmark_handlers(args, clients) + benchmark_parsers(args)
+    finally:
+        server.shutdown()
+    report(results)
+    for key in sorted(fixtures.missing):
+        print(f"Missing fixture: {key}", file=sys.stderr)
+    if args.save:
+        with open(args.save, 'w') as outfile:
+            json.dump(results, outfile, indent=1)
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+def main(args):
+    # the handlers read these at import time or per call; replay never uses them
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-southeast-1')
+    if args.mode == 'record':
+        record(args)
+    else:
+        os.environ.setdefault('API_KEY', 'replay')
+        run(args)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
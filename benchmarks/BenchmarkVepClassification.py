@@ -0,0 +1,171 @@
+"""
+BenchmarkVepClassification.py
+This script compares the in-silico score classification in lambda_functions/QueryVep.py, which reads
+a tool table compiled once per container, with the per-transcript implementation it replaced. It builds
+synthetic VEP transcript consequences, checks that both implementations produce the same output and
+reports the time each takes.
+Usage:
+    python BenchmarkVepClassification.py [-n 60] [--variants 200] [--repeat 5] [--seed 1]
+
+Arguments:
+    -n          Transcript consequences per variant (default: 60)
+    --variants  Variants classified per run (default: 200)
+    --repeat    Timed runs of each implementation; the best is reported (default: 5)
+    --seed      Random seed for the synthetic consequences (default: 1)
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_functions'))
+from QueryVep import TOOLS, process_consequences
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', type=int, default=60, help="Transcript consequences per variant")
+parser.add_argument('--variants', type=int, default=200, help="Variants classified per run")
+parser.add_argument('--repeat', type=int, default=5, help="Timed runs of each implementation")
+parser.add_argument('--seed', type=int, default=1, help="Random seed")
+
+def classify_variant(score, threshold, threshold_type):
+    if threshold_type == "min":
+        if score >= threshold:
+            return "pathogenic"
+    elif threshold_type == "max":
+        if score <= threshold:
+            return "pathogenic"
+    return "neutral"
+
+def classify_set_variant(scores, threshold, threshold_type):
+    try:
+        if threshold_type == "min":
+            if any([float(x) >= threshold for x in scores]):
+                return "pathogenic"
+        elif threshold_type == "max":
+            if any([float(x) <= threshold for x in scores]):
+                return "pathogenic"
+        return "neutral"
+    except ValueError:
+        return "Unknown"
+
+def reference_process_consequence(consequence):
+    """
+    the per-transcript classification QueryVep used before the tool table was precompiled
+    """
+    result_keys = [x.lower() for x in TOOLS.keys()]
+    tool_map = dict(zip(result_keys, TOOLS.keys()))
+    ordered_result_keys = sorted(result_keys)
+    try:
+        nt_change = consequence['hgvsc']
+    except KeyError:
+        pass
+    else:
+        aa_change = consequence.get('hgvsp', 'p.(?)')
+        annotation = []
+        total_predictions = 0
+        total_pathogenic = 0
+        for k in ordered_result_keys:
+            detailed_predictions = {}
+            toolname = tool_map[k]
+            detailed_predictions['id'] = k
+            detailed_predictions['name'] = TOOLS[toolname]['toolname']
+            detailed_predictions['description'] = TOOLS[toolname]['help']
+            detailed_predictions['scores'] = ''
+            detailed_predictions['classification'] = 'Unknown'
+            threshold = TOOLS[toolname]['threshold']
+            threshold_type = TOOLS[toolname]['threshold_type']
+            if k in consequence:
+                v = consequence[k]
+                if v:
+                    if v!='invalid_field':
+                        total_predictions += 1
+                        try:
+                            detailed_predictions['scores'] = set([x for x in v.split(',') if x!="."])
+                            classification = classify_set_variant(detailed_predictions['scores'], 
+                                            threshold, 
+                                            threshold_type)
+                            detailed_predictions['scores'] = ",".join(detailed_predictions['scores'])
+                        except AttributeError:
+                            detailed_predictions['scores'] = v
+                            classification = classify_variant(v, threshold, threshold_type)
+                        if classification == "pathogenic":
+                            total_pathogenic += 1
+                        if classification in ["pathogenic", "neutral"]:
+                            detailed_predictions['classification'] = classification
+            annotation.append(detailed_predictions)
+        return {'hgvsc': nt_change, 
+                'hgvsp': aa_change, 
+                'predictions': annotation,
+                'total_predictions': total_predictions,
+                'total_pathogenic': total_pathogenic,
+                'percent_pathogenic': "{:.2f}%".format(100*total_pathogenic/total_predictions if total_predictions else 0)
+                }
+
+def reference_process_consequences(consequences):
+    annotations = [reference_process_consequence(consequence) for consequence in consequences]
+    return [x for x in annotations if x]
+
+def random_score(rng):
+    """
+    a dbNSFP style score field, including the edge cases seen in VEP output
+    """
+    kind = rng.random()
+    if kind < 0.1:
+        return None
+    if kind < 0.15:
+        return "."
+    if kind < 0.18:
+        return "invalid_field"
+    if kind < 0.2:
+        return "nan"
+    if kind < 0.21:
+        return "0.1,,0.2"
+    if kind < 0.3:
+        return round(rng.uniform(-3, 30), 3)
+    return ",".join(rng.choice([".", f"{rng.uniform(-3, 1):.3f}"]) for _ in range(rng.randint(1, 4)))
+
+def make_variants(args):
+    rng = random.Random(args.seed)
+    variants = []
+    for i in range(args.variants):
+        consequences = []
+        for j in range(args.n):
+            consequence = {'hgvsc': f"NM_{i:06d}.{j}:c.{rng.randint(1, 5000)}A>G"}
+            if rng.random() < 0.9:
+                consequence['hgvsp'] = f"NP_{i:06d}.{j}:p.Lys{rng.randint(1, 1500)}Arg"
+            for key in TOOLS:
+                score = random_score(rng)
+                if score is not None:
+                    consequence[key.lower()] = score
+            consequences.append(consequence)
+        # consequences without hgvsc are skipped
+        consequences.append({'gene_symbol': 'TEST'})
+        variants.append(consequences)
+    return variants
+
+def best_time(function, variants, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for consequences in variants:
+            function(consequences)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def main(args):
+    variants = make_variants(args)
+    for consequences in variants:
+        if process_consequences(consequences) != reference_process_consequences(consequences):
+            sys.exit("Classification differs from the reference implementation")
+    reference = best_time(reference_process_consequences, variants, args.repeat)
+    precompiled = best_time(process_consequences, variants, args.repeat)
+    consequences = args.variants * args.n
+    print(f"{args.variants} variants x {args.n} consequences, output identical")
+    for name, elapsed in (("reference", reference), ("precompiled", precompiled)):
+        print(f"{name + ':':12}{elapsed * 1000:8.1f} ms  {consequences / elapsed:10,.0f} consequences/s  "
+              f"{reference / elapsed:5.2f}x")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,70 @@
+"""
+BenchmarkVepPayload.py
+This script compares the size and serialization time of the verbose and compact QueryVep response
+formats for synthetic VEP transcript consequences, and checks that both carry the same classifications.
+Usage:
+    python BenchmarkVepPayload.py [-n 60] [--variants 20] [--repeat 5] [--seed 1]
+
+Arguments:
+    -n          Transcript consequences per variant (default: 60)
+    --variants  Variants in the batch response (default: 20)
+    --repeat    Timed runs of each format; the best is reported (default: 5)
+    --seed      Random seed for the synthetic consequences (default: 1)
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_functions'))
+from BenchmarkVepClassification import make_variants
+from QueryVep import CLASSIFICATIONS, compact_body, compact_consequences, process_consequences
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', type=int, default=60, help="Transcript consequences per variant")
+parser.add_argument('--variants', type=int, default=20, help="Variants in the batch response")
+parser.add_argument('--repeat', type=int, default=5, help="Timed runs of each format")
+parser.add_argument('--seed', type=int, default=1, help="Random seed")
+
+def verbose_response(variants):
+    return json.dumps({f"variant{i}": process_consequences(x) for i, x in enumerate(variants)})
+
+def compact_response(variants):
+    return json.dumps(compact_body(results={f"variant{i}": compact_consequences(x) for i, x in enumerate(variants)}))
+
+def check(variants):
+    for consequences in variants:
+        for verbose, compact in zip(process_consequences(consequences), compact_consequences(consequences)):
+            if ([x['classification'] for x in verbose['predictions']] !=
+                    [CLASSIFICATIONS[x] for x in compact['classifications']] or
+                    verbose['total_pathogenic'] != compact['total_pathogenic'] or
+                    verbose['total_predictions'] != compact['total_predictions']):
+                sys.exit(f"Compact response differs for {verbose['hgvsc']}")
+
+def best_time(function, variants, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = function(variants)
+        timings.append(time.perf_counter() - started)
+    return min(timings), body
+
+def main(args):
+    variants = make_variants(args)
+    check(variants)
+    print(f"{args.variants} variants x {args.n} consequences, classifications identical")
+    results = [(name, *best_time(function, variants, args.repeat))
+               for name, function in (("verbose", verbose_response), ("compact", compact_response))]
+    _, verbose_time, verbose = results[0]
+    for name, elapsed, body in results:
+        raw = body.encode('utf-8')
+        compressed = gzip.compress(raw)
+        print(f"{name + ':':9}{len(raw):12,} bytes  {len(compressed):10,} gzipped  "
+              f"{len(raw) / len(verbose):6.1%} of verbose  {elapsed * 1000:8.1f} ms to build and serialize  "
+              f"{verbose_time / elapsed:5.2f}x")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
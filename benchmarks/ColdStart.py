@@ -0,0 +1,109 @@
+"""
+ColdStart.py
+This script measures the cold start of every lambda handler: the time to import the handler module and
+the time its initialize() takes to build the clients, pools and lookup tables that are otherwise created
+lazily by the first request. Each measurement runs in a fresh interpreter, like a new Lambda container.
+It exits with status 1 if the median import plus init time of a handler exceeds its budget.
+Usage:
+    python ColdStart.py [-n 5] [--budget QueryVep=800 ...] [--slowest 3]
+
+Arguments:
+    -n         Fresh interpreters per handler; the median is reported (default: 5)
+    --budget   Override the budget of a handler in milliseconds, e.g. QueryVep=800 (repeatable)
+    --slowest  Slowest imports of each handler module to list, from python -X importtime (default: 3)
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+LAMBDA_FUNCTIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_functions')
+
+# import plus init budget per handler in milliseconds. initialize() creates the boto3 clients,
+# which is most of the OncoKB, Athena and aggregator budgets.
+BUDGETS = {
+    'QueryVep': 800,
+    'QueryOncoKb': 1500,
+    'QueryGeneInformation': 400,
+    'QueryGnomAD': 400,
+    'QueryPrism': 400,
+    'QueryVcfFromAthena': 1500,
+    'QueryAggregator': 3000,
+}
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', type=int, default=5, help="Fresh interpreters per handler")
+parser.add_argument('--budget', action='append', default=[], help="Budget override, e.g. QueryVep=800")
+parser.add_argument('--slowest', type=int, default=3, help="Slowest imports to list per handler")
+
+MEASURE = """
+import json, sys, time
+sys.path.insert(0, {path!r})
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+{module}.initialize()
+initialized = time.perf_counter()
+print(json.dumps({{'import_ms': 1000 * (imported - started), 'init_ms': 1000 * (initialized - imported)}}))
+"""
+
+def run(module, importtime=False):
+    """
+    import and initialize a handler in a fresh interpreter.
+    returns the import and init times in milliseconds and the interpreter's stderr.
+    """
+    env = dict(os.environ)
+    # clients are created but never used, so any region will do
+    env.setdefault('AWS_DEFAULT_REGION', 'ap-southeast-1')
+    env.pop('EAGER_INIT', None)
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else [])
+    result = subprocess.run(command + ['-c', MEASURE.format(path=LAMBDA_FUNCTIONS, module=module)],
+                            capture_output=True, text=True, env=env)
+    lines = result.stderr.splitlines()
+    if result.returncode != 0:
+        errors = "\n".join(x for x in lines if not x.startswith('import time:'))
+        raise RuntimeError(f"{module} failed to start:\n{errors}")
+    return json.loads(result.stdout.strip().splitlines()[-1]), lines
+
+def slowest_imports(module, count):
+    """
+    returns the slowest modules imported directly by a handler module, as (milliseconds, name).
+    importtime slows the interpreter down, so this is a separate run from the timed ones.
+    """
+    _, lines = run(module, importtime=True)
+    imports = []
+    for line in lines:
+        # import time: self [us] | cumulative | imported package, indented two spaces per level
+        if not line.startswith('import time:') or line.count('|') != 2:
+            continue
+        _, cumulative, package = line.split('|')
+        if package.startswith('   ') and not package.startswith('    ') and cumulative.strip().isdigit():
+            imports.append((int(cumulative) / 1000, package.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+def main(args):
+    budgets = dict(BUDGETS)
+    for budget in args.budget:
+        name, _, value = budget.partition('=')
+        budgets[name] = float(value)
+    failures = []
+    print(f"{'handler':22}{'import ms':>11}{'init ms':>10}{'total ms':>10}{'budget ms':>11}  slowest imports")
+    for module, budget in budgets.items():
+        runs = [run(module)[0] for _ in range(args.n)]
+        imported = statistics.median(x['import_ms'] for x in runs)
+        initialized = statistics.median(x['init_ms'] for x in runs)
+        total = imported + initialized
+        slowest = ", ".join(f"{package} {ms:.0f}" for ms, package in slowest_imports(module, args.slowest))
+        print(f"{module:22}{imported:11.1f}{initialized:10.1f}{total:10.1f}{budget:11.0f}  {slowest}")
+        if total > budget:
+            failures.append(f"{module}: {total:.1f} ms exceeds its budget of {budget:.0f} ms")
+    for failure in failures:
+        print(f"Over budget: {failure}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
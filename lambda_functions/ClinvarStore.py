@@ -0,0 +1,115 @@
+from bisect import bisect_left
+from MappedStore import MappedStore
+
+"""
+ClinvarStore Module
+This module serves ClinVar lookups from a local, coordinate-sorted store built by utils/BuildClinvarStore.py
+from the TSV written by ParseClinvarVcf.py or ParseClinvarXml.py.
+Records are kept as TSV lines in blocks of BLOCK_SIZE records. The block index holds the first
+(chromosome, position) key and the byte offset of every block, so a lookup is a binary search over the
+index followed by a scan of at most a few blocks.
+Functions:
+    normalize_chromosome(chrom: str) -> str:
+        Strips the chr prefix and maps M to MT.
+    chromosome_order(chrom: str) -> tuple:
+        Sort key that orders chromosomes 1-22, X, Y, MT, then other contigs.
+    position_bin(position: int) -> int:
+        The pos_bin partition of a position in the Parquet table.
+    read_tsv_rows(infile: str) -> generator:
+        The eight columns of each record of a ClinVar TSV, skipping the header and records without
+        coordinates. Shared by the store, Parquet and delta builds in utils/ so they agree on the rows.
+Classes:
+    ClinvarStore(path: str):
+        lookup(chrom, position, reference, alternate) -> list of exact matches.
+        region(chrom, start, end) -> list of records in chrom:start-end (inclusive).
+"""
+
+STORE_KIND = 'clinvar'
+BLOCK_SIZE = 64
+COLUMNS = ('chrom', 'position', 'reference', 'alternate',
+           'variation_id', 'assertions', 'review_status', 'disease')
+# width of the pos_bin partitions of the Parquet table written by utils/ClinvarParquet.py
+POSITION_BIN_SIZE = 10000000
+
+def normalize_chromosome(chrom):
+    chrom = str(chrom)
+    if chrom.lower().startswith('chr'):
+        chrom = chrom[3:]
+    chrom = chrom.upper()
+    return 'MT' if chrom == 'M' else chrom
+
+def chromosome_order(chrom):
+    if chrom.isdigit():
+        return (0, int(chrom), chrom)
+    return (1, ['X', 'Y', 'MT'].index(chrom), chrom) if chrom in ('X', 'Y', 'MT') else (2, 0, chrom)
+
+def position_bin(position):
+    return int(position) // POSITION_BIN_SIZE
+
+def read_tsv_rows(infile):
+    with open(infile, encoding='utf-8') as tsv:
+        for line in tsv:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 8 or not fields[1].isdigit():
+                continue
+            yield fields[:8]
+
+def encode_key(chrom_code, position):
+    return (chrom_code << 32) | position
+
+class ClinvarStore:
+    def __init__(self, path):
+        self._store = MappedStore(path, STORE_KIND)
+        self.chromosomes = {c: i for i, c in enumerate(self._store.metadata['chromosomes'])}
+        self._block_keys = self._store.section('block_keys')
+        self._block_offsets = self._store.section('block_offsets')
+        self._data = self._store.section('data')
+
+    def __len__(self):
+        return self._store.metadata['records']
+
+    def _block(self, index):
+        block = self._data[self._block_offsets[index]:self._block_offsets[index + 1]]
+        # records are written one per line with '\n' only; splitlines would also break on
+        # \x1c-\x1e, \x85 and \u2028 inside a disease name. Blocks end with '\n', so drop the last ''.
+        lines = bytes(block).decode('utf-8').split('\n')
+        lines.pop()
+        for line in lines:
+            chrom, position, _ = line.split('\t', 2)
+            yield chrom, int(position), line
+
+    def _scan(self, chrom, start, end):
+        code = self.chromosomes.get(normalize_chromosome(chrom))
+        if code is None:
+            return
+        first, last = encode_key(code, start), encode_key(code, end)
+        # records sharing a key can spill over from the previous block
+        index = max(bisect_left(self._block_keys, first) - 1, 0)
+        while index < len(self._block_keys) and self._block_keys[index] <= last:
+            for record_chrom, position, line in self._block(index):
+                key = encode_key(self.chromosomes[record_chrom], position)
+                if key < first:
+                    continue
+                if key > last:
+                    return
+                yield line.split('\t')
+            index += 1
+
+    def lookup(self, chrom, position, reference, alternate):
+        """
+        returns every record matching (chrom, position, reference, alternate)
+        as a dictionary keyed by COLUMNS.
+        """
+        chrom = normalize_chromosome(chrom)
+        position = int(position)
+        reference, alternate = reference.upper(), alternate.upper()
+        return [dict(zip(COLUMNS, record)) for record in self._scan(chrom, position, position)
+                if record[2].upper() == reference and record[3].upper() == alternate]
+
+    def region(self, chrom, start, end):
+        """
+        returns every record in chrom:start-end (inclusive)
+        as a dictionary keyed by COLUMNS.
+        """
+        chrom = normalize_chromosome(chrom)
+        return [dict(zip(COLUMNS, record)) for record in self._scan(chrom, int(start), int(end))]
@@ -0,0 +1,49 @@
+from bisect import bisect_right
+from ClinvarStore import encode_key, normalize_chromosome
+from MappedStore import MappedStore
+
+"""
+GeneIntervalStore Module
+This module finds the genes overlapping a position from a local store built by utils/BuildGeneIndex.py
+from a RefSeq or Ensembl GTF. Genes are sorted by their (chromosome, start) key next to their end keys
+and the running maximum of the end keys, so an overlap query is a binary search followed by a backward
+scan that stops as soon as no earlier gene can reach the query. The store is memory-mapped and shared
+between processes without copying.
+Classes:
+    GeneIntervalStore(path: str):
+        overlapping(chrom, start, end) -> list of {'symbol', 'entrez'} dictionaries of the genes
+        overlapping chrom:start-end (inclusive), ordered by gene start.
+"""
+
+STORE_KIND = 'gene_intervals'
+
+class GeneIntervalStore:
+    def __init__(self, path):
+        self._store = MappedStore(path, STORE_KIND)
+        self.metadata = self._store.metadata
+        self.chromosomes = {c: i for i, c in enumerate(self.metadata['chromosomes'])}
+        for name in ('starts', 'ends', 'max_ends', 'name_offsets', 'names'):
+            setattr(self, f'_{name}', self._store.section(name))
+
+    def __len__(self):
+        return len(self._starts)
+
+    def _gene(self, index):
+        name = bytes(self._names[self._name_offsets[index]:self._name_offsets[index + 1]]).decode('utf-8')
+        symbol, _, entrez = name.partition('\t')
+        return {'symbol': symbol, 'entrez': entrez or None}
+
+    def overlapping(self, chrom, start, end=None):
+        code = self.chromosomes.get(normalize_chromosome(chrom))
+        if code is None:
+            return []
+        first = encode_key(code, int(start))
+        last = encode_key(code, int(start if end is None else end))
+        index = bisect_right(self._starts, last) - 1
+        found = []
+        # max_ends is non-decreasing, so once it falls below the query no earlier gene overlaps it
+        while index >= 0 and self._max_ends[index] >= first:
+            if self._ends[index] >= first:
+                found.append(index)
+            index -= 1
+        return [self._gene(index) for index in reversed(found)]
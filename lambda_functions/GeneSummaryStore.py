@@ -0,0 +1,64 @@
+from bisect import bisect_left
+from MappedStore import MappedStore
+
+"""
+GeneSummaryStore Module
+This module answers NCBI Gene summary lookups from a local store built by utils/BuildGeneSummaryStore.py.
+Entrez Gene IDs are sorted for binary search and the summaries are UTF-8 text in one data section, so
+the store is memory-mapped and shared between processes without copying. Genes that NCBI has no summary
+for are stored with an empty summary, which tells them apart from genes missing from the store.
+Classes:
+    GeneSummaryStore(path: str):
+        get(gene_id) -> summary, '' if the gene has no summary, or None if it is not in the store.
+        get_many(gene_ids) -> dictionary of gene ID -> summary for the genes in the store.
+"""
+
+STORE_KIND = 'gene_summary'
+
+def entrez_id(gene_id):
+    """
+    returns a gene ID as an integer, or None if it is not an Entrez Gene ID (e.g. an Ensembl ID)
+    """
+    try:
+        return int(gene_id)
+    except (TypeError, ValueError):
+        return None
+
+class GeneSummaryStore:
+    def __init__(self, path):
+        self._store = MappedStore(path, STORE_KIND)
+        self.metadata = self._store.metadata
+        self._ids = self._store.section('ids')
+        self._offsets = self._store.section('offsets')
+        self._data = self._store.section('data')
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _summary(self, index):
+        return bytes(self._data[self._offsets[index]:self._offsets[index + 1]]).decode('utf-8')
+
+    def get(self, gene_id):
+        key = entrez_id(gene_id)
+        if key is None:
+            return None
+        index = bisect_left(self._ids, key)
+        if index < len(self._ids) and self._ids[index] == key:
+            return self._summary(index)
+        return None
+
+    def get_many(self, gene_ids):
+        """
+        resolves many genes in one forward pass over the sorted IDs: each
+        search starts where the previous one ended.
+        """
+        results = {}
+        index = 0
+        requested = sorted(((entrez_id(x), x) for x in gene_ids if entrez_id(x) is not None), key=lambda x: x[0])
+        for key, gene_id in requested:
+            index = bisect_left(self._ids, key, index)
+            if index == len(self._ids):
+                break
+            if self._ids[index] == key:
+                results[gene_id] = self._summary(index)
+        return results
@@ -0,0 +1,69 @@
+from bisect import bisect_left
+from ClinvarStore import encode_key, normalize_chromosome
+from MappedStore import MappedStore
+
+"""
+GnomadStore Module
+This module answers gnomAD allele frequency lookups from a local store built by utils/BuildGnomadStore.py
+from a gnomAD sites VCF. Variants are sorted by (chromosome, position) key for binary search, and every
+field is a column of fixed-width values, so the store is memory-mapped and shared between processes
+without copying.
+Classes:
+    GnomadStore(path: str):
+        lookup(chrom, position, reference, alternate) -> dict in the shape of the gnomAD API
+        exome/genome selection, or None if the variant is not in the store.
+"""
+
+STORE_KIND = 'gnomad'
+MISSING_POPULATION = -1
+
+class GnomadStore:
+    def __init__(self, path):
+        self._store = MappedStore(path, STORE_KIND)
+        metadata = self._store.metadata
+        self.dataset = metadata['dataset']
+        self.data_type = metadata['data_type']
+        self.populations = metadata['populations']
+        self.chromosomes = {c: i for i, c in enumerate(metadata['chromosomes'])}
+        for name in ('keys', 'allele_offsets', 'alleles', 'ac', 'an', 'af', 'ac_hom', 'ac_hemi',
+                     'population_ac', 'population_an', 'faf99_popmax', 'faf99_popmax_population'):
+            setattr(self, f'_{name}', self._store.section(name))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _find(self, chrom, position, reference, alternate):
+        code = self.chromosomes.get(normalize_chromosome(chrom))
+        if code is None:
+            return None
+        key = encode_key(code, int(position))
+        allele = f"{reference.upper()}\t{alternate.upper()}".encode('utf-8')
+        index = bisect_left(self._keys, key)
+        while index < len(self._keys) and self._keys[index] == key:
+            if self._alleles[self._allele_offsets[index]:self._allele_offsets[index + 1]] == allele:
+                return index
+            index += 1
+        return None
+
+    def lookup(self, chrom, position, reference, alternate):
+        index = self._find(chrom, position, reference, alternate)
+        if index is None:
+            return None
+        prefix = self.data_type
+        width = len(self.populations)
+        population_ac = self._population_ac[index * width:(index + 1) * width]
+        population_an = self._population_an[index * width:(index + 1) * width]
+        popmax = self._faf99_popmax[index]
+        popmax_population = self._faf99_popmax_population[index]
+        return {f'{prefix}_af': self._af[index],
+                f'{prefix}_ac': self._ac[index],
+                f'{prefix}_an': self._an[index],
+                f'{prefix}_ac_hemi': self._ac_hemi[index],
+                f'{prefix}_ac_hom': self._ac_hom[index],
+                f'{prefix}_faf': {
+                    # NaN marks a missing filtering allele frequency
+                    'popmax': popmax if popmax == popmax else None,
+                    'popmax_population': (None if popmax_population == MISSING_POPULATION
+                                          else self.populations[popmax_population])},
+                'populations': [{'id': population, 'ac': ac, 'an': an}
+                                for population, ac, an in zip(self.populations, population_ac, population_an)]}
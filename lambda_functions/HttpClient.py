@@ -0,0 +1,237 @@
+import json
+import os
+import random
+import threading
+import time
+import urllib3
+from urllib.parse import urlsplit
+from Metrics import count, deadline, record, span
+
+"""
+HttpClient Module
+This module provides the HTTP client shared by every lambda. One pool of keep-alive connections per host
+is kept for the life of a warm container, every request has connect and read timeouts, 429 and 5xx
+responses and connection errors are retried with jittered exponential backoff, and a per-host token
+bucket paces requests using the upstream's X-RateLimit-* and Retry-After headers. Every wait is capped
+at MAX_WAIT, and the attempts, backoff and rate limit waits of one request all fit in REQUEST_BUDGET,
+under API Gateway's 29 s integration timeout. Within a handler they also fit in what is left of the
+invocation's deadline (Metrics.deadline), so a handler chaining calls, e.g. VEP then OncoKB, still answers
+in time, and a request made after the deadline is not sent. A request that still fails, on a timeout or a
+connection error, returns a 504 response whose JSON body carries the error, so handlers answer it with the
+same responses as any other upstream failure.
+Classes:
+    TokenBucket(rate: float, capacity: float):
+        Paces requests to one host.
+    SharedClient():
+        request(method: str, url: str, **kwargs) -> urllib3.HTTPResponse:
+            Drop-in replacement for urllib3.PoolManager().request that never raises urllib3 errors.
+        initialize() -> urllib3.PoolManager:
+            Creates the pool, which is otherwise created by the first request.
+    upstream_url(url: str) -> str:
+        Rewrites an upstream URL to UPSTREAM_OVERRIDE, if set.
+Objects:
+    http: The SharedClient instance used by the handlers.
+"""
+
+CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3))
+READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 10))
+RETRIES = int(os.environ.get('HTTP_RETRIES', 2))
+# seconds one request may take across all of its attempts, leaving the handler time to answer
+# within API Gateway's 29 s limit
+REQUEST_BUDGET = float(os.environ.get('HTTP_REQUEST_BUDGET', 24))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+BACKOFF_FACTOR = 0.5
+# connections kept open per host
+POOL_SIZE = 10
+# longest a request waits for its rate limit, or for a Retry-After, before it is sent anyway
+MAX_WAIT = 10
+# status of the response returned when every attempt timed out or failed to connect
+FAILED_STATUS = 504
+
+# requests per second and burst size until the upstream reports its own limits.
+# Ensembl allows 55,000 requests per hour and NCBI E-utilities 3 per second without a key.
+RATE_LIMITS = {
+    'grch37.rest.ensembl.org': (15, 15),
+    'eutils.ncbi.nlm.nih.gov': (3, 3),
+    'gnomad.broadinstitute.org': (10, 10),
+    'www.oncokb.org': (20, 20),
+    'beacon.prism-genomics.org': (10, 10),
+}
+DEFAULT_RATE_LIMIT = (20, 20)
+# metric span names of the upstreams; other hosts are reported by host name
+UPSTREAM_NAMES = {
+    'grch37.rest.ensembl.org': 'vep',
+    'eutils.ncbi.nlm.nih.gov': 'ncbi',
+    'gnomad.broadinstitute.org': 'gnomad',
+    'www.oncokb.org': 'oncokb',
+    'beacon.prism-genomics.org': 'prism',
+}
+RATE_LIMITED = os.environ.get('HTTP_RATE_LIMITED', '1') != '0'
+
+# send every upstream request to one base URL instead, e.g. the replay server of
+# benchmarks/BenchmarkHandlers.py: https://host/path becomes {UPSTREAM_OVERRIDE}/host/path
+UPSTREAM_OVERRIDE = os.environ.get('HTTP_UPSTREAM_OVERRIDE')
+
+def header_float(headers, name):
+    try:
+        return float(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, max_wait=MAX_WAIT):
+        """
+        wait for a token, or at most max_wait seconds. returns the seconds spent waiting
+        """
+        deadline = time.monotonic() + min(max_wait, MAX_WAIT)
+        waited = 0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.blocked_until > now:
+                    wait = self.blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def observe(self, status, headers):
+        """
+        adjust the bucket to the limits reported by the upstream
+        """
+        limit = header_float(headers, 'X-RateLimit-Limit')
+        period = header_float(headers, 'X-RateLimit-Period')
+        remaining = header_float(headers, 'X-RateLimit-Remaining')
+        reset = header_float(headers, 'X-RateLimit-Reset')
+        retry_after = header_float(headers, 'Retry-After')
+        with self._lock:
+            now = time.monotonic()
+            if limit and period:
+                self.rate = limit / period
+            if remaining is not None:
+                self.tokens = min(self.tokens, remaining)
+                if remaining < 1 and reset:
+                    self.blocked_until = max(self.blocked_until, now + reset)
+            if status == 429 and retry_after:
+                self.blocked_until = max(self.blocked_until, now + min(retry_after, MAX_WAIT))
+
+def upstream_url(url):
+    if not UPSTREAM_OVERRIDE:
+        return url
+    parts = urlsplit(url)
+    query = f"?{parts.query}" if parts.query else ""
+    return f"{UPSTREAM_OVERRIDE.rstrip('/')}/{parts.netloc}{parts.path}{query}"
+
+def retry_wait(attempt, response):
+    """
+    seconds to wait before the next attempt: jittered exponential backoff, or the
+    upstream's Retry-After if it is longer, capped at MAX_WAIT
+    """
+    wait = BACKOFF_FACTOR * (2 ** attempt) * random.uniform(0.5, 1.5)
+    if response is not None:
+        retry_after = header_float(response.headers, 'Retry-After')
+        if retry_after:
+            wait = max(wait, retry_after)
+    return min(wait, MAX_WAIT)
+
+def failed_response(error):
+    """
+    a response standing in for a request that timed out or could not connect
+    """
+    body = json.dumps({"error": str(error), "errors": [{"message": f"Upstream request failed: {error}"}]})
+    return urllib3.HTTPResponse(body=body.encode('utf-8'), status=FAILED_STATUS,
+                                headers={'Content-Type': 'application/json'}, preload_content=True)
+
+class SharedClient:
+    def __init__(self):
+        self._pool = None
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    # retries are made by request(), which keeps them within REQUEST_BUDGET;
+                    # urllib3 only follows redirects
+                    self._pool = urllib3.PoolManager(
+                        maxsize=POOL_SIZE,
+                        timeout=urllib3.Timeout(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT),
+                        retries=urllib3.Retry(total=3, connect=0, read=0, status=0, raise_on_redirect=False,
+                                              respect_retry_after_header=False, raise_on_status=False))
+        return self._pool
+
+    def initialize(self):
+        """
+        create the connection pool ahead of the first request
+        """
+        return self.pool
+
+    def bucket(self, host):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.setdefault(host, TokenBucket(*RATE_LIMITS.get(host, DEFAULT_RATE_LIMIT)))
+        return bucket
+
+    def request(self, method, url, **kwargs):
+        host = urlsplit(url).hostname
+        name = UPSTREAM_NAMES.get(host, host)
+        request_deadline = time.monotonic() + REQUEST_BUDGET
+        if deadline() is not None:
+            request_deadline = min(request_deadline, deadline())
+            if request_deadline <= time.monotonic():
+                count(f"{name}.failed")
+                return failed_response(TimeoutError("Invocation deadline exceeded before the request was sent"))
+        for attempt in range(RETRIES + 1):
+            if RATE_LIMITED:
+                bucket = self.bucket(host)
+                waited = bucket.acquire(max(0, request_deadline - time.monotonic() - CONNECT_TIMEOUT))
+                if waited:
+                    record(f"{name}.throttled", waited)
+            remaining = max(0.1, request_deadline - time.monotonic())
+            response = error = None
+            try:
+                with span(name):
+                    # every upstream call is a read, so POSTs are retried too
+                    response = self.pool.request(method, upstream_url(url),
+                                                 timeout=urllib3.Timeout(connect=min(CONNECT_TIMEOUT, remaining),
+                                                                         read=min(READ_TIMEOUT, remaining)),
+                                                 **kwargs)
+            except urllib3.exceptions.HTTPError as e:
+                error = e
+            if response is not None:
+                if RATE_LIMITED:
+                    bucket.observe(response.status, response.headers)
+                if response.status not in RETRY_STATUSES:
+                    return response
+            wait = retry_wait(attempt, response)
+            # a retry that cannot finish within the budget is not started
+            if attempt == RETRIES or time.monotonic() + wait + CONNECT_TIMEOUT >= request_deadline:
+                break
+            time.sleep(wait)
+        if response is not None:
+            return response
+        count(f"{name}.failed")
+        return failed_response(error)
+
+http = SharedClient()
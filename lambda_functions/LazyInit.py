@@ -0,0 +1,39 @@
+import functools
+import os
+import threading
+
+"""
+LazyInit Module
+This module supports cold-start friendly initialization. Heavy objects such as boto3 clients, memory-mapped
+stores and lookup tables are built on first use rather than at import, exactly once per container even when
+the aggregator calls several handlers from its threads. Setting EAGER_INIT=1 makes the handlers build
+everything during the Lambda init phase instead (useful with provisioned concurrency).
+Functions:
+    once(factory: callable) -> callable:
+        Decorator for a zero-argument factory whose result is created on the first call and then reused.
+        The decorated function's reset() drops the result, so the next call creates it again.
+    eager_init() -> bool:
+        Whether handlers should initialize at import.
+"""
+
+def once(factory):
+    lock = threading.Lock()
+    result = []
+
+    @functools.wraps(factory)
+    def get():
+        if not result:
+            with lock:
+                if not result:
+                    result.append(factory())
+        return result[0]
+
+    def reset():
+        with lock:
+            result.clear()
+
+    get.reset = reset
+    return get
+
+def eager_init():
+    return os.environ.get('EAGER_INIT') == '1'
@@ -0,0 +1,91 @@
+import json
+import mmap
+import os
+import shutil
+import struct
+
+"""
+MappedStore Module
+This module provides the on-disk layout shared by the local lookup stores. A store is a single file
+made of a JSON header followed by 8-byte aligned binary sections, so it can be memory-mapped from /tmp
+or a lambda layer and read without copying.
+Layout:
+    MAGIC (8 bytes) | header length (uint32) | JSON header | padding | section | padding | section ...
+Functions:
+    write_store(path: str, kind: str, metadata: dict, sections: list):
+        Writes (name, typecode, data) sections and the metadata to a store file. Data is an array, bytes
+        or a binary file, which is copied without being read into memory.
+Classes:
+    MappedStore(path: str, kind: str):
+        Memory-maps a store file and exposes each section as a typed memoryview.
+"""
+
+MAGIC = b'VAGSTORE'
+ALIGNMENT = 8
+
+def padding(offset):
+    return -offset % ALIGNMENT
+
+def write_store(path, kind, metadata, sections):
+    """
+    Writes a store file.
+    Args:
+        path (str): Output file.
+        kind (str): Store type, checked when the store is opened.
+        metadata (dict): JSON-serializable metadata for the store.
+        sections (list): (name, typecode, data) tuples. data is an array.array, bytes, or a binary
+            file object opened for reading, whose remaining content is the section.
+    """
+    layout = {}
+    offset = 0
+    blobs = []
+    for name, typecode, data in sections:
+        if hasattr(data, 'read'):
+            length = os.fstat(data.fileno()).st_size - data.tell()
+        else:
+            data = bytes(data) if isinstance(data, (bytes, bytearray, memoryview)) else data.tobytes()
+            length = len(data)
+        offset += padding(offset)
+        layout[name] = [offset, length, typecode]
+        blobs.append((offset, data))
+        offset += length
+    header = json.dumps({'kind': kind, 'metadata': metadata, 'sections': layout}).encode('utf-8')
+    start = len(MAGIC) + 4 + len(header)
+    start += padding(start)
+    with open(path, 'wb') as outfile:
+        outfile.write(MAGIC)
+        outfile.write(struct.pack('<I', len(header)))
+        outfile.write(header)
+        outfile.write(b'\0' * (start - outfile.tell()))
+        for offset, data in blobs:
+            outfile.write(b'\0' * (start + offset - outfile.tell()))
+            if hasattr(data, 'read'):
+                shutil.copyfileobj(data, outfile, 1024 * 1024)
+            else:
+                outfile.write(data)
+
+class MappedStore:
+    """
+    Read-only view of a store file. Sections are shared between processes
+    through the page cache and are never copied into the python heap.
+    """
+    def __init__(self, path, kind):
+        with open(path, 'rb') as infile:
+            self._mmap = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a variant aggregator store")
+        header_length, = struct.unpack_from('<I', self._mmap, len(MAGIC))
+        header_start = len(MAGIC) + 4
+        header = json.loads(self._mmap[header_start:header_start + header_length])
+        if header['kind'] != kind:
+            raise ValueError(f"{path} is a {header['kind']} store, expected {kind}")
+        self.metadata = header['metadata']
+        self._start = header_start + header_length
+        self._start += padding(self._start)
+        self._sections = header['sections']
+        self._view = memoryview(self._mmap)
+
+    def section(self, name):
+        offset, length, typecode = self._sections[name]
+        view = self._view[self._start + offset:self._start + offset + length]
+        return view if typecode == 'B' else view.cast(typecode)
@@ -0,0 +1,163 @@
+import contextvars
+import functools
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+"""
+Metrics Module
+This module times upstream calls and processing stages in spans and reports them once per invocation as a
+CloudWatch embedded metric format (EMF) log line, so CloudWatch extracts one metric per span without any
+API calls. With SERVER_TIMING=1 the spans are also returned in a Server-Timing response header, which the
+browser's developer tools show next to the request. Spans are collected per invocation (per thread for the
+aggregator's sources) and cost two clock reads and a dictionary update each.
+Functions:
+    span(name: str):
+        Context manager timing a block. Repeated spans with the same name are summed.
+    timed(name: str):
+        Decorator timing every call of a function as a span.
+    record(name: str, seconds: float):
+        Adds a measured duration to the current invocation.
+    count(name: str, value: int):
+        Adds to a counter of the current invocation, e.g. cache hits, reported with the Count unit.
+    instrumented_handler(name: str):
+        Decorator for a lambda_handler that collects its spans and emits them when it returns. It also sets
+        the invocation's deadline, which HttpClient keeps every upstream call of the invocation within.
+    deadline() -> float:
+        The time.monotonic() by which the current invocation's upstream calls must finish, None outside of a handler.
+"""
+
+ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'VariantAggregator')
+# EMF lines go to stdout, which Lambda forwards to CloudWatch Logs
+LOG_STREAM = sys.stdout
+
+# span name -> [seconds, count] for the invocation in progress, None outside of a handler
+_spans = contextvars.ContextVar('spans', default=None)
+# counter name -> value for the invocation in progress
+_counts = contextvars.ContextVar('counts', default=None)
+# seconds all the upstream calls of one invocation may take together, e.g. VEP then OncoKB,
+# leaving the handler time to answer within API Gateway's 29 s integration timeout
+INVOCATION_BUDGET = float(os.environ.get('INVOCATION_BUDGET', 25))
+# seconds kept back from the Lambda's own remaining time to return the response
+RESPONSE_MARGIN = 1
+# time.monotonic() deadline of the invocation in progress
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+def deadline():
+    return _deadline.get()
+
+def invocation_deadline(context):
+    """
+    INVOCATION_BUDGET from now, or earlier if the Lambda itself or an enclosing handler,
+    e.g. the aggregator's, has less time left
+    """
+    now = time.monotonic()
+    limits = [now + INVOCATION_BUDGET]
+    remaining_time = getattr(context, 'get_remaining_time_in_millis', None)
+    if remaining_time is not None:
+        limits.append(now + remaining_time() / 1000 - RESPONSE_MARGIN)
+    if _deadline.get() is not None:
+        limits.append(_deadline.get())
+    return min(limits)
+
+def record(name, seconds):
+    spans = _spans.get()
+    if spans is None:
+        return
+    entry = spans.get(name)
+    if entry is None:
+        spans[name] = [seconds, 1]
+    else:
+        entry[0] += seconds
+        entry[1] += 1
+
+def count(name, value=1):
+    counts = _counts.get()
+    if counts is not None:
+        counts[name] = counts.get(name, 0) + value
+
+@contextmanager
+def span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+def timed(name):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+def emf_record(handler, spans, counts, total, properties):
+    milliseconds = {name: round(1000 * seconds, 3) for name, (seconds, _) in spans.items()}
+    milliseconds['total'] = round(1000 * total, 3)
+    return {'_aws': {'Timestamp': int(time.time() * 1000),
+                     'CloudWatchMetrics': [{'Namespace': NAMESPACE,
+                                            'Dimensions': [['Handler']],
+                                            'Metrics': [{'Name': name, 'Unit': 'Milliseconds'}
+                                                        for name in milliseconds] +
+                                                       [{'Name': name, 'Unit': 'Count'} for name in counts]}]},
+            'Handler': handler,
+            **properties,
+            # calls per span, as a property rather than a metric
+            'calls': {name: calls for name, (_, calls) in spans.items()},
+            **milliseconds,
+            **counts}
+
+def server_timing(spans, total):
+    timings = [f"{name};dur={1000 * seconds:.1f}" for name, (seconds, _) in spans.items()]
+    timings.append(f"total;dur={1000 * total:.1f}")
+    return ", ".join(timings)
+
+def instrumented_handler(name):
+    def decorate(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            token = _deadline.set(invocation_deadline(context))
+            try:
+                return measure(event, context)
+            finally:
+                _deadline.reset(token)
+
+        def measure(event, context):
+            if not ENABLED:
+                return handler(event, context)
+            spans = {}
+            counts = {}
+            token = _spans.set(spans)
+            counts_token = _counts.set(counts)
+            started = time.perf_counter()
+            properties = {'requestId': getattr(context, 'aws_request_id', None)}
+            response = None
+            try:
+                response = handler(event, context)
+            except BaseException as e:
+                properties['error'] = type(e).__name__
+                raise
+            finally:
+                _spans.reset(token)
+                _counts.reset(counts_token)
+                total = time.perf_counter() - started
+                if isinstance(response, dict):
+                    properties['statusCode'] = response.get('statusCode')
+                LOG_STREAM.write(json.dumps(emf_record(name, spans, counts, total, properties)) + "\n")
+            if SERVER_TIMING and isinstance(response, dict) and isinstance(response.get('headers'), dict):
+                response['headers']['Server-Timing'] = server_timing(spans, total)
+                # lets the frontend, on another origin, read the timings
+                response['headers']['Timing-Allow-Origin'] = '*'
+                response['headers']['Access-Control-Expose-Headers'] = 'Server-Timing'
+            return response
+        return wrapper
+    return decorate
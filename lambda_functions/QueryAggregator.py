@@ -0,0 +1,101 @@
+import contextvars
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from Metrics import instrumented_handler, record
+
+import QueryGeneInformation
+import QueryGnomAD
+import QueryOncoKb
+import QueryPrism
+import QueryVcfFromAthena
+import QueryVep
+
+"""
+QueryAggregator Module
+This module provides a single endpoint that runs every per-source handler for a search in parallel and
+returns one merged document, so a search costs one invocation and roughly the latency of the slowest source.
+Every source has its own timeout. A source that fails or times out is reported in the response,
+which is then marked as partial, without holding back the other sources.
+Functions:
+    initialize():
+        Initializes every source ahead of the first request (each source also does so at import with EAGER_INIT=1).
+    run_source(name: str, params: dict) -> dict:
+        Runs one source's lambda_handler with the parameters it needs and decodes its response.
+    lambda_handler(event: dict, context: object) -> dict:
+        AWS Lambda handler that fans out to every source and merges their responses.
+"""
+
+# source -> (handler, query string parameters it needs, default timeout in seconds)
+SOURCES = {
+    'vep': (QueryVep.lambda_handler, ('hgvsg',), 20),
+    'oncokb': (QueryOncoKb.lambda_handler, ('hgvsg',), 20),
+    'gene': (QueryGeneInformation.lambda_handler, ('hgvsg',), 15),
+    'gnomad': (QueryGnomAD.lambda_handler, ('chromosome', 'position', 'reference', 'variant'), 15),
+    'prism': (QueryPrism.lambda_handler, ('chromosome', 'position', 'reference', 'variant'), 10),
+    'clinvar': (QueryVcfFromAthena.lambda_handler, ('chromosome', 'position', 'reference', 'variant'), 15),
+}
+# per-source timeouts can be overridden with e.g. AGGREGATOR_TIMEOUT_VEP=10
+TIMEOUTS = {name: float(os.environ.get(f'AGGREGATOR_TIMEOUT_{name.upper()}', timeout))
+            for name, (_, _, timeout) in SOURCES.items()}
+
+# module scope so the pool survives across warm invocations. Sources that time out keep
+# their thread until the upstream call returns, so the pool is sized for some stragglers.
+executor = ThreadPoolExecutor(max_workers=len(SOURCES) * 2)
+
+def initialize():
+    for module in (QueryVep, QueryOncoKb, QueryGeneInformation, QueryGnomAD, QueryPrism, QueryVcfFromAthena):
+        module.initialize()
+
+def run_source(name, params):
+    handler, _, _ = SOURCES[name]
+    started = time.monotonic()
+    response = handler({'queryStringParameters': params}, None)
+    status_code = int(response['statusCode'])
+    return {'status': 'ok',
+            'statusCode': status_code,
+            'body': json.loads(response['body']),
+            'elapsed_ms': round(1000 * (time.monotonic() - started), 1)}
+
+@instrumented_handler('QueryAggregator')
+def lambda_handler(event, context):
+    param = event["queryStringParameters"] or {}
+    started = time.monotonic()
+    futures = {}
+    results = {}
+    for name, (_, required, _) in SOURCES.items():
+        missing = [x for x in required if not param.get(x)]
+        if missing:
+            results[name] = {'status': 'error', 'error': f"Missing parameters: {', '.join(missing)}"}
+        else:
+            # the source runs in this invocation's context, so its upstream calls keep to its deadline
+            futures[name] = executor.submit(contextvars.copy_context().run, run_source, name,
+                                            {x: param[x] for x in required})
+
+    # every source started together, so waiting in order of deadline bounds the
+    # wall-clock time by the slowest source that finishes within its timeout
+    for name in sorted(futures, key=TIMEOUTS.get):
+        remaining = started + TIMEOUTS[name] - time.monotonic()
+        try:
+            results[name] = futures[name].result(timeout=max(remaining, 0))
+            # sources run in executor threads with their own spans, so their time is recorded here
+            record(f"source.{name}", results[name].get('elapsed_ms', 0) / 1000)
+        except TimeoutError:
+            futures[name].cancel()
+            results[name] = {'status': 'timeout', 'error': f"No response within {TIMEOUTS[name]:g} seconds"}
+        except Exception as e:
+            results[name] = {'status': 'error', 'error': f"{type(e).__name__}: {e}"}
+
+    body = {'partial': any(x['status'] != 'ok' for x in results.values()),
+            'elapsed_ms': round(1000 * (time.monotonic() - started), 1),
+            'sources': {name: results[name] for name in SOURCES}}
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
+        },
+        'body': json.dumps(body),
+    }
@@ -1,54 +1,197 @@
 
 import json
-import urllib3
+import os
+from urllib.parse import urlencode
+from GeneIntervalStore import GeneIntervalStore
+from GeneSummaryStore import GeneSummaryStore
+from HttpClient import http
+from LazyInit import eager_init, once
+from Metrics import instrumented_handler, timed
+from ResponseCache import ResponseCache, get_disk
+from VariantNormalizer import get_reference, hgvsg_interval
+from VepAnnotation import get_transcript_consequences
 
 """
 QueryGeneInformation Module
 This module provides functions to query gene information using HGVS notation and retrieve gene summaries from external APIs.
 Functions:
     get_gene_symbol(notation: str) -> tuple:
-        Extracts the gene symbol and gene ID from the VEP API using the provided HGVS notation.
+        Finds the gene symbol and gene ID of the provided HGVS notation in the local gene interval index,
+        or in the shared VEP annotation if the index is not deployed or no gene overlaps the variant.
     get_summary(gene_id: str) -> dict:
-        Retrieves a summary of the gene information from the NCBI E-utilities API using the provided gene ID.
+        Retrieves a summary of the gene information from the local gene summary store, or from the response cache or the NCBI E-utilities API on a miss.
+    fetch_summaries(gene_ids: list, api_key: str) -> dict:
+        Retrieves many summaries from the NCBI E-utilities API with batched esummary requests.
+    get_summaries(gene_ids: list) -> dict:
+        Retrieves the summaries of many genes with one pass over the local store and the response cache and one batched request for the misses.
+    initialize():
+        Opens the reference genome, the gene interval index, the gene summary store and the response cache and creates the HTTP connection pool ahead of the first request.
     lambda_handler(event: dict, context: object) -> dict:
         AWS Lambda handler function that processes the event, extracts the HGVS notation, retrieves gene information, and returns a summary response.
+        A POST body with a list of gene IDs is answered in batch mode.
 """
 
-def get_gene_symbol(notation):
-    # extract gene symbol from Vep 
-    url = f"https://grch37.rest.ensembl.org/vep/human/hgvs/{notation}?refseq=1&hgvs=1&content-type=application/json"
-    http = urllib3.PoolManager()
-    response = http.request('GET', url)
-    if response.status == 200:
-        data = json.loads(response.data.decode('utf-8'))
-        consequences = data[0]['transcript_consequences']
-        if consequences:
-            for csq  in consequences:
-                try:
-                    return {'status': 200, 
-                            'symbol': csq["gene_symbol"], 
-                            'entrez':csq['gene_id']}
-                except KeyError:
-                    pass
-        return  {'status': 200, 
-                'symbol': None, 
-                'entrez': None}
+ESUMMARY_ENDPOINT = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
+# gene IDs per esummary POST
+ESUMMARY_BATCH = 500
+# local store built by utils/BuildGeneSummaryStore.py; when present it answers most lookups
+GENE_SUMMARY_STORE = os.environ.get('GENE_SUMMARY_STORE', '/opt/genes/summaries.store')
+# gene interval index built by utils/BuildGeneIndex.py; when present it replaces the VEP lookup
+GENE_INDEX = os.environ.get('GENE_INDEX', '/opt/genes/genes.store')
+# summaries missing from the store; a gene NCBI does not know may be added, so it is retried after a day
+summary_cache = ResponseCache('ncbi', ttl=7 * 86400, negative_ttl=86400)
+
+@once
+def get_gene_index():
+    """
+    returns the local gene interval index, or None if it is not deployed
+    """
+    if os.path.exists(GENE_INDEX):
+        return GeneIntervalStore(GENE_INDEX)
     return None
 
+@once
+def get_summary_store():
+    """
+    returns the local gene summary store, or None if it is not deployed
+    """
+    if os.path.exists(GENE_SUMMARY_STORE):
+        return GeneSummaryStore(GENE_SUMMARY_STORE)
+    return None
+
+def summary_result(summary):
+    if summary:
+        return {'status': 200, 'summary': summary}
+    return {'status': 204, 'summary': 'No gene information found', 'symbol': None}
+
+@timed('get_gene_symbol')
+def get_gene_symbol(notation):
+    index = get_gene_index()
+    if index is not None:
+        try:
+            genes = index.overlapping(*hgvsg_interval(notation))
+        except ValueError:
+            genes = []
+        # prefer a gene with an Entrez ID, which the summary lookup needs
+        for gene in sorted(genes, key=lambda x: x['entrez'] is None):
+            return {'status': 200, 'symbol': gene['symbol'], 'entrez': gene['entrez']}
+    # extract gene symbol from the shared Vep annotation
+    consequences = get_transcript_consequences(notation)
+    if consequences is None:
+        return None
+    for csq in consequences:
+        try:
+            return {'status': 200, 
+                    'symbol': csq["gene_symbol"], 
+                    'entrez':csq['gene_id']}
+        except KeyError:
+            pass
+    return  {'status': 200, 
+            'symbol': None, 
+            'entrez': None}
+
+@timed('get_summary')
 def get_summary(gene_id):
-    url = f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?db=gene&id={gene_id}&retmode=json"
-    http = urllib3.PoolManager()
-    response = http.request('GET', url)
+    store = get_summary_store()
+    if store is not None:
+        summary = store.get(gene_id)
+        if summary is not None:
+            return summary_result(summary)
+    found, summary = summary_cache.get(gene_id)
+    if found:
+        if summary is None:
+            return {'status': 204, 'summary': 'No gene information found', 'symbol': None}
+        return {'status': 200, 'summary': summary}
+    url = f"{ESUMMARY_ENDPOINT}?db=gene&id={gene_id}&retmode=json"
+    response = summary_cache.timed_fetch(lambda: http.request('GET', url))
     if response.status == 200:
         data = json.loads(response.data.decode('utf-8'))
         try:
-            return {'status': 200, 'summary': data['result'][gene_id]['summary']}
+            summary = data['result'][gene_id]['summary']
         except KeyError:
+            summary_cache.put(gene_id, None, negative=True)
             return {'status': 204, 'summary': 'No gene information found', 'symbol': None}
+        summary_cache.put(gene_id, summary)
+        return {'status': 200, 'summary': summary}
     else:
         return {'status': 204, 'summary': 'No gene information found', 'symbol': None}
+
+def fetch_summaries(gene_ids, api_key=None):
+    """
+    POST gene IDs to esummary in chunks of ESUMMARY_BATCH.
+    returns a dictionary of gene ID -> summary ('' if NCBI has none), or None
+    for IDs NCBI rejected; the IDs of failed chunks are left out.
+    """
+    results = {}
+    for i in range(0, len(gene_ids), ESUMMARY_BATCH):
+        chunk = gene_ids[i:i + ESUMMARY_BATCH]
+        fields = {'db': 'gene', 'id': ",".join(str(x) for x in chunk), 'retmode': 'json'}
+        if api_key:
+            fields['api_key'] = api_key
+        response = http.request('POST', ESUMMARY_ENDPOINT, body=urlencode(fields),
+                                headers={'Content-Type': 'application/x-www-form-urlencoded'})
+        if response.status != 200:
+            continue
+        data = json.loads(response.data.decode('utf-8')).get('result', {})
+        for gene_id in chunk:
+            entry = data.get(str(gene_id))
+            if isinstance(entry, dict) and 'error' not in entry:
+                results[gene_id] = entry.get('summary') or ''
+            else:
+                results[gene_id] = None
+    return results
+
+@timed('get_summaries')
+def get_summaries(gene_ids):
+    """
+    returns a dictionary of gene ID -> get_summary style result
+    """
+    store = get_summary_store()
+    found = store.get_many(gene_ids) if store is not None else {}
+    misses = []
+    for gene_id in dict.fromkeys(gene_ids):
+        if gene_id in found:
+            continue
+        cached, summary = summary_cache.get(gene_id)
+        if cached:
+            found[gene_id] = summary
+        else:
+            misses.append(gene_id)
+    if misses:
+        fetched = summary_cache.timed_fetch(lambda: fetch_summaries(misses))
+        for gene_id, summary in fetched.items():
+            summary_cache.put(gene_id, summary, negative=summary is None)
+        found.update(fetched)
+    return {gene_id: summary_result(found.get(gene_id)) for gene_id in gene_ids}
+
+def initialize():
+    get_reference()
+    get_gene_index()
+    get_summary_store()
+    get_disk()
+    http.initialize()
+
+def format_response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
+            
+        },
+        'body': json.dumps(body),
+    }
         
+@instrumented_handler('QueryGeneInformation')
 def lambda_handler(event, context):
+    if event.get("body"):
+        # batch mode: POST {"gene_ids": ["672", "7157", ...]} returns summaries keyed by gene ID
+        request = json.loads(event["body"])
+        if not isinstance(request, dict):
+            return format_response(400, {"error": "request body must be a JSON object"})
+        if isinstance(request.get("gene_ids"), list):
+            return format_response(200, get_summaries([str(x) for x in request["gene_ids"]]))
     param = event["queryStringParameters"]
     notation = param["hgvsg"]
     vep_data = get_gene_symbol(notation)
@@ -61,13 +204,7 @@ def lambda_handler(event, context):
         summary['gene_id'] = vep_data['entrez']
     else:
         summary = {'status': 204, 'summary': 'Gene Symbol not found', 'symbol': None}
-    return {
-        'statusCode': 200 if vep_data else 204,
-        'headers': {
-            'Access-Control-Allow-Headers': 'Content-Type',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-            
-        },
-        'body': json.dumps(summary),
-    }
\ No newline at end of file
+    return format_response(200 if vep_data else 204, summary)
+
+if eager_init():
+    initialize()
@@ -1,5 +1,11 @@
 import json
-import urllib3
+import os
+from GnomadStore import GnomadStore
+from HttpClient import http
+from LazyInit import eager_init, once
+from Metrics import instrumented_handler, timed
+from ResponseCache import ResponseCache, get_disk
+from VariantNormalizer import canonical_variant, get_reference
 
 """
 QueryGnomAD.py
@@ -14,9 +20,19 @@ Functions:
     extract_variant_data(variant_results):
         Extracts and simplifies variant data from the gnomAD API response, 
         focusing on exome and genome datasets.
+    query_gnomad(variants, datasets):
+        Queries many variants, in one or more datasets, using aliased variant 
+        selections batched into as few GraphQL requests as possible. Answers,
+        including "Variant not found", are cached per dataset and variant.
+    format_variant_body(variant_results, errors, chrom, position, ref, variant):
+        Builds the response body for one variant.
+    initialize():
+        Opens the local stores and the reference genome and creates the HTTP connection pool ahead of the first request.
     lambda_handler(event, context):
         AWS Lambda handler function that processes incoming API requests, 
-        queries the gnomAD API, and returns formatted variant data.
+        queries the gnomAD API, and returns formatted variant data. A POST body 
+        with a list of variants is answered in batch mode, in one or more of the
+        GRCh37 datasets in DATASETS; any other dataset is rejected with a 400.
 Parameters:
     replace_null_values(value):
         value (any): The value to be processed.
@@ -91,16 +107,23 @@ def extract_variant_data(variant_results):
     return (simplified_exome, exome_af, exome_faf_popmax, exome_faf_popmax_population, 
             simplified_genome, genome_af, genome_faf_popmax, genome_faf_popmax_population)
 
-def lambda_handler(event, context):
-    param = event["queryStringParameters"]
-    chrom = param['chromosome']
-    position = param['position']
-    ref = param['reference']
-    variant = param['variant']
-    http = urllib3.PoolManager()
-    
-    query = ("""
-    {variant(variantId:"%s-%s-%s-%s" dataset:gnomad_r2_1) {
+API_ENDPOINT = "https://gnomad.broadinstitute.org/api/"
+DEFAULT_DATASET = "gnomad_r2_1"
+# datasets a batch request may name: the GRCh37 r2.1 release and its subsets, which share its
+# coordinates and the exome/genome schema of VARIANT_FIELDS. GRCh38 releases (v3, v4) are not offered,
+# as variants are queried with GRCh37 coordinates.
+DATASETS = ("gnomad_r2_1", "gnomad_r2_1_controls", "gnomad_r2_1_non_neuro",
+            "gnomad_r2_1_non_cancer", "gnomad_r2_1_non_topmed")
+POPULATIONS = ["EAS", "SAS", "AFR", "AMR", "ASJ", "FIN", "NFE", "OTH"]
+# aliased variant selections per request, keeps each query within the API's cost limits
+MAX_SELECTIONS = 25
+# local stores built by utils/BuildGnomadStore.py; when present they answer DEFAULT_DATASET lookups
+GNOMAD_STORES = {'exome': os.environ.get('GNOMAD_EXOME_STORE', '/opt/gnomad/exome.store'),
+                 'genome': os.environ.get('GNOMAD_GENOME_STORE', '/opt/gnomad/genome.store')}
+# a dataset release never changes, so answers are kept for a month and "Variant not found" for a day
+gnomad_cache = ResponseCache('gnomad', ttl=30 * 86400, negative_ttl=86400)
+
+VARIANT_FIELDS = """
     reference_genome
     genome {
       genome_af: af
@@ -134,24 +157,101 @@ def lambda_handler(event, context):
         an
       }
     }
-    }
-    }
-    """)
-    
-    query = query % (chrom, position, ref.upper(), variant.upper())
-    payload = {"query": query}
-    API_ENDPOINT = "https://gnomad.broadinstitute.org/api/"
-    
-    response = http.request('GET', API_ENDPOINT, fields=payload)
-    data = json.loads(response.data.decode('utf-8'))
-    
-    if data["data"]["variant"]:
-        variant_results = data['data']['variant']
+"""
+
+def build_variant_selection(alias, chrom, position, ref, variant, dataset):
+    return ('%s: variant(variantId:"%s-%s-%s-%s" dataset:%s) {%s}' 
+            % (alias, chrom, position, ref.upper(), variant.upper(), dataset, VARIANT_FIELDS))
+
+def cache_key(variant, dataset):
+    chrom, position, ref, alt = variant
+    return (dataset, str(chrom), str(position), ref.upper(), alt.upper())
+
+@once
+def get_local_stores():
+    """
+    returns the local exome and genome stores by dataset, opening them once per container
+    """
+    if all(os.path.exists(path) for path in GNOMAD_STORES.values()):
+        stores = {data_type: GnomadStore(path) for data_type, path in GNOMAD_STORES.items()}
+        return {stores['exome'].dataset: stores}
+    return {}
+
+def initialize():
+    get_local_stores()
+    get_reference()
+    get_disk()
+    http.initialize()
+
+@timed('query_local')
+def query_local(stores, chrom, position, ref, variant):
+    """
+    answer a lookup from the local stores in the shape of the API's variant selection
+    """
+    exome = stores['exome'].lookup(chrom, position, ref, variant)
+    genome = stores['genome'].lookup(chrom, position, ref, variant)
+    if exome is None and genome is None:
+        return None, [{"message": "Variant not found"}]
+    return {"reference_genome": "GRCh37", "exome": exome, "genome": genome}, None
+
+@timed('query_gnomad')
+def query_gnomad(variants, datasets=(DEFAULT_DATASET,)):
+    """
+    query many variants, in one or more datasets, with aliased selections in a
+    single GraphQL request per MAX_SELECTIONS selections. datasets with a local
+    store are answered without calling the API.
+    returns a dictionary of (variant, dataset) -> (variant results, errors)
+    """
+    stores = get_local_stores()
+    results = {(variant, dataset): query_local(stores[dataset], *variant)
+               for variant in variants for dataset in datasets if dataset in stores}
+    pending = []
+    for variant in variants:
+        for dataset in datasets:
+            if dataset in stores or (variant, dataset) in results:
+                continue
+            found, cached = gnomad_cache.get(cache_key(variant, dataset))
+            if found:
+                results[(variant, dataset)] = tuple(cached)
+            else:
+                pending.append((variant, dataset))
+    selections = [(f"v{i}", variant, dataset) for i, (variant, dataset) in enumerate(pending)]
+    for i in range(0, len(selections), MAX_SELECTIONS):
+        chunk = selections[i:i + MAX_SELECTIONS]
+        query = "{\n" + "\n".join(build_variant_selection(alias, *variant, dataset) 
+                                   for alias, variant, dataset in chunk) + "\n}"
+        response = gnomad_cache.timed_fetch(lambda: http.request('POST', API_ENDPOINT, 
+                                                                 body=json.dumps({"query": query}),
+                                                                 headers={"Content-Type": "application/json"}))
+        try:
+            data = json.loads(response.data.decode('utf-8'))
+        except ValueError:
+            # e.g. an HTML error page from a proxy after the last retry
+            data = {"errors": [{"message": f"gnomAD API returned status {response.status}"}]}
+        errors = data.get("errors") or []
+        for alias, variant, dataset in chunk:
+            # errors without a path apply to every selection in the request
+            alias_errors = [x for x in errors if not x.get("path") or x["path"][0] == alias]
+            variant_results = (data.get("data") or {}).get(alias)
+            results[(variant, dataset)] = (variant_results, alias_errors or None)
+            # only answers are cached, never rate limiting or other failures
+            not_found = alias_errors and all(x.get("message") == "Variant not found" for x in alias_errors)
+            if response.status == 200 and (variant_results or not_found):
+                gnomad_cache.put(cache_key(variant, dataset), results[(variant, dataset)], negative=not variant_results)
+    return results
+
+def format_variant_body(variant_results, errors, chrom, position, ref, variant):
+    query = {
+            "chromosome": chrom,
+            "position": position,
+            "reference": ref,
+            "variant": variant
+            }
+    if variant_results:
         simplified_exome, exome_af, exome_faf_popmax, exome_faf_popmax_population, simplified_genome, genome_af, genome_faf_popmax, genome_faf_popmax_population = extract_variant_data(variant_results)
         
-        populations = ["EAS", "SAS", "AFR", "AMR", "ASJ", "FIN", "NFE", "OTH"]
-        population_results = [get_population_values(simplified_exome, simplified_genome, x, exome_faf_popmax, genome_faf_popmax) for x in populations]
-        body = {
+        population_results = [get_population_values(simplified_exome, simplified_genome, x, exome_faf_popmax, genome_faf_popmax) for x in POPULATIONS]
+        return {
                 "errors": "",
                 "summary": {
                     "exome": {
@@ -164,33 +264,24 @@ def lambda_handler(event, context):
                         "genome_faf_popmax": genome_faf_popmax,
                         "genome_faf_popmax_population": genome_faf_popmax_population
                     },
-                    "query": {
-                        "chromosome": chrom,
-                        "position": position,
-                        "reference": ref,
-                        "variant": variant
-                    }
+                    "query": query
                 },
                 "populations": population_results
                 
             }
-    else:
-        body = {
-                "errors": data.get("errors"),
-                "summary": {
-                    "exome": {},
-                    "genome": {},
-                    "query": {
-                        "chromosome": chrom,
-                        "position": position,
-                        "reference": ref,
-                        "variant": variant
-                        }
-                },
-                "populations": []
-            }
     return {
-            'statusCode': 200,
+            "errors": errors,
+            "summary": {
+                "exome": {},
+                "genome": {},
+                "query": query
+            },
+            "populations": []
+        }
+
+def format_response(body, status_code=200):
+    return {
+            'statusCode': status_code,
             'headers': {
                 'Access-Control-Allow-Headers': 'Content-Type',
                 'Access-Control-Allow-Origin': '*',
@@ -198,3 +289,40 @@ def lambda_handler(event, context):
             },
             'body': json.dumps(body)
         }
+
+def batch_handler(variants, datasets):
+    variants = [(x['chromosome'], x['position'], x['reference'], x['variant']) for x in variants]
+    # results are keyed by the requested variant but looked up by its normalized form
+    canonical = {variant: canonical_variant(*variant) for variant in variants}
+    results = query_gnomad(list(dict.fromkeys(canonical.values())), datasets)
+    body = {}
+    for variant in variants:
+        # the query is echoed as requested; only the lookup uses the normalized form
+        body["-".join(str(x) for x in variant)] = {dataset: format_variant_body(*results[(canonical[variant], dataset)], *variant)
+                                                   for dataset in datasets}
+    return format_response(body)
+
+@instrumented_handler('QueryGnomAD')
+def lambda_handler(event, context):
+    if event.get("body"):
+        # batch mode: POST {"variants": [{"chromosome", "position", "reference", "variant"}, ...],
+        #                   "datasets": ["gnomad_r2_1", ...]}
+        request = json.loads(event["body"])
+        if not isinstance(request, dict):
+            return format_response({"errors": "request body must be a JSON object"}, 400)
+        if isinstance(request.get("variants"), list):
+            datasets = request.get("datasets") or [DEFAULT_DATASET]
+            # dataset names are written into the GraphQL query, so only known ones are accepted
+            if not isinstance(datasets, list) or any(x not in DATASETS for x in datasets):
+                return format_response({"errors": f"datasets must be a list of {', '.join(DATASETS)}"}, 400)
+            return batch_handler(request["variants"], datasets)
+    param = event["queryStringParameters"]
+    query = (param['chromosome'], param['position'], param['reference'], param['variant'])
+    canonical = canonical_variant(*query)
+
+    variant_results, errors = query_gnomad([canonical])[(canonical, DEFAULT_DATASET)]
+    # the summary echoes the query as requested, not its normalized form
+    return format_response(format_variant_body(variant_results, errors, *query))
+
+if eager_init():
+    initialize()
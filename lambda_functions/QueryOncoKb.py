@@ -1,45 +1,144 @@
-import boto3
 import json
+import logging
 import os
-import urllib3
+import pickle
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from HttpClient import http
+from LazyInit import eager_init, once
+from Metrics import count, instrumented_handler, timed
+from ResponseCache import get_disk
+from VariantNormalizer import get_reference
+from VepAnnotation import get_transcript_consequences, get_transcript_consequences_batch
 
-def get_oncokb_identifiers():
+ONCOKB_BUCKET = 'variant-aggregator-v2'
+ONCOKB_GENE_LIST = 'cancerGeneList_Athena.tsv'
+# seconds between ETag revalidations of the cached gene list
+GENE_LIST_TTL = int(os.environ.get('ONCOKB_GENE_LIST_TTL', 900))
+# prebuilt snapshot packaged with the deployment (see utils/BuildOncoKbSnapshot.py)
+GENE_LIST_SNAPSHOT = os.environ.get('ONCOKB_GENE_LIST_SNAPSHOT',
+                                    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cancerGeneList.pickle'))
+
+ONCOKB_ENDPOINT = "https://www.oncokb.org/api/v1/annotate/mutations/byProteinChange"
+REFERENCE_GENOME = 'GRCh37'
+# protein changes per batch annotation POST
+ONCOKB_BATCH = int(os.environ.get('ONCOKB_BATCH', 100))
+# annotations of the same gene and alteration are shared between requests for this many seconds
+RESULT_CACHE_TTL = int(os.environ.get('ONCOKB_CACHE_TTL', 3600))
+RESULT_CACHE_SIZE = int(os.environ.get('ONCOKB_CACHE_SIZE', 4096))
+
+logger = logging.getLogger(__name__)
+
+# module scope so the gene list survives across warm invocations
+_gene_list = {'etag': None, 'checked': None, 'genes': {}, 'refseq': {}}
+
+# an OncoKB response: HTTP status and the decoded annotation (None unless the status is 200)
+OncoKbResult = namedtuple('OncoKbResult', ['status', 'annotation'])
+
+# (referenceGenome, hugoSymbol, alteration) -> (time fetched, annotation). only
+# successful annotations are cached, so an expired API key is retried every time
+_results = OrderedDict()
+_results_lock = threading.Lock()
+
+def parse_gene_list(data):
     """
-    get list of RefSeq identifiers from oncokb database
+    parse the OncoKB cancer gene list into two indices:
+    gene -> metadata and version-stripped RefSeq -> gene
     """
-    s3 = boto3.resource('s3')
-    obj = s3.Object('variant-aggregator-v2','cancerGeneList_Athena.tsv')
-    
-    data=obj.get()['Body'].read()
-    data = str(data).split('\\r\\n')
-    data = [str(x).split('\\t') for x in data]
-    dictionary = {}
-    refseq = []
-    for g in data:
+    genes = {}
+    refseq = {}
+    for line in data.decode('utf-8').splitlines():
+        g = line.split('\t')
         if len(g) == 6:
-            dictionary[g[0]] = {'refseq': g[1].split('.')[0], 'description': g[5]}
-            refseq.append(g[1].split('.')[0])
-    return dictionary, refseq
+            transcript = g[1].split('.')[0]
+            genes[g[0]] = {'refseq': transcript, 'description': g[5]}
+            refseq[transcript] = g[0]
+    return genes, refseq
+
+def load_gene_list_snapshot(path):
+    try:
+        with open(path, 'rb') as infile:
+            snapshot = pickle.load(infile)
+        etag, genes, refseq = snapshot['etag'], snapshot['genes'], snapshot['refseq']
+    except (IOError, EOFError, KeyError, TypeError, pickle.UnpicklingError):
+        # missing, truncated, or written by an older BuildOncoKbSnapshot.py
+        return False
+    _gene_list.update(etag=etag, 
+                      checked=time.monotonic(),
+                      genes=genes, 
+                      refseq=refseq)
+    return True
+
+@once
+def get_s3_client():
+    # boto3 is imported on first use, which is rare when the gene list snapshot is deployed
+    import boto3
+    return boto3.client('s3')
+
+@timed('refresh_gene_list')
+def refresh_gene_list():
+    """
+    download the gene list from S3 unless the cached copy still matches its ETag.
+    if S3 fails, the current list is kept until the next check; the error is only
+    raised when there is no list to serve.
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+    s3 = get_s3_client()
+    request = {'Bucket': ONCOKB_BUCKET, 'Key': ONCOKB_GENE_LIST}
+    if _gene_list['etag']:
+        request['IfNoneMatch'] = _gene_list['etag']
+    try:
+        obj = s3.get_object(**request)
+    except (ClientError, BotoCoreError) as e:
+        not_modified = isinstance(e, ClientError) and e.response['Error']['Code'] in ('304', 'NotModified')
+        if not not_modified:
+            if not _gene_list['genes']:
+                raise
+            logger.warning("Keeping the cached OncoKB gene list, refreshing it failed: %s", e)
+            count('oncokb.gene_list_refresh_failed')
+    else:
+        genes, refseq = parse_gene_list(obj['Body'].read())
+        _gene_list.update(etag=obj['ETag'], genes=genes, refseq=refseq)
+    _gene_list['checked'] = time.monotonic()
 
+def initialize():
+    """
+    load the gene list snapshot, open the reference genome and response cache and create the S3 client
+    ahead of the first request
+    """
+    if _gene_list['checked'] is None:
+        load_gene_list_snapshot(GENE_LIST_SNAPSHOT)
+    get_s3_client()
+    get_reference()
+    get_disk()
+    http.initialize()
 
+@timed('get_oncokb_identifiers')
+def get_oncokb_identifiers():
+    """
+    get list of RefSeq identifiers from oncokb database.
+    returns the gene -> metadata dictionary and the
+    version-stripped RefSeq -> gene index.
+    """
+    if _gene_list['checked'] is None:
+        load_gene_list_snapshot(GENE_LIST_SNAPSHOT)
+    if _gene_list['checked'] is None or time.monotonic() - _gene_list['checked'] > GENE_LIST_TTL:
+        refresh_gene_list()
+    return _gene_list['genes'], _gene_list['refseq']
+
+
+@timed('get_vep_annotation')
 def get_vep_annotation(notation):
     """
     perform vep annotation using the g. convention. 
-    returns None if VEP is not able to annotate
+    raises ValueError if VEP is not able to annotate
     the variant.
     """
-    http = urllib3.PoolManager()
-    API_ENDPOINT = API_ENDPOINT = f"https://grch37.rest.ensembl.org/vep/human/hgvs/{notation}?hgvs=1&refseq=1&content-type=application/json"
-    response = http.request('GET', API_ENDPOINT)
-    data = json.loads(response.data)
-
-    try:
-        consequence = data[0]['transcript_consequences']
-    except KeyError:
+    consequence = get_transcript_consequences(notation)
+    if consequence is None:
         raise ValueError("Unable to annotate variant coordinates with VEP")
-    else:
-        return consequence
-    return
+    return consequence
 
 def identify_oncokb_transcripts(refseq_ids, 
                                 vep_annotations):
@@ -50,7 +149,8 @@ def identify_oncokb_transcripts(refseq_ids,
     return:
     first dictionary element of vep_annotations that has a refseq id in refseq_ids
     """
-    refseq_ids = set(refseq_ids)
+    if not isinstance(refseq_ids, (set, frozenset, dict)):
+        refseq_ids = set(refseq_ids)
     if vep_annotations:
         for annotation in vep_annotations:
             try:
@@ -63,6 +163,39 @@ def identify_oncokb_transcripts(refseq_ids,
     else:   
         return 
 
+def cached_result(key):
+    with _results_lock:
+        entry = _results.get(key)
+        if entry is None:
+            return None
+        fetched, annotation = entry
+        if time.monotonic() - fetched > RESULT_CACHE_TTL:
+            del _results[key]
+            return None
+        _results.move_to_end(key)
+        return OncoKbResult(200, annotation)
+
+def cache_result(key, result):
+    if result.status != 200:
+        return
+    with _results_lock:
+        _results[key] = (time.monotonic(), result.annotation)
+        _results.move_to_end(key)
+        while len(_results) > RESULT_CACHE_SIZE:
+            _results.popitem(last=False)
+
+def authorization():
+    return {"Authorization": f" Bearer {os.environ['API_KEY']}",
+            "accept": "application/json"}
+
+def protein_change(consequence):
+    """
+    returns the cache key (referenceGenome, hugoSymbol, alteration) of a
+    transcript consequence. raises KeyError if it has no protein change.
+    """
+    aachange = consequence['hgvsp'].split("p.")[-1]
+    return REFERENCE_GENOME, consequence['gene_symbol'], contract_amino_acid_change(aachange)
+
 def contract_amino_acid_change(aachange):
     """
     contract amino acid change to single letter amino acid code
@@ -82,31 +215,68 @@ def contract_amino_acid_change(aachange):
         aachange = aachange.replace(long, short)
     return aachange
 
+@timed('get_oncokb_result')
 def get_oncokb_result(consequence):
     """
-    return entire api object to extract status code
+    return the OncoKbResult of a transcript consequence with its contracted
+    amino acid change and gene, from the cache when it holds the alteration
     """
-    api_key = os.environ['API_KEY']
     if consequence:
-        http = urllib3.PoolManager()
         try:
-            aachange = consequence['hgvsp'].split("p.")[-1]
-            aachange_short = contract_amino_acid_change(aachange)
-            genename = consequence['gene_symbol']
-            API_ENDPOINT = f"https://www.oncokb.org/api/v1/annotate/mutations/byProteinChange?referenceGenome=GRCh37&hugoSymbol={genename}&alteration={aachange_short}"
-            response = http.request('GET', API_ENDPOINT, 
-                                    headers = {
-                                        "Authorization": f" Bearer {api_key}",
-                                        "accept": "application/json"})
-            return response, aachange_short, genename
+            key = protein_change(consequence)
         except KeyError:
             return
+        _, genename, aachange_short = key
+        result = cached_result(key)
+        if result is None:
+            API_ENDPOINT = f"{ONCOKB_ENDPOINT}?referenceGenome={REFERENCE_GENOME}&hugoSymbol={genename}&alteration={aachange_short}"
+            response = http.request('GET', API_ENDPOINT, headers=authorization())
+            result = OncoKbResult(response.status, json.loads(response.data) if response.status == 200 else None)
+            cache_result(key, result)
+        return result, aachange_short, genename
     return
 
+@timed('get_oncokb_results')
+def get_oncokb_results(consequences):
+    """
+    batch version of get_oncokb_result: alterations missing from the cache are
+    annotated with POSTs of up to ONCOKB_BATCH protein changes.
+    returns a list with the get_oncokb_result of every consequence, in order.
+    """
+    keys = []
+    for consequence in consequences:
+        try:
+            keys.append(protein_change(consequence) if consequence else None)
+        except KeyError:
+            keys.append(None)
+    found = {}
+    misses = []
+    for key in dict.fromkeys(x for x in keys if x):
+        result = cached_result(key)
+        if result is None:
+            misses.append(key)
+        else:
+            found[key] = result
+    for i in range(0, len(misses), ONCOKB_BATCH):
+        chunk = misses[i:i + ONCOKB_BATCH]
+        queries = [{"referenceGenome": genome, "gene": {"hugoSymbol": gene}, "alteration": alteration}
+                   for genome, gene, alteration in chunk]
+        response = http.request('POST', ONCOKB_ENDPOINT, body=json.dumps(queries),
+                                headers={**authorization(), "Content-Type": "application/json"})
+        if response.status == 200:
+            # annotations are returned in the order of the queries
+            for key, annotation in zip(chunk, json.loads(response.data)):
+                found[key] = OncoKbResult(200, annotation)
+                cache_result(key, found[key])
+        else:
+            for key in chunk:
+                found[key] = OncoKbResult(response.status, None)
+    return [(found[key], key[2], key[1]) if key else None for key in keys]
+
 def parse_oncokb_result(oncokb_result, aachange, gene, transcript, hgvsc, genedictionary):
     if oncokb_result:
         status = oncokb_result.status
-        data = json.loads(oncokb_result.data)
+        data = oncokb_result.annotation
         if status == 200:
             geneType = genedictionary.get(gene, 'not in the list of genes from OncoKb')
             drugs = data["treatments"]
@@ -141,6 +311,41 @@ def parse_oncokb_result(oncokb_result, aachange, gene, transcript, hgvsc, genedi
                 'message': 'Variant not found in OncoKb',
                 "code":201
             }]
+def batch_handler(notations):
+    """
+    annotate many notations with one batched VEP lookup and batched OncoKB POSTs.
+    returns the response with the results of every notation keyed by notation.
+    """
+    not_found = [{'message': 'OncoKB transcript not found in annotations from VEP', "code":201}]
+    gene_dictionary, refseq_ids = get_oncokb_identifiers()
+    annotations = get_transcript_consequences_batch(notations)
+    body = {}
+    transcripts = {}
+    for notation in notations:
+        try:
+            transcripts[notation] = identify_oncokb_transcripts(refseq_ids, annotations[notation])
+        except ValueError:
+            transcripts[notation] = None
+        if transcripts[notation] is None:
+            body[notation] = not_found
+            del transcripts[notation]
+    results = get_oncokb_results([oncokb_transcript for oncokb_transcript, _, _ in transcripts.values()])
+    for (notation, (_, transcript, hgvsc)), result in zip(transcripts.items(), results):
+        try:
+            _, body[notation] = parse_oncokb_result(*result, transcript, hgvsc, gene_dictionary)
+        except TypeError:
+            body[notation] = [{'message': 'Variant not reported in oncoKb', "code":201}]
+    return {
+            'statusCode': json.dumps(200),
+            'headers': {
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
+                        },
+            'body': json.dumps({notation: body[notation] for notation in notations})
+    }
+
+@instrumented_handler('QueryOncoKb')
 def lambda_handler(event, context):
     return_json = {
             'headers': {
@@ -149,6 +354,16 @@ def lambda_handler(event, context):
                 'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
                         }
     }
+    if event.get("body"):
+        # batch mode: POST {"hgvsg": [...]} returns OncoKB results keyed by notation
+        request = json.loads(event["body"])
+        if not isinstance(request, dict):
+            return_json['statusCode'] = json.dumps(400)
+            return_json['body'] = json.dumps({'error': 'request body must be a JSON object'})
+            return return_json
+        notations = request.get("hgvsg")
+        if isinstance(notations, list):
+            return batch_handler(notations)
     param = event["queryStringParameters"]
     notation = param['hgvsg']
     gene_dictionary, refseq_ids = get_oncokb_identifiers()
@@ -177,4 +392,7 @@ def lambda_handler(event, context):
         return_json['statusCode'] = json.dumps(status)
         return_json['body'] = json.dumps(oncokb_result)
         return return_json
-    return
\ No newline at end of file
+    return
+
+if eager_init():
+    initialize()
@@ -1,13 +1,26 @@
 import json
-import urllib3
+from HttpClient import http
+from LazyInit import eager_init
+from Metrics import instrumented_handler
+from ResponseCache import ResponseCache, get_disk
+from VariantNormalizer import canonical_variant, get_reference
 
+# beacon answers per variant; "false" is kept for a shorter time in case the beacon adds the variant
+prism_cache = ResponseCache('prism', ttl=30 * 86400, negative_ttl=86400)
+
+def initialize():
+    get_reference()
+    get_disk()
+    http.initialize()
+
+@instrumented_handler('QueryPrism')
 def lambda_handler(event, context):
     param = event["queryStringParameters"]
-    chrom = param['chromosome'].replace("chr", "")
-    position = int(param['position'])-1
+    # the beacon encodes indels relative to their left-aligned VCF padding base
+    chrom, position, reference, variant = canonical_variant(param['chromosome'], param['position'],
+                                                            param['reference'], param['variant'])
+    position = position - 1
 
-    variant = param['variant']
-    reference = param['reference']
     if len(reference) < len(variant):
         # insertions
         variant = f"I{variant[1:]}"
@@ -17,19 +30,30 @@ def lambda_handler(event, context):
         variant = f"D{len(reference) - len(variant)}"
     else:
         variant = variant
-    http = urllib3.PoolManager()
-    API_ENDPOINT = f"http://beacon.prism-genomics.org/cgi-bin/ucscBeacon/query?&chromosome={chrom}&position={position}&alternateBases={variant}&format=json"
-    response = http.request('GET', API_ENDPOINT)
-    data = json.loads(response.data)["response"]
+    found, exists = prism_cache.get((chrom, position, variant))
+    if not found:
+        API_ENDPOINT = f"http://beacon.prism-genomics.org/cgi-bin/ucscBeacon/query?&chromosome={chrom}&position={position}&alternateBases={variant}&format=json"
+        response = prism_cache.timed_fetch(lambda: http.request('GET', API_ENDPOINT))
+        if response.status != 200:
+            # the page hides the PRISM card for a body with an error
+            return format_response({"error": f"PRISM beacon returned status {response.status}"}, 502)
+        exists = json.loads(response.data)["response"]['exists']
+        prism_cache.put((chrom, position, variant), exists, negative=exists.lower() != 'true')
     body = {"results": {
-            "exists": data['exists'].capitalize(),
+            "exists": exists.capitalize(),
             "query": {"chrom": chrom, "position": position+1, "reference": reference, "variant": variant}
     }}
+    return format_response(body)
+
+def format_response(body, status_code=200):
     return {
-            'statusCode': 200,
+            'statusCode': status_code,
             'body': json.dumps(body),
             'headers': {
                     'Access-Control-Allow-Headers': 'Content-Type',
                     'Access-Control-Allow-Origin': '*',
                     'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'} 
             }
+
+if eager_init():
+    initialize()
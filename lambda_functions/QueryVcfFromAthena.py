@@ -1,100 +1,213 @@
-import boto3
-import botocore
 import json
+import os
 import re
 import time
+from ClinvarStore import COLUMNS, ClinvarStore, position_bin
+from LazyInit import eager_init, once
+from Metrics import instrumented_handler, span, timed
+from VariantNormalizer import canonical_variant, get_reference
 
 # Reference: https://www.ilkkapeltola.fi/2018/04/simple-way-to-query-amazon-athena-in.html
 
 DATABASE = 'clinvar_vcf'
 TABLE = 'current'
+# set CLINVAR_POSITION_BINS=1 once the table has been rebuilt with utils/ClinvarParquet.py and its DDL,
+# which partitions it by chrom and pos_bin; the original table has no pos_bin column
+POSITION_BINS = os.environ.get('CLINVAR_POSITION_BINS', '0') == '1'
 OUTPUT = 's3://variant-aggregator-v2/queries/Unsaved/'
+# local store built by utils/BuildClinvarStore.py, e.g. in /tmp or a lambda layer
+CLINVAR_STORE = os.environ.get('CLINVAR_STORE', '/opt/clinvar/clinvar.store')
 
+# identical lookups within this window are served from Athena's cached results
+RESULT_REUSE_MINUTES = 60
+# variants per query, keeps the query string well under Athena's length limit
+MAX_BATCH = 250
+# polling starts at POLL_INITIAL seconds and doubles up to POLL_MAX until POLL_TIMEOUT
+POLL_INITIAL = 0.05
+POLL_MAX = 1.0
+POLL_TIMEOUT = 10
 
-client = boto3.client('athena')
+@once
+def get_client():
+    # boto3 is imported on first use: it dominates the cold start and is not
+    # needed at all when the local store answers every lookup
+    import boto3
+    return boto3.client('athena')
 
-def lambda_handler(event, context):
-    
-    param = event["queryStringParameters"]
-    chrom = param['chromosome']
-    position = param['position']
-    ref = param['reference']
-    variant = param['variant']
-    query = f"SELECT * FROM {DATABASE}.{TABLE} WHERE chrom = '{chrom}' AND position = '{position}' AND reference = '{ref}' AND alternate = '{variant}'"
-  
-    query_id =  client.start_query_execution(
+@once
+def get_store():
+    """
+    returns the local ClinVar store, or None if it is not deployed
+    """
+    if os.path.exists(CLINVAR_STORE):
+        return ClinvarStore(CLINVAR_STORE)
+    return None
+
+def initialize():
+    get_store()
+    get_reference()
+    get_client()
+
+def format_response(body, status_code=200):
+    return {
+            'statusCode': status_code,
+            'headers': {
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
+            },
+            'body': json.dumps(body)
+            }
+
+def format_record(record):
+    if not record:
+        return {'found': False}
+    variant_id = record['variation_id']
+    return { 'found': True,
+                'diseases': record['disease'],
+                'significance': record['assertions'],
+                'criteria': record['review_status'],
+                'accession': variant_id,
+                'linkout': f'https://www.ncbi.nlm.nih.gov/clinvar/variation/{variant_id}'
+            }
+
+def variant_key(chrom, position, ref, variant):
+    # ClinVar records are left-aligned, so queries are too
+    chrom, position, ref, variant = canonical_variant(chrom, position, ref, variant)
+    return (chrom, str(position), ref, variant)
+
+def quote(value):
+    # execution parameters are substituted as SQL literals
+    return "'" + str(value).replace("'", "''") + "'"
+
+def build_batch_query(variants):
+    """
+    build a parameterized query that looks up many (chrom, position, reference, alternate) tuples.
+    with POSITION_BINS, every predicate names its chrom and pos_bin partition so Athena only scans those partitions.
+    returns the query string and its execution parameters.
+    """
+    predicate = "(chrom = ? AND position = ? AND reference = ? AND alternate = ?)"
+    parameters = [quote(value) for variant in variants for value in variant]
+    if POSITION_BINS:
+        predicate = "(chrom = ? AND pos_bin = ? AND position = ? AND reference = ? AND alternate = ?)"
+        parameters = []
+        for chrom, position, ref, variant in variants:
+            parameters += [quote(chrom), str(position_bin(position)), quote(position), quote(ref), quote(variant)]
+    query = f"SELECT * FROM {DATABASE}.{TABLE} WHERE " + " OR ".join([predicate] * len(variants))
+    return query, parameters
+
+@timed('athena_start')
+def start_query(query, parameters):
+    query_id = get_client().start_query_execution(
         QueryString=query,
+        ExecutionParameters=parameters,
         QueryExecutionContext={
             'Database': DATABASE
         },
         ResultConfiguration={
             'OutputLocation': OUTPUT,
+        },
+        ResultReuseConfiguration={
+            'ResultReuseByAgeConfiguration': {
+                'Enabled': True,
+                'MaxAgeInMinutes': RESULT_REUSE_MINUTES
+            }
         }
-    )   
-    execution_id = query_id['QueryExecutionId']
-    
-    STATE = 'RUNNING'
-
-    MAX_EXEC = 10
-    
-    while (MAX_EXEC > 0 and STATE in ['RUNNING', 'QUEUED']):
-        MAX_EXEC = MAX_EXEC - 1
-        response = client.get_query_execution(QueryExecutionId = execution_id)
-        if 'QueryExecution' in response and \
-                'Status' in response['QueryExecution'] and \
-                'State' in response['QueryExecution']['Status']:
-            STATE = response['QueryExecution']['Status']['State']
-            if STATE == 'FAILED':
-                return False
-            elif STATE == 'SUCCEEDED':
-                s3_path = response['QueryExecution']['ResultConfiguration']['OutputLocation']
-                results = client.get_query_results(
-                    QueryExecutionId = execution_id
-                    )
-
-                row = results["ResultSet"]["Rows"]
-                if len(row) == 1:
-                    # empty result set since the first row is the header
-                    return {
-                            'statusCode': 200,
-                            'headers': {
-                            'Access-Control-Allow-Headers': 'Content-Type',
-                            'Access-Control-Allow-Origin': '*',
-                            'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-                            },
-                            'body': json.dumps(
-                               {'found': False}
-                               )
-                            }
-                else:
-                    results = row[-1]
-                    results = results['Data']
-                    position, ref, variant, variant_id, clinsig, criteria, disease, ch =  [x["VarCharValue"] for x in results]
-                    return {
-                            'statusCode': 200,
-                            'headers': {
-                            'Access-Control-Allow-Headers': 'Content-Type',
-                            'Access-Control-Allow-Origin': '*',
-                            'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-                            },
-                            'body': json.dumps(
-                                { 'found': True,
-                                    'diseases': disease,
-                                    'significance': clinsig, 
-                                    'criteria': criteria,
-                                    'accession': variant_id,
-                                    'linkout': f'https://www.ncbi.nlm.nih.gov/clinvar/variation/{variant_id}'
-                                })
-                            }
-        time.sleep(1)
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Access-Control-Allow-Headers': 'Content-Type',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-            },
-        'body': json.dumps(
-            {'found': False}
-            )
-    }
\ No newline at end of file
+    )
+    return query_id['QueryExecutionId']
+
+@timed('athena_poll')
+def wait_for_query(execution_id):
+    """
+    poll a query with exponential backoff.
+    returns the final state (SUCCEEDED, FAILED, CANCELLED or TIMEOUT)
+    and the reason reported by Athena, if any.
+    """
+    deadline = time.monotonic() + POLL_TIMEOUT
+    interval = POLL_INITIAL
+    while True:
+        response = get_client().get_query_execution(QueryExecutionId = execution_id)
+        status = response.get('QueryExecution', {}).get('Status', {})
+        state = status.get('State', 'RUNNING')
+        if state not in ['RUNNING', 'QUEUED']:
+            return state, status.get('StateChangeReason')
+        if time.monotonic() + interval > deadline:
+            return 'TIMEOUT', f'Query did not complete within {POLL_TIMEOUT} seconds'
+        time.sleep(interval)
+        interval = min(interval * 2, POLL_MAX)
+
+@timed('athena_results')
+def get_records(execution_id):
+    """
+    returns every row of a finished query as a dictionary keyed by COLUMNS
+    """
+    records = []
+    paginator = get_client().get_paginator('get_query_results')
+    for page in paginator.paginate(QueryExecutionId = execution_id):
+        for row in page["ResultSet"]["Rows"]:
+            # partition columns follow the data columns
+            position, ref, variant, variant_id, clinsig, criteria, disease, ch =  [x.get("VarCharValue", "") for x in row['Data']][:8]
+            records.append(dict(zip(COLUMNS, (ch, position, ref, variant, variant_id, clinsig, criteria, disease))))
+    # the first row is the header
+    return records[1:]
+
+def query_variants(variants):
+    """
+    look up (chrom, position, reference, alternate) tuples.
+    returns a dictionary of normalized variant key -> matching records and
+    raises RuntimeError if Athena does not complete a query.
+    """
+    keys = list(dict.fromkeys(variant_key(*x) for x in variants))
+    results = {key: [] for key in keys}
+    store = get_store()
+    if store is not None:
+        with span('clinvar_store'):
+            for key in keys:
+                results[key] = store.lookup(*key)
+        return results
+    for i in range(0, len(keys), MAX_BATCH):
+        execution_id = start_query(*build_batch_query(keys[i:i + MAX_BATCH]))
+        state, reason = wait_for_query(execution_id)
+        if state != 'SUCCEEDED':
+            raise RuntimeError(f"Athena query {execution_id} {state}: {reason}")
+        for record in get_records(execution_id):
+            key = variant_key(record['chrom'], record['position'], record['reference'], record['alternate'])
+            if key in results:
+                results[key].append(record)
+    return results
+
+def batch_handler(variants):
+    variants = [(x['chromosome'], x['position'], x['reference'], x['variant']) for x in variants]
+    try:
+        results = query_variants(variants)
+    except RuntimeError as e:
+        return format_response({'found': False, 'error': str(e)}, 500)
+    body = {}
+    for variant in variants:
+        records = results[variant_key(*variant)]
+        body["-".join(str(x) for x in variant)] = format_record(records[-1] if records else None)
+    return format_response(body)
+
+@instrumented_handler('QueryVcfFromAthena')
+def lambda_handler(event, context):
+    if event.get("body"):
+        # batch mode: POST {"variants": [{"chromosome", "position", "reference", "variant"}, ...]}
+        request = json.loads(event["body"])
+        if not isinstance(request, dict):
+            return format_response({'found': False, 'error': 'request body must be a JSON object'}, 400)
+        variants = request.get("variants")
+        if isinstance(variants, list):
+            return batch_handler(variants)
+    param = event["queryStringParameters"]
+    chrom = param['chromosome']
+    position = param['position']
+    ref = param['reference']
+    variant = param['variant']
+    try:
+        records = query_variants([(chrom, position, ref, variant)])[variant_key(chrom, position, ref, variant)]
+    except RuntimeError as e:
+        return format_response({'found': False, 'error': str(e)}, 500)
+    return format_response(format_record(records[-1] if records else None))
+
+if eager_init():
+    initialize()
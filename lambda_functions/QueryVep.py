@@ -1,6 +1,13 @@
 import json
-import urllib3
-from collections import defaultdict
+import math
+from collections import defaultdict, namedtuple
+from itertools import islice
+from HttpClient import http
+from LazyInit import eager_init, once
+from Metrics import instrumented_handler, timed
+from ResponseCache import get_disk
+from VariantNormalizer import get_reference
+from VepAnnotation import get_transcript_consequences, get_transcript_consequences_batch
 
 TOOLS = {
         "BayesDel_addAF_score": {
@@ -113,20 +120,52 @@ TOOLS = {
             "toolname": "CADD"}
             }
 
+CLASSIFICATIONS = ["Unknown", "neutral", "pathogenic"]
+
+# tools: (id, name, description) in the order predictions are reported. VEP returns the dbNSFP fields lower-cased.
+# rules: (id, direction, threshold) per tool. Scores are multiplied by the direction so that
+# every tool is pathogenic at score >= threshold.
+# compact: tool metadata sent once by the compact response format.
+ToolTable = namedtuple('ToolTable', ['tools', 'rules', 'compact'])
+
+@once
+def get_tool_table():
+    """
+    compile the TOOLS lookup tables, once per container on first use
+    """
+    keys = sorted(TOOLS, key=str.lower)
+    directions = [1.0 if TOOLS[key]['threshold_type'] == "min" else -1.0 for key in keys]
+    return ToolTable(tools=[(key.lower(), TOOLS[key]['toolname'], TOOLS[key]['help']) for key in keys],
+                     rules=[(key.lower(), direction, direction * TOOLS[key]['threshold'])
+                            for key, direction in zip(keys, directions)],
+                     compact=[{'id': key.lower(),
+                               'name': TOOLS[key]['toolname'],
+                               'description': TOOLS[key]['help'],
+                               'threshold': TOOLS[key]['threshold'],
+                               'threshold_type': TOOLS[key]['threshold_type']}
+                              for key in keys])
+
+def initialize():
+    get_tool_table()
+    get_reference()
+    get_disk()
+    http.initialize()
+
+@timed('fetch_vep_data')
 def fetch_vep_data(notation):
     # returns None if status code from the Vep API is not 200 or no consequences can be retrieved
-    tools = ",".join(TOOLS.keys())
-    http = urllib3.PoolManager()
-    API_ENDPOINT = f"https://grch37.rest.ensembl.org/vep/human/hgvs/{notation}?CADD=1&dbNSFP={tools}&hgvs=1&maxEntScan=1&refseq=1&content-type=application/json"
-    response = http.request('GET', API_ENDPOINT)
-    if response.status == 200:
-        data = json.loads(response.data)
-        try:
-            return data[0]['transcript_consequences']
-        except (IndexError, KeyError):
-            return 
-    return 
+    return get_transcript_consequences(notation) or None
 
+@timed('fetch_vep_batch')
+def fetch_vep_batch(notations):
+    """
+    annotate a list of HGVS notations through the shared VEP layer.
+    returns a dictionary of notation -> transcript consequences. notations 
+    that VEP could not annotate map to None.
+    """
+    return get_transcript_consequences_batch(notations)
+
+@timed('format_response')
 def format_response(status_code, body):
     return {'statusCode': status_code,
             'headers': {
@@ -136,93 +175,153 @@ def format_response(status_code, body):
                         },
             'body': json.dumps(body)}
 
-def classify_variant(score, threshold, threshold_type):
-    if threshold_type == "min":
-        if score >= threshold:
-            return "pathogenic"
-    elif threshold_type == "max":
-        if score <= threshold:
-            return "pathogenic"
-    return "neutral"
-
-def classify_set_variant(scores, threshold, threshold_type):
+# scores are classified one cell at a time. Parsing the raw score strings dominates, so a NumPy matrix
+# of consequences x tools measured only 1.1-1.5x faster (benchmarks/BenchmarkVepClassification.py)
+# and was not worth the dependency and its import time on cold start.
+def classify_score(value, direction, threshold):
+    """
+    classify the score one tool reported for a consequence.
+    returns the score for the response and the classification code into
+    CLASSIFICATIONS, or None if the tool reported no score.
+    """
+    if not value or value == 'invalid_field':
+        return '', None
+    if not isinstance(value, str):
+        return value, 2 if direction * float(value) >= threshold else 1
+    if ',' not in value:
+        # a single score, the usual case
+        values = [value] if value != "." else []
+        score = value if value != "." else ''
+    else:
+        values = set([x for x in value.split(',') if x != "."])
+        score = ",".join(values)
     try:
-        if threshold_type == "min":
-            if any([float(x) >= threshold for x in scores]):
-                return "pathogenic"
-        elif threshold_type == "max":
-            if any([float(x) <= threshold for x in scores]):
-                return "pathogenic"
-        return "neutral"
+        # parse every value first, so that one that is not a number makes the score Unknown
+        directed = [direction * float(x) for x in values]
     except ValueError:
-        return "Unknown"
+        return score, 0
+    # NaN compares False, so missing scores are neutral
+    return score, 2 if any(x >= threshold for x in directed) else 1
+
+def classify_consequences(consequences):
+    """
+    classify the scores of every tool for the consequences that have a hgvsc.
+    returns the consequences, their score cells, whether each tool reported a
+    score, the classification codes into CLASSIFICATIONS and the totals.
+    """
+    consequences = [x for x in consequences if 'hgvsc' in x]
+    rules = get_tool_table().rules
+    scores, reported, codes, total_predictions, total_pathogenic = [], [], [], [], []
+    for consequence in consequences:
+        row = [classify_score(consequence.get(key), direction, threshold)
+               for key, direction, threshold in rules]
+        scores.append([score for score, _ in row])
+        reported.append([code is not None for _, code in row])
+        codes.append([code or 0 for _, code in row])
+        total_predictions.append(sum(reported[-1]))
+        total_pathogenic.append(codes[-1].count(2))
+    return consequences, scores, reported, codes, total_predictions, total_pathogenic
+
+@timed('process_consequences')
+def process_consequences(consequences):
+    consequences, scores, _, codes, total_predictions, total_pathogenic = classify_consequences(consequences)
+    annotations = []
+    for i, consequence in enumerate(consequences):
+        annotation = [{'id': key,
+                       'name': name,
+                       'description': description,
+                       'scores': score,
+                       'classification': classification}
+                      for (key, name, description), score, classification
+                      in zip(get_tool_table().tools, scores[i], [CLASSIFICATIONS[x] for x in codes[i]])]
+        annotations.append({'hgvsc': consequence['hgvsc'],
+                            'hgvsp': consequence.get('hgvsp', 'p.(?)'),
+                            'predictions': annotation,
+                            'total_predictions': total_predictions[i],
+                            'total_pathogenic': total_pathogenic[i],
+                            'percent_pathogenic': "{:.2f}%".format(100*total_pathogenic[i]/total_predictions[i] 
+                                                                   if total_predictions[i] else 0)
+                            })
+    return annotations
 
 def process_consequence(consequence):
-    result_keys = [x.lower() for x in TOOLS.keys()]
-    tool_map = dict(zip(result_keys, TOOLS.keys()))
-    ordered_result_keys = sorted(result_keys)
+    annotations = process_consequences([consequence])
+    return annotations[0] if annotations else None
+
+def score_number(value):
     try:
-        nt_change = consequence['hgvsc']
-    except KeyError:
-        pass
-    else:
-        aa_change = consequence.get('hgvsp', 'p.(?)')
-        annotation = []
-        total_predictions = 0
-        total_pathogenic = 0
-        for k in ordered_result_keys:
-            detailed_predictions = {}
-            toolname = tool_map[k]
-            detailed_predictions['id'] = k
-            detailed_predictions['name'] = TOOLS[toolname]['toolname']
-            detailed_predictions['description'] = TOOLS[toolname]['help']
-            detailed_predictions['scores'] = ''
-            detailed_predictions['classification'] = 'Unknown'
-            threshold = TOOLS[toolname]['threshold']
-            threshold_type = TOOLS[toolname]['threshold_type']
-            if k in consequence:
-                v = consequence[k]
-                if v:
-                    if v!='invalid_field':
-                        total_predictions += 1
-                        try:
-                            detailed_predictions['scores'] = set([x for x in v.split(',') if x!="."])
-                            classification = classify_set_variant(detailed_predictions['scores'], 
-                                            threshold, 
-                                            threshold_type)
-                            detailed_predictions['scores'] = ",".join(detailed_predictions['scores'])
-                        except AttributeError:
-                            detailed_predictions['scores'] = v
-                            classification = classify_variant(v, threshold, threshold_type)
-                        if classification == "pathogenic":
-                            total_pathogenic += 1
-                        if classification in ["pathogenic", "neutral"]:
-                            detailed_predictions['classification'] = classification
-            annotation.append(detailed_predictions)
-        return {'hgvsc': nt_change, 
-                'hgvsp': aa_change, 
-                'predictions': annotation,
-                'total_predictions': total_predictions,
-                'total_pathogenic': total_pathogenic,
-                'percent_pathogenic': "{:.2f}%".format(100*total_pathogenic/total_predictions if total_predictions else 0)
-                }
+        value = float(value)
+    except ValueError:
+        return None
+    # NaN and infinity are not valid JSON
+    return value if math.isfinite(value) else None
 
+def compact_scores(score):
+    if isinstance(score, str):
+        return [score_number(x) for x in score.split(',')] if score else []
+    return [score_number(score)]
 
+@timed('compact_consequences')
+def compact_consequences(consequences):
+    """
+    compact form of process_consequences: scores and classification codes are
+    arrays aligned to the compact tool table. A score is null if the tool reported none,
+    otherwise a list of numbers, with null for values that are not numbers.
+    """
+    consequences, scores, reported, codes, total_predictions, total_pathogenic = classify_consequences(consequences)
+    return [{'hgvsc': consequence['hgvsc'],
+             'hgvsp': consequence.get('hgvsp', 'p.(?)'),
+             'scores': [compact_scores(score) if present else None
+                        for score, present in zip(scores[i], reported[i])],
+             'classifications': codes[i],
+             'total_predictions': total_predictions[i],
+             'total_pathogenic': total_pathogenic[i],
+             'percent_pathogenic': round(100*total_pathogenic[i]/total_predictions[i], 2) if total_predictions[i] else 0}
+            for i, consequence in enumerate(consequences)]
+
+def compact_body(**fields):
+    return {'format': 'compact', 'tools': get_tool_table().compact, 'classifications': CLASSIFICATIONS, **fields}
+
+def batch_handler(notations, compact=False):
+    results = {}
+    batch = fetch_vep_batch(notations)
+    process = compact_consequences if compact else process_consequences
+    annotations = iter(process([x for consequences in batch.values() if consequences 
+                                for x in consequences]))
+    for notation, consequences in batch.items():
+        if consequences:
+            results[notation] = list(islice(annotations, sum('hgvsc' in x for x in consequences)))
+        else:
+            results[notation] = {"error": "No variant data available from VEP API"}
+    return format_response(200, compact_body(results=results) if compact else results)
+
+@instrumented_handler('QueryVep')
 def lambda_handler(event, context):   
-    param = event["queryStringParameters"]
+    param = event.get("queryStringParameters") or {}
+    if event.get("body"):
+        # batch mode: POST {"hgvsg": [...]} returns annotations keyed by notation
+        body = json.loads(event["body"])
+        if not isinstance(body, dict):
+            return format_response(400, {"error": "request body must be a JSON object"})
+        notations = body.get("hgvsg")
+        if isinstance(notations, list):
+            return batch_handler(notations, compact=(body.get("format") or param.get("format")) == "compact")
     notation = param['hgvsg']
+    # format=compact sends the tool table once instead of repeating it for every consequence
+    compact = param.get('format') == 'compact'
 
     consequences = fetch_vep_data(notation)
 
     if not consequences:
         return format_response(201, 
                                 {"error": "No variant data available from VEP API"})
+    elif compact:
+        return format_response(200, compact_body(consequences=compact_consequences(consequences)))
     else:
-        annotations = []
-        for consequence in consequences:
-            csq = process_consequence(consequence)
-            annotations.append(csq)
-        annotations = [x for x in annotations if x]
+        annotations = process_consequences(consequences)
         return format_response(200, annotations)
     return format_response(201, 
-                            {"error": "Error in processing Vep results"})
\ No newline at end of file
+                            {"error": "Error in processing Vep results"})
+
+if eager_init():
+    initialize()
@@ -0,0 +1,189 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from LazyInit import once
+from Metrics import count, record
+
+"""
+ResponseCache Module
+This module caches upstream responses that do not change within a dataset release, such as gnomAD
+variants, NCBI gene summaries and PRISM beacon answers. Each source has its own cache with two tiers:
+a bounded LRU in the process, which lives across warm invocations, and a SQLite database shared by every
+source. By default the database is in /tmp, which belongs to one execution environment: there it only adds
+room beyond the LRU, for the life of the environment. Pointing RESPONSE_CACHE_PATH at a mounted volume
+such as EFS shares it between functions and environments and lets it survive cold starts; WAL journaling
+is only used in /tmp, as it needs shared memory that network file systems do not provide. Entries expire
+after the source's TTL, and negative answers such as "variant not found" after a separate, shorter TTL.
+The database is kept under RESPONSE_CACHE_BYTES by evicting expired entries and then the oldest ones.
+Every lookup counts a memory hit, disk hit or miss in the invocation's metrics, and a hit records the
+upstream time it saved, estimated from the mean time of that source's fetches.
+Functions:
+    get_disk() -> DiskTier or None:
+        The shared SQLite tier, opened once per container, or None if it is disabled or cannot be opened.
+    clear():
+        Empties the memory tier of every cache and the SQLite tier.
+Classes:
+    ResponseCache(name: str, ttl: float, negative_ttl: float):
+        get(key) -> (found, value).
+        put(key, value, negative: bool).
+        timed_fetch(function) -> the result of function(), timed for the saved-time estimate.
+    DiskTier(path: str, max_bytes: int):
+        SQLite storage of every cache's entries.
+"""
+
+# entries per source kept in the process
+MEMORY_SIZE = int(os.environ.get('RESPONSE_CACHE_MEMORY', 2048))
+DISK_ENABLED = os.environ.get('RESPONSE_CACHE_DISK', '1') == '1'
+DISK_PATH = os.environ.get('RESPONSE_CACHE_PATH', '/tmp/response-cache.sqlite')
+# /tmp holds 512 MB by default on Lambda
+DISK_BYTES = int(os.environ.get('RESPONSE_CACHE_BYTES', 128 * 1024 * 1024))
+# puts between size checks of the database
+EVICT_EVERY = 200
+
+# every cache by name, so they can be cleared together
+_caches = {}
+
+class DiskTier:
+    def __init__(self, path, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if os.path.abspath(path).startswith('/tmp/'):
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS responses "
+                         "(source TEXT, key TEXT, value TEXT, expires REAL, stored REAL, PRIMARY KEY (source, key))")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_stored ON responses (stored)")
+
+    def get(self, source, key):
+        """
+        returns (value, expiry time) or None
+        """
+        with self._lock:
+            row = self._db.execute("SELECT value, expires FROM responses WHERE source = ? AND key = ?",
+                                   (source, key)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, source, key, value, expires):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                             (source, key, json.dumps(value), expires, time.time()))
+            self._puts += 1
+            if self._puts % EVICT_EVERY == 0:
+                self._evict()
+
+    def _evict(self):
+        self._db.execute("DELETE FROM responses WHERE expires < ?", (time.time(),))
+        while True:
+            size, rows = self._db.execute("SELECT COALESCE(SUM(LENGTH(key) + LENGTH(value)), 0), COUNT(*) "
+                                          "FROM responses").fetchone()
+            if size <= self.max_bytes or not rows:
+                return
+            # oldest tenth first, then measure again
+            self._db.execute("DELETE FROM responses WHERE rowid IN "
+                             "(SELECT rowid FROM responses ORDER BY stored LIMIT ?)", (max(rows // 10, 1),))
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+
+@once
+def get_disk():
+    if not DISK_ENABLED:
+        return None
+    try:
+        return DiskTier(DISK_PATH, DISK_BYTES)
+    except (sqlite3.Error, OSError):
+        # a read-only or full file system only costs the second tier
+        return None
+
+def clear():
+    for cache in _caches.values():
+        with cache._lock:
+            cache._memory.clear()
+    disk = get_disk()
+    if disk is not None:
+        disk.clear()
+
+class ResponseCache:
+    """
+    Cache of one source. Keys are tuples or strings and values must be JSON
+    serializable. Cached values are shared and must not be modified by callers;
+    a value read back from the disk tier has its tuples turned into lists.
+    """
+    def __init__(self, name, ttl, negative_ttl):
+        self.name = name
+        # e.g. CACHE_TTL_GNOMAD=86400 and CACHE_NEGATIVE_TTL_GNOMAD=600
+        self.ttl = float(os.environ.get(f'CACHE_TTL_{name.upper()}', ttl))
+        self.negative_ttl = float(os.environ.get(f'CACHE_NEGATIVE_TTL_{name.upper()}', negative_ttl))
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        # running mean of the fetch time, the estimate of what a hit saves
+        self._fetches = 0
+        self._fetch_seconds = 0.0
+        _caches[name] = self
+
+    def get(self, key):
+        key = json.dumps(key)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] >= now:
+                    self._memory.move_to_end(key)
+                    self._hit('hit_memory')
+                    return True, entry[1]
+                del self._memory[key]
+        disk = get_disk()
+        try:
+            entry = disk.get(self.name, key) if disk is not None else None
+        except sqlite3.Error:
+            entry = None
+        if entry is None:
+            count(f"cache.{self.name}.miss")
+            return False, None
+        value, expires = entry
+        self._remember(key, value, expires)
+        self._hit('hit_disk')
+        return True, value
+
+    def _hit(self, tier):
+        count(f"cache.{self.name}.{tier}")
+        if self._fetches:
+            record(f"cache.{self.name}.saved", self._fetch_seconds / self._fetches)
+
+    def _remember(self, key, value, expires):
+        with self._lock:
+            self._memory[key] = (expires, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > MEMORY_SIZE:
+                self._memory.popitem(last=False)
+
+    def put(self, key, value, negative=False):
+        key = json.dumps(key)
+        expires = time.time() + (self.negative_ttl if negative else self.ttl)
+        self._remember(key, value, expires)
+        disk = get_disk()
+        if disk is not None:
+            try:
+                disk.put(self.name, key, value, expires)
+            except sqlite3.Error:
+                pass
+
+    def timed_fetch(self, function):
+        """
+        calls function() and adds its duration to the estimate of what a hit saves
+        """
+        started = time.perf_counter()
+        try:
+            return function()
+        finally:
+            with self._lock:
+                self._fetches += 1
+                self._fetch_seconds += time.perf_counter() - started
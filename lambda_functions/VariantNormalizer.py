@@ -0,0 +1,334 @@
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from urllib.parse import unquote
+from ClinvarStore import normalize_chromosome
+from LazyInit import once
+
+"""
+VariantNormalizer Module
+This module gives every handler the same canonical variant key without a network call. It converts
+between genomic HGVS (g.) notations and VCF (chromosome, position, reference, alternate) tuples and
+normalizes indels, reading the bases it needs from a memory-mapped GRCh37 reference: a UCSC 2bit file
+or a FASTA file with its samtools .fai index. VCF tuples are left-aligned and trimmed to their shortest
+padded form, as in gnomAD and ClinVar; HGVS notations are 3' shifted as the HGVS rules require.
+Without a reference only trimming is done, and notations that need reference bases raise ValueError.
+Functions:
+    open_reference(path: str) -> TwoBitReference or FastaReference:
+        Opens a 2bit file, or a FASTA file with a .fai index, by its extension.
+    get_reference() -> TwoBitReference, FastaReference or None:
+        The reference genome at REFERENCE_GENOME, opened once per container, or None if it is not deployed.
+    use_reference(path: str):
+        Makes get_reference() open the reference genome at path, even if another one was already opened.
+    chromosome_name(accession: str) -> str:
+        Maps chr-prefixed names and versioned GRCh37 RefSeq accessions (NC_000017.10) to 1-22, X, Y and MT.
+        Raises ValueError for any other RefSeq accession, such as the GRCh38 NC_000017.11.
+    hgvsg_interval(notation: str) -> tuple:
+        The chromosome and 1-based start and end positions of a g. notation, without reading the reference.
+    parse_hgvsg(notation: str, reference: object) -> tuple:
+        Converts a substitution, del, dup, ins or delins g. notation to a VCF tuple.
+    normalize_variant(chrom, position, ref, alt, reference: object) -> tuple:
+        Left-aligns and trims a VCF tuple.
+    format_hgvsg(chrom, position, ref, alt, reference: object) -> str:
+        Converts a VCF tuple to a 3' shifted g. notation.
+    canonical_variant(chrom, position, ref, alt) -> tuple:
+        The normalized VCF tuple of a variant, using the deployed reference.
+    canonical_hgvsg(notation: str) -> str:
+        The normalized g. notation of a variant, using the deployed reference.
+Classes:
+    TwoBitReference(path: str):
+        sequence(chrom, start, end) -> str of the bases in [start, end), 0-based.
+    FastaReference(path: str):
+        sequence(chrom, start, end) -> str of the bases in [start, end), 0-based.
+"""
+
+# hg19.2bit from UCSC, or a GRCh37 FASTA with its .fai index next to it
+REFERENCE_GENOME = os.environ.get('REFERENCE_GENOME', '/opt/reference/hg19.2bit')
+# bases read at a time while shifting an indel through a repeat
+SHIFT_WINDOW = 64
+
+TWOBIT_SIGNATURE = 0x1A412743
+# 2bit packs four bases per byte, T C A G, most significant bits first
+TWOBIT_BYTES = [''.join('TCAG'[(byte >> shift) & 3] for shift in (6, 4, 2, 0)) for byte in range(256)]
+
+# GRCh37 RefSeq accessions with their versions; other versions belong to other assemblies
+GRCH37_VERSIONS = [10, 11, 11, 11, 9, 11, 13, 10, 11, 10, 9, 11, 10, 8, 9, 9, 10, 9, 9, 10, 8, 10, 10, 9]
+ACCESSIONS = {**{f'NC_{i + 1:06d}.{version}': str(i + 1) for i, version in enumerate(GRCH37_VERSIONS[:22])},
+              f'NC_000023.{GRCH37_VERSIONS[22]}': 'X', f'NC_000024.{GRCH37_VERSIONS[23]}': 'Y',
+              'NC_012920.1': 'MT'}
+
+HGVSG = re.compile(r'^(?P<accession>[^:]+):g\.(?P<start>\d+)(?:_(?P<end>\d+))?'
+                   r'(?:(?P<ref>[ACGTN])>(?P<alt>[ACGTN])|(?P<kind>delins|del|dup|ins)(?P<bases>[ACGTN]*))$',
+                   re.IGNORECASE)
+BASES = re.compile(r'^[ACGTN]+$')
+
+class TwoBitReference:
+    """
+    Reads a UCSC 2bit file in place. Runs of N are restored and soft-masking is ignored.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as infile:
+            self._mmap = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        for order in '<>':
+            signature, version, count, _ = struct.unpack_from(order + '4I', self._mmap, 0)
+            if signature == TWOBIT_SIGNATURE:
+                break
+        else:
+            raise ValueError(f"{path} is not a 2bit file")
+        self._order = order
+        # version 1 files use 64-bit offsets
+        offset_format = order + ('Q' if version == 1 else 'I')
+        self._offsets = {}
+        position = 16
+        for _ in range(count):
+            length = self._mmap[position]
+            name = self._mmap[position + 1:position + 1 + length].decode('ascii')
+            self._offsets[name], = struct.unpack_from(offset_format, self._mmap, position + 1 + length)
+            position += 1 + length + struct.calcsize(offset_format)
+        self.names = {normalize_chromosome(name): name for name in self._offsets}
+        self._records = {}
+
+    def _uint32s(self, offset, count):
+        values = array('I', self._mmap[offset:offset + 4 * count])
+        if (self._order == '<') != (sys.byteorder == 'little'):
+            values.byteswap()
+        return values, offset + 4 * count
+
+    def _record(self, chrom):
+        name = self.names.get(normalize_chromosome(chrom))
+        if name is None:
+            raise ValueError(f"Chromosome {chrom} is not in the reference genome")
+        record = self._records.get(name)
+        if record is None:
+            offset = self._offsets[name]
+            size, blocks = struct.unpack_from(self._order + '2I', self._mmap, offset)
+            n_starts, offset = self._uint32s(offset + 8, blocks)
+            n_sizes, offset = self._uint32s(offset, blocks)
+            masks, = struct.unpack_from(self._order + 'I', self._mmap, offset)
+            # skip the mask blocks and the reserved word
+            offset += 4 + 8 * masks + 4
+            record = self._records[name] = (size, n_starts, n_sizes, offset)
+        return record
+
+    def length(self, chrom):
+        return self._record(chrom)[0]
+
+    def sequence(self, chrom, start, end):
+        size, n_starts, n_sizes, dna = self._record(chrom)
+        start, end = max(start, 0), min(end, size)
+        if start >= end:
+            return ''
+        packed = self._mmap[dna + start // 4:dna + (end + 3) // 4]
+        bases = ''.join([TWOBIT_BYTES[x] for x in packed])[start % 4:start % 4 + end - start]
+        i = max(bisect_right(n_starts, start) - 1, 0)
+        while i < len(n_starts) and n_starts[i] < end:
+            n_start, n_end = max(n_starts[i], start), min(n_starts[i] + n_sizes[i], end)
+            if n_start < n_end:
+                bases = bases[:n_start - start] + 'N' * (n_end - n_start) + bases[n_end - start:]
+            i += 1
+        return bases
+
+class FastaReference:
+    """
+    Reads a FASTA file in place through its samtools faidx index (path + '.fai').
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as infile:
+            self._mmap = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        self._index = {}
+        with open(path + '.fai') as index:
+            for line in index:
+                name, size, offset, line_bases, line_width = line.split('\t')[:5]
+                self._index[name] = (int(size), int(offset), int(line_bases), int(line_width))
+        self.names = {normalize_chromosome(name): name for name in self._index}
+
+    def _record(self, chrom):
+        name = self.names.get(normalize_chromosome(chrom))
+        if name is None:
+            raise ValueError(f"Chromosome {chrom} is not in the reference genome")
+        return self._index[name]
+
+    def length(self, chrom):
+        return self._record(chrom)[0]
+
+    def sequence(self, chrom, start, end):
+        size, offset, line_bases, line_width = self._record(chrom)
+        start, end = max(start, 0), min(end, size)
+        if start >= end:
+            return ''
+        first = offset + start // line_bases * line_width + start % line_bases
+        last = offset + (end - 1) // line_bases * line_width + (end - 1) % line_bases
+        return self._mmap[first:last + 1].replace(b'\n', b'').replace(b'\r', b'').decode('ascii').upper()
+
+def open_reference(path):
+    if path.endswith('.2bit'):
+        return TwoBitReference(path)
+    return FastaReference(path)
+
+@once
+def get_reference():
+    if os.path.exists(REFERENCE_GENOME):
+        return open_reference(REFERENCE_GENOME)
+    return None
+
+def use_reference(path):
+    global REFERENCE_GENOME
+    REFERENCE_GENOME = path
+    get_reference.reset()
+
+def chromosome_name(accession):
+    if accession.upper().startswith('NC_'):
+        chrom = ACCESSIONS.get(accession.upper())
+        if chrom is None:
+            # e.g. NC_000017.11 is chr17 of GRCh38, whose coordinates would be read as GRCh37 ones
+            raise ValueError(f"{accession} is not a GRCh37 RefSeq accession")
+        return chrom
+    return normalize_chromosome(accession)
+
+def require(reference, notation):
+    if reference is None:
+        raise ValueError(f"{notation} cannot be converted without a reference genome")
+    return reference
+
+def match_hgvsg(notation):
+    match = HGVSG.match("".join(unquote(notation).split()))
+    if match is None:
+        raise ValueError(f"Unsupported HGVS notation: {notation}")
+    return match
+
+def hgvsg_interval(notation):
+    match = match_hgvsg(notation)
+    start = int(match['start'])
+    return chromosome_name(match['accession']), start, int(match['end'] or start)
+
+def parse_hgvsg(notation, reference=None):
+    """
+    convert a genomic HGVS notation to a VCF tuple. deletions, duplications and
+    insertions are padded with the preceding base, as in VCF.
+    returns (chromosome, position, reference, alternate) and raises ValueError if
+    the notation is not supported or needs bases that are not available.
+    """
+    match = match_hgvsg(notation)
+    chrom = chromosome_name(match['accession'])
+    start = int(match['start'])
+    end = int(match['end'] or start)
+    if match['ref']:
+        if match['end']:
+            raise ValueError(f"Unsupported HGVS notation: {notation}")
+        return chrom, start, match['ref'].upper(), match['alt'].upper()
+    kind, bases = match['kind'].lower(), match['bases'].upper()
+    if end < start or (kind == 'ins' and end != start + 1) or (kind == 'ins' and not bases):
+        raise ValueError(f"Unsupported HGVS notation: {notation}")
+    if kind == 'ins':
+        anchor = require(reference, notation).sequence(chrom, start - 1, start)
+        return chrom, start, anchor, anchor + bases
+    reference = require(reference, notation)
+    if kind == 'delins':
+        if not bases:
+            raise ValueError(f"Unsupported HGVS notation: {notation}")
+        return chrom, start, reference.sequence(chrom, start - 1, end), bases
+    # del and dup: the base before the affected bases is the VCF padding
+    if start == 1:
+        raise ValueError(f"{notation} has no preceding base to pad with")
+    region = reference.sequence(chrom, start - 2, end)
+    if bases and bases != region[1:]:
+        raise ValueError(f"{notation} does not match the reference genome")
+    if kind == 'del':
+        return chrom, start - 1, region, region[0]
+    return chrom, end, region[-1], region[-1] + region[1:]
+
+def trim(position, ref, alt):
+    while len(ref) > 1 and len(alt) > 1 and ref[-1] == alt[-1]:
+        ref, alt = ref[:-1], alt[:-1]
+    while len(ref) > 1 and len(alt) > 1 and ref[0] == alt[0]:
+        ref, alt, position = ref[1:], alt[1:], position + 1
+    return position, ref, alt
+
+def normalize_variant(chrom, position, ref, alt, reference=None):
+    """
+    left-align and trim a VCF tuple (Tan et al. 2015): shared trailing bases are
+    removed, an allele that becomes empty is extended with the preceding base,
+    and finally shared leading bases are removed down to one base of padding.
+    returns the normalized (chromosome, position, reference, alternate).
+    """
+    chrom = chromosome_name(str(chrom))
+    position, ref, alt = int(position), ref.upper(), alt.upper()
+    if ref == alt or not BASES.match(ref) or not BASES.match(alt):
+        # symbolic, missing and no-change alleles are left as they are
+        return chrom, position, ref, alt
+    if reference is None or chrom not in reference.names:
+        return (chrom, *trim(position, ref, alt))
+    window = ''
+    while True:
+        if ref and alt and ref[-1] == alt[-1]:
+            ref, alt = ref[:-1], alt[:-1]
+        elif (not ref or not alt) and position > 1:
+            if not window:
+                window = reference.sequence(chrom, max(position - 1 - SHIFT_WINDOW, 0), position - 1)
+            base, window = window[-1], window[:-1]
+            ref, alt, position = base + ref, base + alt, position - 1
+        else:
+            break
+    return (chrom, *trim(position, ref, alt))
+
+def right_align(chrom, position, ref, alt, reference):
+    """
+    shift an unpadded insertion or deletion to its 3' most position. returns (position, ref, alt).
+    """
+    size = reference.length(chrom)
+    window = ''
+    while position - 1 + len(ref) < size:
+        if not window:
+            following = position - 1 + len(ref)
+            window = reference.sequence(chrom, following, following + SHIFT_WINDOW)
+        allele = ref or alt
+        if allele[0] != window[0]:
+            break
+        # rotate the inserted or deleted bases past the next reference base
+        allele, window, position = allele[1:] + window[0], window[1:], position + 1
+        if ref:
+            ref = allele
+        else:
+            alt = allele
+    return position, ref, alt
+
+def format_hgvsg(chrom, position, ref, alt, reference=None):
+    """
+    convert a VCF tuple to a genomic HGVS notation. with a reference, indels are
+    shifted 3' and insertions of the preceding bases are written as dup.
+    """
+    chrom, position, ref, alt = normalize_variant(chrom, position, ref, alt, reference)
+    if ref == alt or not BASES.match(ref) or not BASES.match(alt):
+        raise ValueError(f"{chrom}-{position}-{ref}-{alt} has no HGVS notation")
+    # drop the padding; trailing bases were already trimmed
+    if ref[0] == alt[0] and (len(ref) == 1 or len(alt) == 1):
+        ref, alt, position = ref[1:], alt[1:], position + 1
+    if reference is not None and (not ref or not alt) and chrom in reference.names:
+        position, ref, alt = right_align(chrom, position, ref, alt, reference)
+    end = position + len(ref) - 1
+    span = f"{position}_{end}" if end > position else f"{position}"
+    if len(ref) == 1 and len(alt) == 1:
+        change = f"{position}{ref}>{alt}"
+    elif not alt:
+        change = f"{span}del"
+    elif not ref:
+        preceding = reference.sequence(chrom, position - 1 - len(alt), position - 1) if reference is not None else None
+        if preceding == alt:
+            start = position - len(alt)
+            change = f"{start}_{position - 1}dup" if len(alt) > 1 else f"{start}dup"
+        else:
+            change = f"{position - 1}_{position}ins{alt}"
+    else:
+        change = f"{span}delins{alt}"
+    return f"{chrom}:g.{change}"
+
+def canonical_variant(chrom, position, ref, alt):
+    return normalize_variant(chrom, position, ref, alt, get_reference())
+
+def canonical_hgvsg(notation):
+    reference = get_reference()
+    return format_hgvsg(*parse_hgvsg(notation, reference), reference)
@@ -0,0 +1,161 @@
+import json
+import threading
+from HttpClient import http
+from ResponseCache import ResponseCache
+from VariantNormalizer import canonical_hgvsg
+
+"""
+VepAnnotation Module
+This module provides a shared VEP annotation layer for QueryVep, QueryOncoKb and QueryGeneInformation.
+A single request with the superset of query flags is sent to VEP for each normalized notation, spelled as
+the caller gave it, and the response is kept in the 'vep' ResponseCache, keyed on the normalized notation
+and the flags. Concurrent callers asking for the same variant share one request and its answer. Its memory
+tier belongs to one process, so it is only shared by the three handlers where they run in the same one,
+as inside QueryAggregator; deployed as separate functions they share responses through the SQLite tier
+only when RESPONSE_CACHE_PATH is on a volume mounted by all of them.
+Functions:
+    normalize_notation(notation: str) -> str:
+        The cache key of a HGVS notation, shared by equivalent spellings and equivalent indel positions.
+    get_transcript_consequences(notation: str, flags: tuple) -> list:
+        Returns the VEP transcript consequences for a notation, fetching them with a GET request on a cache miss.
+    get_transcript_consequences_batch(notations: list, flags: tuple) -> dict:
+        Returns transcript consequences keyed by notation, fetching cache misses with chunked POST requests.
+"""
+
+VEP_ENDPOINT = "https://grch37.rest.ensembl.org/vep/human/hgvs"
+# Ensembl REST caps POST requests to the VEP endpoint at 200 notations
+VEP_BATCH_SIZE = 200
+
+DBNSFP_FIELDS = ("BayesDel_addAF_score", "BayesDel_noAF_score", "MetaLR_score", "MetaRNN_score",
+                 "MetaSVM_score", "SIFT_score", "polyphen_score", "DANN_score", "fathmm-MKL_coding_score",
+                 "MutationTaster_score", "PROVEAN_score", "MutPred_score", "CADD_phred")
+
+# superset of the flags needed by every consumer; plain refseq/hgvs lookups are served from it
+SUPERSET_FLAGS = (("CADD", "1"),
+                  ("dbNSFP", ",".join(DBNSFP_FIELDS)),
+                  ("hgvs", "1"),
+                  ("maxEntScan", "1"),
+                  ("refseq", "1"))
+
+# (notation, flags) -> transcript consequences, None for notations VEP could not annotate
+vep_cache = ResponseCache('vep', ttl=3600, negative_ttl=3600)
+_inflight_lock = threading.Lock()
+# (notation, flags) -> {'done': Event set once the fetch in progress completes, 'consequences': its result},
+# so that concurrent callers (e.g. the aggregator's threads) share one request, cached or not
+_inflight = {}
+
+def normalize_notation(notation):
+    try:
+        return canonical_hgvsg(notation)
+    except ValueError:
+        # not a supported g. notation, or the reference genome is not deployed
+        pass
+    notation = "".join(notation.split())
+    accession, _, change = notation.partition(':')
+    return f"{accession}:{change}" if change else accession
+
+def build_query(flags):
+    return "&".join(f"{k}={v}" for k, v in flags)
+
+def fetch_annotation(notation, flags=SUPERSET_FLAGS):
+    """
+    GET a single notation from VEP.
+    returns (True, consequences) on a 200 response and (False, None) otherwise
+    so that transient upstream errors are never cached.
+    """
+    API_ENDPOINT = f"{VEP_ENDPOINT}/{notation}?{build_query(flags)}&content-type=application/json"
+    response = http.request('GET', API_ENDPOINT)
+    if response.status == 200:
+        data = json.loads(response.data)
+        try:
+            return True, data[0].get('transcript_consequences')
+        except (IndexError, AttributeError):
+            return True, None
+    return False, None
+
+def fetch_annotations(notations, flags=SUPERSET_FLAGS):
+    """
+    POST notations to VEP in chunks of VEP_BATCH_SIZE.
+    returns a dictionary of notation -> (cacheable, consequences).
+    """
+    API_ENDPOINT = f"{VEP_ENDPOINT}?{build_query(flags)}"
+    results = {}
+    for i in range(0, len(notations), VEP_BATCH_SIZE):
+        chunk = notations[i:i + VEP_BATCH_SIZE]
+        response = http.request('POST', API_ENDPOINT,
+                                body=json.dumps({"hgvs_notations": chunk}),
+                                headers={"Content-Type": "application/json",
+                                         "Accept": "application/json"})
+        if response.status == 200:
+            for notation in chunk:
+                results[notation] = (True, None)
+            for annotation in json.loads(response.data):
+                if annotation.get('input') in results:
+                    results[annotation['input']] = (True, annotation.get('transcript_consequences'))
+        elif response.status == 400:
+            # VEP rejects the whole POST if a single notation cannot be parsed,
+            # so fall back to individual lookups to isolate the failures
+            for notation in chunk:
+                results[notation] = fetch_annotation(notation, flags)
+        else:
+            # rate limited, unavailable or timed out: retrying each notation would only
+            # multiply the calls to a failing upstream, so the chunk fails uncached
+            for notation in chunk:
+                results[notation] = (False, None)
+    return results
+
+def get_transcript_consequences(notation, flags=SUPERSET_FLAGS):
+    """
+    returns the transcript consequences for a notation, or None if VEP
+    could not annotate it. The returned list is shared with the cache and
+    must not be modified by callers.
+    """
+    key = (normalize_notation(notation), flags)
+    found, consequences = vep_cache.get(key)
+    if found:
+        return consequences
+    entry = {'done': threading.Event(), 'consequences': None}
+    with _inflight_lock:
+        pending = _inflight.get(key)
+        if pending is None:
+            _inflight[key] = entry
+    if pending is not None:
+        # the answer of the request in progress, even one that failed and was not cached
+        pending['done'].wait()
+        return pending['consequences']
+    try:
+        cacheable, consequences = vep_cache.timed_fetch(lambda: fetch_annotation(notation, flags))
+        entry['consequences'] = consequences
+        if cacheable:
+            vep_cache.put(key, consequences, negative=consequences is None)
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key)
+        entry['done'].set()
+    return consequences
+
+def get_transcript_consequences_batch(notations, flags=SUPERSET_FLAGS):
+    """
+    returns a dictionary of input notation -> transcript consequences
+    (None for notations VEP could not annotate).
+    """
+    keys = {notation: normalize_notation(notation) for notation in notations}
+    results = {}
+    # cache key -> the first notation with that key, sent to VEP as the caller spelled it
+    misses = {}
+    for notation, key in keys.items():
+        if key in results or key in misses:
+            continue
+        found, consequences = vep_cache.get((key, flags))
+        if found:
+            results[key] = consequences
+        else:
+            misses[key] = notation
+    if misses:
+        fetched = vep_cache.timed_fetch(lambda: fetch_annotations(list(misses.values()), flags))
+        for key, notation in misses.items():
+            cacheable, consequences = fetched[notation]
+            if cacheable:
+                vep_cache.put((key, flags), consequences, negative=consequences is None)
+            results[key] = consequences
+    return {notation: results.get(key) for notation, key in keys.items()}
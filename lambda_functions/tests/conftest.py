@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the lambda functions import each other as top-level modules, as they are deployed,
+# and the stores are built with the scripts in utils/
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS, '..', '..', 'utils'))
+sys.path.insert(0, os.path.join(TESTS, '..'))
@@ -0,0 +1,62 @@
+import random
+
+from BuildClinvarStore import build_store, read_records
+from ClinvarStore import COLUMNS, ClinvarStore
+
+HEADER = '\t'.join(COLUMNS) + '\n'
+
+def row(chrom, position, reference, alternate, variation_id, disease='not provided'):
+    return [chrom, str(position), reference, alternate, str(variation_id),
+            'Pathogenic', 'criteria provided, single submitter', disease]
+
+def build(tmp_path, rows, block_size=4):
+    tsv = tmp_path / 'clinvar.tsv'
+    with open(tsv, 'w', encoding='utf-8') as outfile:
+        outfile.write(HEADER)
+        for fields in rows:
+            outfile.write('\t'.join(fields) + '\n')
+    path = str(tmp_path / 'clinvar.store')
+    build_store(read_records(str(tsv)), path, block_size)
+    return ClinvarStore(path)
+
+def test_lookup_finds_every_record(tmp_path):
+    rng = random.Random(1)
+    rows = [row(rng.choice(['1', 'chr2', 'X', 'MT']), rng.randint(1, 5000), rng.choice('ACGT'),
+                rng.choice(['A', 'C', 'G', 'T', 'TA']), i) for i in range(300)]
+    store = build(tmp_path, rows)
+    assert len(store) == len(rows)
+    for fields in rows:
+        matches = store.lookup(*fields[:4])
+        assert fields[4] in [x['variation_id'] for x in matches]
+        assert all(x['reference'] == fields[2] and x['alternate'] == fields[3] for x in matches)
+
+def test_records_sharing_a_key_span_blocks(tmp_path):
+    # ten records at one position fill three blocks of four; the key starts mid-block
+    rows = [row('1', 100, 'A', 'G', 1), row('1', 150, 'C', 'T', 2)]
+    rows += [row('1', 200, 'G', alternate, 10 + i) for i, alternate in enumerate(['A', 'C', 'T'] * 3 + ['AT'])]
+    rows += [row('1', 300, 'T', 'C', 3)]
+    store = build(tmp_path, rows)
+    assert sorted(x['variation_id'] for x in store.lookup('1', 200, 'G', 'A')) == ['10', '13', '16']
+    assert [x['variation_id'] for x in store.lookup('chr1', 200, 'g', 'at')] == ['19']
+    assert len(store.region('1', 200, 200)) == 10
+    assert [x['position'] for x in store.region('1', 101, 299)] == ['150'] + ['200'] * 10
+
+def test_region_and_misses(tmp_path):
+    store = build(tmp_path, [row('1', 100, 'A', 'G', 1), row('2', 100, 'A', 'G', 2), row('X', 5, 'C', 'T', 3)])
+    assert [x['chrom'] for x in store.region('1', 1, 10 ** 9)] == ['1']
+    assert store.lookup('1', 100, 'A', 'C') == []
+    assert store.lookup('1', 101, 'A', 'G') == []
+    assert store.lookup('Y', 100, 'A', 'G') == []
+    assert store.region('2', 101, 200) == []
+
+def test_header_and_rows_without_coordinates_are_skipped(tmp_path):
+    rows = [row('1', 100, 'A', 'G', 1), row('1', '', 'A', 'G', 2), row('1', 'NA', 'A', 'G', 3), ['1', '100', 'A']]
+    store = build(tmp_path, rows)
+    assert len(store) == 1
+
+def test_line_separators_inside_a_field(tmp_path):
+    # splitlines would break these records apart
+    diseases = ['Disease type 1', 'Disease\x85type 2', 'Disease\x1ctype 3']
+    store = build(tmp_path, [row('1', 100 + i, 'A', 'G', i, disease) for i, disease in enumerate(diseases)],
+                  block_size=2)
+    assert [x['disease'] for x in store.region('1', 1, 1000)] == diseases
@@ -0,0 +1,55 @@
+import random
+
+import BuildGeneIndex
+from GeneIntervalStore import GeneIntervalStore
+
+def gtf_line(chrom, feature, start, end, attributes):
+    return f"{chrom}\tRefSeq\t{feature}\t{start}\t{end}\t.\t+\t.\t{attributes}\n"
+
+def build(tmp_path, lines, *options):
+    gtf = tmp_path / 'genes.gtf'
+    gtf.write_text("#!genome-build GRCh37\n" + "".join(lines))
+    store = str(tmp_path / 'genes.store')
+    BuildGeneIndex.main(BuildGeneIndex.parser.parse_args(['-i', str(gtf), '-o', store, *options]))
+    return GeneIntervalStore(store)
+
+def test_overlapping_matches_a_scan(tmp_path):
+    rng = random.Random(1)
+    genes = {}
+    for i in range(200):
+        start = rng.randint(1, 100000)
+        genes[f'G{i}'] = (rng.choice(['1', '2']), start, start + rng.randint(0, 3000))
+    # a long gene that earlier and later genes nest inside
+    genes['LONG'] = ('1', 500, 90000)
+    lines = [gtf_line(chrom, 'exon', start, end, f'gene_id "{name}"; gene_name "{name}";')
+             for name, (chrom, start, end) in genes.items()]
+    store = build(tmp_path, lines)
+    assert len(store) == len(genes)
+    for _ in range(500):
+        chrom, start = rng.choice(['1', '2']), rng.randint(1, 105000)
+        end = start + rng.choice([0, 0, 10, 5000])
+        found = store.overlapping(chrom, start, end)
+        expected = {name for name, (gene_chrom, gene_start, gene_end) in genes.items()
+                    if gene_chrom == chrom and gene_start <= end and gene_end >= start}
+        assert {x['symbol'] for x in found} == expected
+        starts = [genes[x['symbol']][1] for x in found]
+        assert starts == sorted(starts)
+
+def test_gene_spans_its_features(tmp_path):
+    lines = [gtf_line('NC_000017.10', 'exon', 7572927, 7573008,
+                      'gene_id "TP53"; transcript_id "NM_000546.5"; db_xref "HGNC:11998"; db_xref "GeneID:7157";'),
+             gtf_line('NC_000017.10', 'exon', 7590695, 7590856, 'gene_id "TP53"; db_xref "GeneID:7157";'),
+             gtf_line('chr17', 'gene', 7565097, 7565100, 'gene_id "ENSG1"; gene_name "OTHER";')]
+    store = build(tmp_path, lines)
+    assert store.overlapping('17', 7580000) == [{'symbol': 'TP53', 'entrez': '7157'}]
+    assert store.overlapping('chr17', 7565000, 7572927) == [{'symbol': 'OTHER', 'entrez': None},
+                                                            {'symbol': 'TP53', 'entrez': '7157'}]
+    assert store.overlapping('17', 7590857) == []
+    assert store.overlapping('1', 7580000) == []
+
+def test_entrez_ids_from_gene_info(tmp_path):
+    gene_info = tmp_path / 'gene_info'
+    gene_info.write_text("#tax_id\tGeneID\tSymbol\n9606\t672\tBRCA1\n10090\t12189\tBRCA1\n")
+    lines = [gtf_line('17', 'gene', 41196312, 41277500, 'gene_id "ENSG00000012048"; gene_name "BRCA1";')]
+    store = build(tmp_path, lines, '--gene-info', str(gene_info))
+    assert store.overlapping('17', 41200000) == [{'symbol': 'BRCA1', 'entrez': '672'}]
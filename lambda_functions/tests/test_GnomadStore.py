@@ -0,0 +1,81 @@
+import gzip
+import random
+
+import pytest
+
+import BuildGnomadStore
+from GnomadStore import GnomadStore
+
+HEADER = "##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+def vcf_line(chrom, position, reference, alternates, info, filters='PASS'):
+    return f"{chrom}\t{position}\t.\t{reference}\t{alternates}\t.\t{filters}\t{info}\n"
+
+def build(tmp_path, lines, *options, compress=False):
+    path = tmp_path / ('sites.vcf.gz' if compress else 'sites.vcf')
+    with (gzip.open(path, 'wt') if compress else open(path, 'w')) as outfile:
+        outfile.write(HEADER + "".join(lines))
+    store = str(tmp_path / 'gnomad.store')
+    BuildGnomadStore.main(BuildGnomadStore.parser.parse_args(
+        ['-i', str(path), '-o', store, '--data-type', 'exome', *options]))
+    return GnomadStore(store)
+
+def test_lookup_finds_every_allele(tmp_path):
+    rng = random.Random(1)
+    variants, lines = {}, []
+    for chrom in ['1', '2', 'X']:
+        # unsorted within the chromosome, with repeated positions
+        for position in rng.sample(range(1, 200), 60) + [50, 50]:
+            reference = rng.choice('ACGT')
+            alternates = rng.sample(['A', 'C', 'G', 'T', 'AT', 'GCC'], rng.randint(1, 3))
+            ac = [rng.randint(1, 100) for _ in alternates]
+            if any((chrom, position, reference, x) in variants for x in alternates):
+                continue
+            for alternate, count in zip(alternates, ac):
+                variants[(chrom, position, reference, alternate)] = count
+            lines.append(vcf_line(f'chr{chrom}', position, reference, ','.join(alternates),
+                                  f"AC={','.join(map(str, ac))};AN=200"))
+    store = build(tmp_path, lines, compress=True)
+    assert len(store) == len(variants)
+    keys = list(store._keys)
+    assert keys == sorted(keys)
+    for (chrom, position, reference, alternate), ac in variants.items():
+        result = store.lookup(chrom, position, reference.lower(), alternate)
+        assert result['exome_ac'] == ac
+        assert result['exome_af'] == ac / 200
+    assert store.lookup('1', 50, 'N', 'A') is None
+    assert store.lookup('Y', 50, 'A', 'C') is None
+
+def test_fields(tmp_path):
+    info = ("AC=3,1;AN=100;AF=0.03,0.01;nhomalt=1,0;AC_male=2,1;"
+            "AC_afr=1,0;AN_afr=10,10;AC_nfe=2,1;AN_nfe=40,40;"
+            "faf99_afr=0.001,.;faf99_nfe=0.002,0.0005;faf99_asj=0.5,0.5;faf99_fin=0.4,0.4")
+    store = build(tmp_path, [vcf_line('1', 10, 'A', 'G,T', info), vcf_line('X', 10, 'A', 'G,T', info)])
+    result = store.lookup('1', 10, 'A', 'G')
+    assert (result['exome_ac'], result['exome_an'], result['exome_af']) == (3, 100, 0.03)
+    assert (result['exome_ac_hom'], result['exome_ac_hemi']) == (1, 0)
+    populations = {x['id']: (x['ac'], x['an']) for x in result['populations']}
+    assert populations['afr'] == (1, 10) and populations['nfe'] == (2, 40) and populations['sas'] == (0, 0)
+    # asj and fin are left out of the popmax, as in gnomAD
+    assert result['exome_faf'] == {'popmax': 0.002, 'popmax_population': 'nfe'}
+    result = store.lookup('1', 10, 'A', 'T')
+    assert result['exome_faf'] == {'popmax': 0.0005, 'popmax_population': 'nfe'}
+    # only X and Y have hemizygous counts
+    assert store.lookup('X', 10, 'A', 'T')['exome_ac_hemi'] == 1
+
+def test_missing_values(tmp_path):
+    store = build(tmp_path, [vcf_line('1', 10, 'A', 'G', "AC=2;AN=0")])
+    result = store.lookup('1', 10, 'A', 'G')
+    assert result['exome_af'] == 0.0
+    assert result['exome_faf'] == {'popmax': None, 'popmax_population': None}
+
+def test_pass_only(tmp_path):
+    lines = [vcf_line('1', 10, 'A', 'G', "AC=1;AN=2"), vcf_line('1', 20, 'A', 'G', "AC=1;AN=2", 'AC0')]
+    store = build(tmp_path, lines, '--pass-only')
+    assert store.lookup('1', 10, 'A', 'G') is not None
+    assert store.lookup('1', 20, 'A', 'G') is None
+
+def test_chromosomes_must_be_grouped(tmp_path):
+    lines = [vcf_line(chrom, 10, 'A', 'G', "AC=1;AN=2") for chrom in ['1', '2', '1']]
+    with pytest.raises(ValueError):
+        build(tmp_path, lines)
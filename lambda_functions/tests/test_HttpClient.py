@@ -0,0 +1,115 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('urllib3')
+import HttpClient
+import Metrics
+from HttpClient import MAX_WAIT, TokenBucket, failed_response, retry_wait
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    a monotonic clock that only moves when the code under test sleeps
+    """
+    clock = SimpleNamespace(now=1000.0, sleeps=[])
+    def sleep(seconds):
+        clock.sleeps.append(seconds)
+        clock.now += seconds
+    monkeypatch.setattr(HttpClient.time, 'monotonic', lambda: clock.now)
+    monkeypatch.setattr(HttpClient.time, 'sleep', sleep)
+    return clock
+
+def test_burst_then_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.acquire() for _ in range(3)] == [0, 0, 0]
+    # the fourth token refills at two per second
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert clock.now == pytest.approx(1000.5)
+
+def test_tokens_refill_up_to_the_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    clock.now += 60
+    assert [bucket.acquire() for _ in range(3)] == [0, 0, 0]
+    assert bucket.acquire() > 0
+
+def test_acquire_gives_up_after_max_wait(clock):
+    bucket = TokenBucket(rate=0.01, capacity=1)
+    bucket.acquire()
+    # the next token is 100 s away; the request is sent without one
+    assert bucket.acquire(max_wait=2) == 0
+    assert clock.sleeps == []
+
+def test_observe_follows_the_upstream_limits(clock):
+    bucket = TokenBucket(rate=20, capacity=20)
+    bucket.observe(200, {'X-RateLimit-Limit': '10', 'X-RateLimit-Period': '5', 'X-RateLimit-Remaining': '1'})
+    assert bucket.rate == 2
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(0.5)
+
+def test_exhausted_window_blocks_until_the_reset(clock):
+    bucket = TokenBucket(rate=20, capacity=20)
+    bucket.observe(200, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '3'})
+    assert bucket.acquire() == pytest.approx(3)
+
+def test_retry_after_is_capped(clock):
+    bucket = TokenBucket(rate=20, capacity=20)
+    bucket.observe(429, {'Retry-After': '3600'})
+    assert bucket.blocked_until == pytest.approx(clock.now + MAX_WAIT)
+    # a request with less time left than the block is not held back
+    assert bucket.acquire(max_wait=1) == 0
+    assert bucket.acquire() == pytest.approx(MAX_WAIT)
+
+def test_retry_wait(monkeypatch):
+    monkeypatch.setattr(HttpClient.random, 'uniform', lambda low, high: 1.0)
+    assert retry_wait(0, None) == HttpClient.BACKOFF_FACTOR
+    assert retry_wait(2, None) == HttpClient.BACKOFF_FACTOR * 4
+    assert retry_wait(0, SimpleNamespace(headers={'Retry-After': '3'})) == 3
+    assert retry_wait(0, SimpleNamespace(headers={'Retry-After': '3600'})) == MAX_WAIT
+    assert retry_wait(20, None) == MAX_WAIT
+
+def test_failed_response():
+    response = failed_response(TimeoutError('read timed out'))
+    assert response.status == HttpClient.FAILED_STATUS
+    body = json.loads(response.data)
+    assert body['error'] == 'read timed out'
+    assert body['errors'][0]['message'] == 'Upstream request failed: read timed out'
+
+@pytest.fixture
+def upstream(clock, monkeypatch):
+    """
+    a client whose requests each take upstream.seconds on the clock, recording their read timeouts
+    """
+    upstream = SimpleNamespace(seconds=0, timeouts=[])
+    def request(method, url, timeout=None, **kwargs):
+        upstream.timeouts.append(timeout.read_timeout)
+        clock.now += upstream.seconds
+        return SimpleNamespace(status=200, headers={}, data=b'{}')
+    client = HttpClient.SharedClient()
+    client._pool = SimpleNamespace(request=request)
+    monkeypatch.setattr(HttpClient, 'RATE_LIMITED', False)
+    upstream.client = client
+    return upstream
+
+def test_chained_requests_share_the_invocation_deadline(upstream, monkeypatch):
+    monkeypatch.setattr(Metrics, 'INVOCATION_BUDGET', 12)
+    @Metrics.instrumented_handler('chained')
+    def handler(event, context):
+        upstream.seconds = 8
+        first = upstream.client.request('GET', 'https://grch37.rest.ensembl.org/vep')
+        second = upstream.client.request('GET', 'https://www.oncokb.org/api')
+        upstream.seconds = 0
+        third = upstream.client.request('GET', 'https://eutils.ncbi.nlm.nih.gov/gene')
+        return [first.status, second.status, third.status]
+    monkeypatch.setattr(Metrics, 'LOG_STREAM', SimpleNamespace(write=lambda line: None))
+    # the second request only has what the first left of the 12 s, and the third is not sent
+    assert handler({}, None) == [200, 200, HttpClient.FAILED_STATUS]
+    assert upstream.timeouts == [HttpClient.READ_TIMEOUT, pytest.approx(4)]
+    assert Metrics.deadline() is None
+
+def test_requests_outside_a_handler_keep_the_request_budget(upstream):
+    upstream.client.request('GET', 'https://grch37.rest.ensembl.org/vep')
+    assert upstream.timeouts == [HttpClient.READ_TIMEOUT]
@@ -0,0 +1,75 @@
+import io
+import json
+import re
+from types import SimpleNamespace
+
+import pytest
+
+import Metrics
+
+@pytest.fixture
+def log(monkeypatch):
+    log = io.StringIO()
+    monkeypatch.setattr(Metrics, 'LOG_STREAM', log)
+    monkeypatch.setattr(Metrics, 'ENABLED', True)
+    return lambda: [json.loads(line) for line in log.getvalue().splitlines()]
+
+@Metrics.timed('parse')
+def parse(value):
+    return int(value)
+
+@Metrics.instrumented_handler('Example')
+def handler(event, context):
+    with Metrics.span('vep'):
+        pass
+    with Metrics.span('vep'):
+        parse('1')
+    Metrics.record('oncokb', 0.25)
+    Metrics.count('cache.hit')
+    Metrics.count('cache.hit', 2)
+    if event.get('fail'):
+        raise ValueError(event['fail'])
+    return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': '{}'}
+
+def test_emf_record(log):
+    handler({}, SimpleNamespace(aws_request_id='request-1'))
+    [record] = log()
+    [directive] = record['_aws']['CloudWatchMetrics']
+    assert directive['Namespace'] == Metrics.NAMESPACE and directive['Dimensions'] == [['Handler']]
+    assert {x['Name']: x['Unit'] for x in directive['Metrics']} == {
+        'vep': 'Milliseconds', 'parse': 'Milliseconds', 'oncokb': 'Milliseconds', 'total': 'Milliseconds',
+        'cache.hit': 'Count'}
+    assert record['Handler'] == 'Example' and record['requestId'] == 'request-1' and record['statusCode'] == 200
+    # every metric named in the directive is a member of the record
+    assert all(x['Name'] in record for x in directive['Metrics'])
+    assert record['calls'] == {'vep': 2, 'parse': 1, 'oncokb': 1}
+    assert record['oncokb'] == 250 and record['cache.hit'] == 3
+    assert record['total'] >= record['vep'] >= record['parse']
+
+def test_failed_invocations_are_recorded(log):
+    with pytest.raises(ValueError):
+        handler({'fail': 'bad request'}, None)
+    [record] = log()
+    assert record['error'] == 'ValueError' and record['requestId'] is None and 'statusCode' not in record
+    # spans outside of a handler are not collected
+    Metrics.record('vep', 1)
+    Metrics.count('cache.hit')
+    assert len(log()) == 1
+
+def test_server_timing(log, monkeypatch):
+    monkeypatch.setattr(Metrics, 'SERVER_TIMING', True)
+    headers = handler({}, None)['headers']
+    timings = dict(re.fullmatch(r'([\w.]+);dur=(\d+\.\d)', x).groups() for x in headers['Server-Timing'].split(', '))
+    assert list(timings) == ['vep', 'parse', 'oncokb', 'total']
+    assert timings['oncokb'] == '250.0'
+    assert headers['Access-Control-Expose-Headers'] == 'Server-Timing'
+    assert headers['Timing-Allow-Origin'] == '*'
+
+def test_server_timing_can_be_turned_off(log, monkeypatch):
+    monkeypatch.setattr(Metrics, 'SERVER_TIMING', False)
+    assert 'Server-Timing' not in handler({}, None)['headers']
+
+def test_disabled_metrics_are_not_logged(log, monkeypatch):
+    monkeypatch.setattr(Metrics, 'ENABLED', False)
+    assert handler({}, None)['statusCode'] == 200
+    assert log() == []
@@ -0,0 +1,85 @@
+import io
+import json
+import sys
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('urllib3')
+if sys.version_info < (3, 12):
+    # QueryAggregator imports QueryOncoKb, which nests quotes in an f-string
+    pytest.skip('QueryAggregator requires Python 3.12', allow_module_level=True)
+import Metrics
+import QueryAggregator
+
+PARAMS = {'hgvsg': '17:g.7577121G>A', 'chromosome': '17', 'position': '7577121', 'reference': 'G', 'variant': 'A'}
+
+def respond(body, status=200):
+    return lambda event, context: {'statusCode': status, 'body': json.dumps(body)}
+
+@pytest.fixture
+def sources(monkeypatch):
+    """
+    replaces every source's handler with one answering {'source': name}
+    """
+    for name, (_, required, _) in list(QueryAggregator.SOURCES.items()):
+        monkeypatch.setitem(QueryAggregator.SOURCES, name, (respond({'source': name}), required, 1))
+        monkeypatch.setitem(QueryAggregator.TIMEOUTS, name, 1)
+    monkeypatch.setattr(Metrics, 'LOG_STREAM', io.StringIO())
+    return lambda name, handler: monkeypatch.setitem(
+        QueryAggregator.SOURCES, name, (handler, QueryAggregator.SOURCES[name][1], 1))
+
+def aggregate(params):
+    response = QueryAggregator.lambda_handler({'queryStringParameters': params}, None)
+    assert response['statusCode'] == 200
+    return json.loads(response['body'])
+
+def test_every_source_is_merged(sources):
+    body = aggregate(PARAMS)
+    assert not body['partial']
+    assert list(body['sources']) == list(QueryAggregator.SOURCES)
+    for name, result in body['sources'].items():
+        assert result['status'] == 'ok' and result['body'] == {'source': name}
+
+def test_failed_and_slow_sources_do_not_hold_back_the_others(sources, monkeypatch):
+    release = threading.Event()
+    def slow(event, context):
+        release.wait(5)
+        return respond({'source': 'prism'})(event, context)
+    def failing(event, context):
+        raise KeyError('hgvsg')
+    sources('prism', slow)
+    sources('gene', failing)
+    sources('oncokb', respond({'error': 'unauthorized'}, status='401'))
+    monkeypatch.setitem(QueryAggregator.TIMEOUTS, 'prism', 0.2)
+    started = time.monotonic()
+    try:
+        body = aggregate(PARAMS)
+    finally:
+        release.set()
+    assert time.monotonic() - started < 1
+    assert body['partial']
+    assert body['sources']['prism'] == {'status': 'timeout', 'error': 'No response within 0.2 seconds'}
+    assert body['sources']['gene'] == {'status': 'error', 'error': "KeyError: 'hgvsg'"}
+    # a source that answered with an error status is still a response
+    assert body['sources']['oncokb']['statusCode'] == 401
+    assert all(body['sources'][x]['status'] == 'ok' for x in ('vep', 'oncokb', 'gnomad', 'clinvar'))
+
+def test_sources_missing_parameters_are_not_called(sources):
+    calls = []
+    sources('gnomad', lambda event, context: calls.append(event))
+    body = aggregate({'hgvsg': PARAMS['hgvsg'], 'chromosome': '17'})
+    assert body['partial'] and calls == []
+    assert body['sources']['gnomad'] == {'status': 'error', 'error': 'Missing parameters: position, reference, variant'}
+    assert body['sources']['vep']['status'] == 'ok'
+
+def test_sources_run_within_the_invocation_deadline(sources):
+    deadlines = []
+    def handler(event, context):
+        deadlines.append(Metrics.deadline())
+        return respond({})(event, context)
+    sources('vep', handler)
+    started = time.monotonic()
+    aggregate(PARAMS)
+    assert started < deadlines[0] <= time.monotonic() + Metrics.INVOCATION_BUDGET
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+pytest.importorskip('urllib3')
+import QueryGnomAD
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """
+    records the normalized variants looked up; the reference is replaced by a
+    normalizer that only left-trims the shared base of an indel
+    """
+    lookups = []
+    def canonical_variant(chrom, position, ref, alt):
+        if ref[0] == alt[0] and min(len(ref), len(alt)) > 1:
+            return chrom.replace('chr', ''), int(position) + 1, ref[1:], alt[1:]
+        return chrom.replace('chr', ''), int(position), ref, alt
+    def query_gnomad(variants, datasets=(QueryGnomAD.DEFAULT_DATASET,)):
+        lookups.extend(variants)
+        return {(variant, dataset): (None, 'Variant not found') for variant in variants for dataset in datasets}
+    monkeypatch.setattr(QueryGnomAD, 'canonical_variant', canonical_variant)
+    monkeypatch.setattr(QueryGnomAD, 'query_gnomad', query_gnomad)
+    return lookups
+
+def test_query_is_echoed_as_requested(lookups):
+    param = {'chromosome': 'chr17', 'position': '7577120', 'reference': 'GCA', 'variant': 'GC'}
+    response = QueryGnomAD.lambda_handler({'queryStringParameters': param}, None)
+    assert lookups == [('17', 7577121, 'CA', 'C')]
+    assert json.loads(response['body'])['summary']['query'] == {
+        'chromosome': 'chr17', 'position': '7577120', 'reference': 'GCA', 'variant': 'GC'}
+
+def test_batch_echoes_each_requested_variant(lookups):
+    variants = [{'chromosome': 'chr17', 'position': '7577120', 'reference': 'GCA', 'variant': 'GC'},
+                {'chromosome': '17', 'position': 7577121, 'reference': 'CA', 'variant': 'C'}]
+    response = QueryGnomAD.lambda_handler({'body': json.dumps({'variants': variants})}, None)
+    # both spellings are one lookup
+    assert lookups == [('17', 7577121, 'CA', 'C')]
+    body = json.loads(response['body'])
+    assert body['chr17-7577120-GCA-GC'][QueryGnomAD.DEFAULT_DATASET]['summary']['query'] == variants[0]
+    assert body['17-7577121-CA-C'][QueryGnomAD.DEFAULT_DATASET]['summary']['query'] == variants[1]
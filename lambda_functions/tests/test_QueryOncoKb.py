@@ -0,0 +1,63 @@
+import json
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('urllib3')
+if sys.version_info < (3, 12):
+    # QueryOncoKb nests quotes in an f-string
+    pytest.skip('QueryOncoKb requires Python 3.12', allow_module_level=True)
+import QueryOncoKb
+
+GENES = {'BRAF': {'refseq': 'NM_004333', 'description': 'Oncogene'},
+         'TP53': {'refseq': 'NM_000546', 'description': 'Tumor suppressor gene'}}
+REFSEQ = {'NM_004333': 'BRAF', 'NM_000546': 'TP53'}
+
+def consequence(transcript, gene, protein):
+    return {'hgvsc': f'{transcript}.5:c.1A>G', 'gene_symbol': gene, 'hgvsp': f'{transcript}.5:p.{protein}'}
+
+def annotation(gene, alteration):
+    return {'treatments': [], 'oncogenic': f'{gene} {alteration}', 'hotspot': True,
+            'mutationEffect': {'knownEffect': 'Gain-of-function', 'description': ''},
+            'highestSensitiveLevel': None, 'highestDiagnosticImplicationLevel': None, 'highestFdaLevel': None}
+
+@pytest.fixture
+def oncokb(monkeypatch):
+    """
+    records the alterations posted to OncoKB, which annotates each with its gene and alteration
+    """
+    oncokb = SimpleNamespace(queries=[])
+    def request(method, url, body=None, headers=None):
+        queries = json.loads(body)
+        oncokb.queries.extend(queries)
+        data = [annotation(x['gene']['hugoSymbol'], x['alteration']) for x in queries]
+        return SimpleNamespace(status=200, data=json.dumps(data).encode('utf-8'))
+    monkeypatch.setattr(QueryOncoKb.http, 'request', request)
+    monkeypatch.setattr(QueryOncoKb, 'get_oncokb_identifiers', lambda: (GENES, REFSEQ))
+    monkeypatch.setenv('API_KEY', 'key')
+    QueryOncoKb._results.clear()
+    return oncokb
+
+def test_batch_pairs_results_with_their_notations(oncokb, monkeypatch):
+    annotations = {
+        # no transcript in OncoKB's gene list
+        '1:g.100A>G': [consequence('NM_000001', 'OTHER', 'Ala1Gly')],
+        '7:g.140453136A>T': [consequence('NM_004333', 'BRAF', 'Val600Glu')],
+        # not annotated by VEP
+        '1:g.200C>T': None,
+        '17:g.7577121G>A': [consequence('NM_000001', 'OTHER', 'Ala2Gly'),
+                            consequence('NM_000546', 'TP53', 'Arg273His')],
+    }
+    monkeypatch.setattr(QueryOncoKb, 'get_transcript_consequences_batch', lambda notations: annotations)
+    response = QueryOncoKb.lambda_handler({'body': json.dumps({'hgvsg': list(annotations)})}, None)
+    assert response['statusCode'] == json.dumps(200)
+    body = json.loads(response['body'])
+    assert list(body) == list(annotations)
+    assert body['1:g.100A>G'][0]['code'] == 201
+    assert body['1:g.200C>T'][0]['code'] == 201
+    assert body['7:g.140453136A>T'][0]['oncogenecity'] == 'BRAF V600E'
+    assert body['7:g.140453136A>T'][0]['transcript'] == 'NM_004333'
+    assert body['17:g.7577121G>A'][0]['oncogenecity'] == 'TP53 R273H'
+    assert body['17:g.7577121G>A'][0]['geneType'] == 'Tumor suppressor gene'
+    assert [x['alteration'] for x in oncokb.queries] == ['V600E', 'R273H']
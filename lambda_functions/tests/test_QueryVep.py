@@ -0,0 +1,90 @@
+import json
+import math
+
+import pytest
+
+pytest.importorskip('urllib3')
+import QueryVep
+
+def consequences(*scores):
+    """
+    transcript consequences reporting the given tool -> score fields
+    """
+    return [{'hgvsc': f'NM_000546.5:c.{i}G>A', 'hgvsp': f'NP_000537.3:p.Arg{i}His', **fields}
+            for i, fields in enumerate(scores, 1)]
+
+def tool(i):
+    return QueryVep.get_tool_table().rules[i][0]
+
+ANNOTATIONS = {
+    '17:g.7577121G>A': consequences(
+        {tool(0): '0.2', tool(1): '-0.5,.,0.3', tool(2): '.', tool(3): 'invalid_field'},
+        {tool(0): 12.5, tool(4): 'nan', tool(5): 'n/a'},
+        {}) + [{'gene_symbol': 'TP53'}],
+    '7:g.140453136A>T': consequences({tool(1): '1e-3'}),
+    '1:g.100A>G': None,
+}
+
+@pytest.fixture
+def vep(monkeypatch):
+    monkeypatch.setattr(QueryVep, 'get_transcript_consequences_batch',
+                        lambda notations: {x: ANNOTATIONS[x] for x in notations})
+    monkeypatch.setattr(QueryVep, 'get_transcript_consequences', ANNOTATIONS.get)
+
+def number(value):
+    try:
+        value = float(value)
+    except ValueError:
+        return None
+    return value if math.isfinite(value) else None
+
+def expand(body, consequence):
+    """
+    the verbose annotation of a compact one, with its scores as numbers
+    """
+    assert body['format'] == 'compact'
+    predictions = [{'id': tool['id'], 'name': tool['name'], 'description': tool['description'],
+                    'scores': scores or [], 'classification': body['classifications'][code]}
+                   for tool, scores, code in zip(body['tools'], consequence['scores'], consequence['classifications'])]
+    return {'hgvsc': consequence['hgvsc'], 'hgvsp': consequence['hgvsp'], 'predictions': predictions,
+            'total_predictions': consequence['total_predictions'], 'total_pathogenic': consequence['total_pathogenic'],
+            'percent_pathogenic': f"{consequence['percent_pathogenic']:.2f}%"}
+
+def numeric(annotation):
+    for prediction in annotation['predictions']:
+        scores = prediction['scores']
+        if isinstance(scores, str):
+            # the verbose scores of a tool are one string, which may list several values
+            prediction['scores'] = [number(x) for x in scores.split(',')] if scores else []
+        elif not isinstance(scores, list):
+            prediction['scores'] = [number(scores)]
+    return annotation
+
+def post(notations, **fields):
+    response = QueryVep.lambda_handler({'body': json.dumps({'hgvsg': notations, **fields})}, None)
+    assert response['statusCode'] == 200
+    return json.loads(response['body'])
+
+def test_compact_batch_expands_to_the_verbose_batch(vep):
+    verbose = post(list(ANNOTATIONS))
+    compact = post(list(ANNOTATIONS), format='compact')
+    assert set(compact) == {'format', 'tools', 'classifications', 'results'}
+    assert list(compact['results']) == list(verbose)
+    assert compact['results']['1:g.100A>G'] == verbose['1:g.100A>G'] == {'error': 'No variant data available from VEP API'}
+    for notation in ['17:g.7577121G>A', '7:g.140453136A>T']:
+        assert [expand(compact, x) for x in compact['results'][notation]] == [numeric(x) for x in verbose[notation]]
+
+def test_compact_scores(vep):
+    [first, second, third] = post(['17:g.7577121G>A'], format='compact')['results']['17:g.7577121G>A']
+    assert first['scores'][0] == [0.2] and first['scores'][2:4] == [[], None]
+    # repeated values are reported once, in no particular order
+    assert sorted(first['scores'][1]) == [-0.5, 0.3]
+    assert second['scores'][:6] == [[12.5], None, None, None, [None], [None]]
+    assert third['scores'] == [None] * len(QueryVep.get_tool_table().rules)
+    assert third['total_predictions'] == 0 and third['percent_pathogenic'] == 0
+
+def test_compact_single_notation(vep):
+    response = QueryVep.lambda_handler({'queryStringParameters': {'hgvsg': '7:g.140453136A>T', 'format': 'compact'}}, None)
+    compact = json.loads(response['body'])
+    verbose = json.loads(QueryVep.lambda_handler({'queryStringParameters': {'hgvsg': '7:g.140453136A>T'}}, None)['body'])
+    assert [expand(compact, x) for x in compact['consequences']] == [numeric(x) for x in verbose]
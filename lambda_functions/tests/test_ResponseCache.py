@@ -0,0 +1,89 @@
+import pytest
+
+import ResponseCache
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000000.0]
+    monkeypatch.setattr(ResponseCache.time, 'time', lambda: now[0])
+    return now
+
+@pytest.fixture
+def disk(tmp_path, monkeypatch):
+    disk = ResponseCache.DiskTier(str(tmp_path / 'response-cache.sqlite'), 1024 * 1024)
+    monkeypatch.setattr(ResponseCache, 'get_disk', lambda: disk)
+    return disk
+
+def test_entries_expire_after_the_ttl(clock, disk):
+    cache = ResponseCache.ResponseCache('ttl', ttl=100, negative_ttl=10)
+    cache.put(('1', 100, 'A', 'G'), {'af': 0.1})
+    clock[0] += 99
+    assert cache.get(('1', 100, 'A', 'G')) == (True, {'af': 0.1})
+    clock[0] += 2
+    assert cache.get(('1', 100, 'A', 'G')) == (False, None)
+
+def test_negative_entries_use_their_own_ttl(clock, disk):
+    cache = ResponseCache.ResponseCache('negative', ttl=100, negative_ttl=10)
+    cache.put('found', {'af': 0.1})
+    cache.put('missing', None, negative=True)
+    assert cache.get('missing') == (True, None)
+    clock[0] += 11
+    assert cache.get('missing') == (False, None)
+    assert cache.get('found') == (True, {'af': 0.1})
+
+def test_ttls_can_be_set_per_source(monkeypatch):
+    monkeypatch.setenv('CACHE_TTL_ENVIRONMENT', '5')
+    monkeypatch.setenv('CACHE_NEGATIVE_TTL_ENVIRONMENT', '1')
+    cache = ResponseCache.ResponseCache('environment', ttl=100, negative_ttl=10)
+    assert (cache.ttl, cache.negative_ttl) == (5, 1)
+
+def test_memory_tier_evicts_the_least_recently_used(clock, disk, monkeypatch):
+    monkeypatch.setattr(ResponseCache, 'MEMORY_SIZE', 2)
+    cache = ResponseCache.ResponseCache('lru', ttl=100, negative_ttl=10)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert list(cache._memory) == ['"a"', '"c"']
+    # the evicted entry is still on disk, and is read back into memory
+    assert cache.get('b') == (True, 2)
+    assert list(cache._memory) == ['"c"', '"b"']
+
+def test_disk_tier_is_shared_and_keeps_expiry(clock, disk):
+    ResponseCache.ResponseCache('shared', ttl=100, negative_ttl=10).put(('17', 7577121), [('G', 'A')])
+    # a new process, or another function on the same volume, starts with an empty memory tier
+    cache = ResponseCache.ResponseCache('shared', ttl=100, negative_ttl=10)
+    assert cache.get(('17', 7577121)) == (True, [['G', 'A']])
+    clock[0] += 101
+    assert cache.get(('17', 7577121)) == (False, None)
+
+def test_disk_tier_evicts_expired_then_oldest_entries(clock, tmp_path, monkeypatch):
+    monkeypatch.setattr(ResponseCache, 'EVICT_EVERY', 1)
+    disk = ResponseCache.DiskTier(str(tmp_path / 'small.sqlite'), 2000)
+    disk.put('source', 'expired', 'x' * 100, clock[0] + 1)
+    clock[0] += 2
+    for i in range(50):
+        clock[0] += 1
+        disk.put('source', f'key{i}', 'x' * 100, clock[0] + 1000)
+    rows = disk._db.execute("SELECT key, LENGTH(key) + LENGTH(value) FROM responses").fetchall()
+    assert sum(size for _, size in rows) <= 2000
+    keys = {key for key, _ in rows}
+    assert 'expired' not in keys and 'key49' in keys and 'key0' not in keys
+
+def test_memory_only_without_a_disk_tier(clock, monkeypatch):
+    monkeypatch.setattr(ResponseCache, 'get_disk', lambda: None)
+    cache = ResponseCache.ResponseCache('memory', ttl=100, negative_ttl=10)
+    cache.put('a', 1)
+    assert cache.get('a') == (True, 1)
+    assert cache.get('b') == (False, None)
+
+def test_clear_empties_both_tiers(clock, disk):
+    cache = ResponseCache.ResponseCache('clear', ttl=100, negative_ttl=10)
+    cache.put('a', 1)
+    ResponseCache.clear()
+    assert cache.get('a') == (False, None)
+
+def test_wal_only_in_tmp(tmp_path):
+    disk = ResponseCache.DiskTier(str(tmp_path / 'wal.sqlite'), 1024)
+    expected = 'wal' if str(tmp_path).startswith('/tmp/') else 'delete'
+    assert disk._db.execute("PRAGMA journal_mode").fetchone()[0] == expected
@@ -0,0 +1,94 @@
+import pytest
+
+import VariantNormalizer
+from VariantNormalizer import (chromosome_name, format_hgvsg, normalize_variant, open_reference,
+                               parse_hgvsg)
+
+#           1         2         3
+#  1234567890123456789012345678901234
+#  TTGACCAGCAGCAGTCAAAAGTGCATGCATGCAT
+# a CAG repeat at 6-14 and an A run at 17-20
+SEQUENCE = "TTGACCAGCAGCAGTCAAAAGT" + "GCAT" * 12
+
+@pytest.fixture
+def reference(tmp_path):
+    """
+    chromosome 1 as a FASTA file of 10 bases per line with its .fai index
+    """
+    path = tmp_path / 'reference.fa'
+    lines = [SEQUENCE[i:i + 10] for i in range(0, len(SEQUENCE), 10)]
+    path.write_text(">1\n" + "\n".join(lines) + "\n")
+    (tmp_path / 'reference.fa.fai').write_text(f"1\t{len(SEQUENCE)}\t3\t10\t11\n")
+    return open_reference(str(path))
+
+def test_reference_reads_across_lines(reference):
+    assert reference.sequence('1', 0, len(SEQUENCE)) == SEQUENCE
+    assert reference.sequence('chr1', 8, 13) == SEQUENCE[8:13]
+
+@pytest.mark.parametrize('variant, normalized', [
+    # a deletion in the A run moves to its left end
+    (('1', 19, 'AA', 'A'), ('1', 16, 'CA', 'C')),
+    # a CAG duplication becomes an insertion before the repeat
+    (('1', 14, 'G', 'GCAG'), ('1', 5, 'C', 'CCAG')),
+    (('1', 11, 'GCAG', 'G'), ('1', 5, 'CCAG', 'C')),
+    # shared bases are trimmed down to a substitution
+    (('chr1', 3, 'GAC', 'GTC'), ('1', 4, 'A', 'T')),
+    (('1', 3, 'GA', 'TT'), ('1', 3, 'GA', 'TT')),
+])
+def test_normalize_left_aligns(reference, variant, normalized):
+    assert normalize_variant(*variant, reference) == normalized
+
+@pytest.mark.parametrize('notation, variant, formatted', [
+    ('NC_000001.10:g.18del', ('1', 16, 'CA', 'C'), '1:g.20del'),
+    ('NC_000001.10:g.6_8del', ('1', 5, 'CCAG', 'C'), '1:g.12_14del'),
+    ('NC_000001.10:g.6_8dup', ('1', 5, 'C', 'CCAG'), '1:g.12_14dup'),
+    ('NC_000001.10:g.17dupA', ('1', 16, 'C', 'CA'), '1:g.20dup'),
+    # inserting the preceding bases is written as a dup
+    ('NC_000001.10:g.18_19insA', ('1', 16, 'C', 'CA'), '1:g.20dup'),
+    ('NC_000001.10:g.15_16insGG', ('1', 15, 'T', 'TGG'), '1:g.15_16insGG'),
+    ('NC_000001.10:g.3_4delinsTT', ('1', 3, 'GA', 'TT'), '1:g.3_4delinsTT'),
+    ('NC_000001.10:g.4A>T', ('1', 4, 'A', 'T'), '1:g.4A>T'),
+])
+def test_hgvsg_round_trip(reference, notation, variant, formatted):
+    assert normalize_variant(*parse_hgvsg(notation, reference), reference) == variant
+    # the 3' shifted notation parses back to the same variant
+    assert format_hgvsg(*variant, reference) == formatted
+    assert normalize_variant(*parse_hgvsg(formatted, reference), reference) == variant
+
+def test_del_checks_the_deleted_bases(reference):
+    assert parse_hgvsg('1:g.17_18delAA', reference) == ('1', 16, 'CAA', 'C')
+    with pytest.raises(ValueError):
+        parse_hgvsg('1:g.17_18delGG', reference)
+
+def test_indels_need_a_reference():
+    with pytest.raises(ValueError):
+        parse_hgvsg('NC_000001.10:g.18del')
+    # without a reference only trimming is done
+    assert normalize_variant('1', 19, 'AA', 'A') == ('1', 19, 'AA', 'A')
+
+@pytest.mark.parametrize('accession, chrom', [
+    ('NC_000001.10', '1'),
+    ('NC_000017.10', '17'),
+    ('nc_000023.10', 'X'),
+    ('NC_000024.9', 'Y'),
+    ('NC_012920.1', 'MT'),
+    ('chrM', 'MT'),
+    ('chr7', '7'),
+])
+def test_chromosome_name(accession, chrom):
+    assert chromosome_name(accession) == chrom
+
+@pytest.mark.parametrize('accession', ['NC_000017.11', 'NC_000001.11', 'NC_000024', 'NC_999999.1'])
+def test_chromosome_name_rejects_other_assemblies(accession):
+    with pytest.raises(ValueError):
+        chromosome_name(accession)
+
+def test_use_reference_replaces_an_opened_reference(reference, tmp_path, monkeypatch):
+    monkeypatch.setattr(VariantNormalizer, 'REFERENCE_GENOME', str(tmp_path / 'missing.2bit'))
+    VariantNormalizer.get_reference.reset()
+    try:
+        assert VariantNormalizer.get_reference() is None
+        VariantNormalizer.use_reference(str(tmp_path / 'reference.fa'))
+        assert VariantNormalizer.canonical_variant('1', 19, 'AA', 'A') == ('1', 16, 'CA', 'C')
+    finally:
+        VariantNormalizer.get_reference.reset()
@@ -0,0 +1,98 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('urllib3')
+import ResponseCache
+import VepAnnotation
+
+@pytest.fixture
+def vep(monkeypatch):
+    """
+    records the requests sent to VEP and answers them from vep.responses, a list of
+    (status, body) or a function of (method, url, body)
+    """
+    vep = SimpleNamespace(calls=[], responses=None)
+    def request(method, url, body=None, headers=None):
+        vep.calls.append((method, url, json.loads(body) if body else None))
+        status, data = vep.responses(method, url, body) if callable(vep.responses) else vep.responses.pop(0)
+        return SimpleNamespace(status=status, data=json.dumps(data).encode('utf-8'))
+    monkeypatch.setattr(VepAnnotation.http, 'request', request)
+    monkeypatch.setattr(ResponseCache, 'get_disk', lambda: None)
+    VepAnnotation.vep_cache._memory.clear()
+    return vep
+
+def annotation(notation):
+    return {'input': notation, 'transcript_consequences': [{'hgvsc': f'{notation}:c.1A>G'}]}
+
+def test_batch_falls_back_to_single_lookups_on_400(vep):
+    notations = ['17:g.100A>G', '17:g.200C>T']
+    vep.responses = [(400, {'error': 'unparseable notation'}),
+                     (200, [annotation('17:g.100A>G')]),
+                     (400, {'error': 'unparseable notation'})]
+    results = VepAnnotation.get_transcript_consequences_batch(notations)
+    assert results['17:g.100A>G'] == annotation('17:g.100A>G')['transcript_consequences']
+    assert results['17:g.200C>T'] is None
+    assert [method for method, _, _ in vep.calls] == ['POST', 'GET', 'GET']
+
+@pytest.mark.parametrize('status', [429, 503, 504])
+def test_batch_is_not_retried_per_notation_when_vep_fails(vep, status):
+    notations = [f'17:g.{i}A>G' for i in range(1, 51)]
+    vep.responses = lambda method, url, body: (status, {'error': 'unavailable'})
+    assert set(VepAnnotation.get_transcript_consequences_batch(notations).values()) == {None}
+    assert len(vep.calls) == 1
+    # failures are not cached
+    VepAnnotation.get_transcript_consequences_batch(notations)
+    assert len(vep.calls) == 2
+
+def test_notation_is_sent_as_given_and_cached_by_its_normal_form(vep):
+    vep.responses = [(200, [annotation('NC_000017.10:g.7577121G>A')])]
+    consequences = VepAnnotation.get_transcript_consequences('NC_000017.10:g.7577121G>A')
+    assert '/NC_000017.10:g.7577121G>A?' in vep.calls[0][1]
+    # another spelling of the same variant is served from the cache
+    assert VepAnnotation.get_transcript_consequences('17:g.7577121g>a') is consequences
+    assert len(vep.calls) == 1
+
+def test_batch_sends_one_notation_per_variant_as_given(vep):
+    vep.responses = [(200, [annotation('NC_000017.10:g.100A>G'), annotation('17:g.200C>T')])]
+    results = VepAnnotation.get_transcript_consequences_batch(
+        ['NC_000017.10:g.100A>G', '17:g.100A>G', '17:g.200C>T'])
+    assert vep.calls[0][2] == {'hgvs_notations': ['NC_000017.10:g.100A>G', '17:g.200C>T']}
+    assert results['17:g.100A>G'] is results['NC_000017.10:g.100A>G'] is not None
+    assert results['17:g.200C>T'] == annotation('17:g.200C>T')['transcript_consequences']
+
+class CountingEvent(threading.Event):
+    def __init__(self):
+        super().__init__()
+        self.waiting = 0
+
+    def wait(self, timeout=None):
+        self.waiting += 1
+        return super().wait(timeout)
+
+def test_concurrent_callers_share_a_failed_request(vep):
+    release = threading.Event()
+    def respond(method, url, body):
+        release.wait(5)
+        return 503, {'error': 'unavailable'}
+    vep.responses = respond
+    results = []
+    call = lambda: results.append(VepAnnotation.get_transcript_consequences('17:g.300G>A'))
+    leader = threading.Thread(target=call)
+    leader.start()
+    while not vep.calls:
+        time.sleep(0.001)
+    done = VepAnnotation._inflight[('17:g.300G>A', VepAnnotation.SUPERSET_FLAGS)]['done'] = CountingEvent()
+    waiters = [threading.Thread(target=call) for _ in range(5)]
+    for thread in waiters:
+        thread.start()
+    while done.waiting < len(waiters):
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader] + waiters:
+        thread.join(5)
+    assert results == [None] * 6
+    assert len(vep.calls) == 1
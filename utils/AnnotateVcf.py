@@ -0,0 +1,375 @@
+"""
+AnnotateVcf.py
+This script annotates every variant of a VCF with the lambda functions' sources, without going through
+the API. Records are streamed from a plain, gzipped or bgzipped VCF and multi-allelic records are split
+into one variant per ALT allele, normalized with VariantNormalizer (set REFERENCE_GENOME or --reference
+to left-align indels). Chunks of variants go to each source's batch mode in batches of its batch size,
+with at most its concurrency limit of batches in flight per source, so every source's rate limit and
+request size is respected while all sources run at the same time.
+Results are written in input order as JSON lines or TSV, identifying each variant by its record number
+and its VCF coordinates, as <record>:<chrom>-<pos>-<ref>-<alt>. After every chunk the output is flushed
+and a checkpoint (<output>.checkpoint) records how many records and output bytes are complete; a later
+run with the same input and options resumes from it, dropping any partly written chunk.
+Usage:
+    python AnnotateVcf.py -i <vcf> -o <output> [--format jsonl|tsv] [--sources vep,gnomad,...]
+                          [--concurrency gnomad=4 ...] [--batch-size vep=200 ...] [--restart]
+
+Arguments:
+    -i             Input VCF, optionally (b)gzipped (required)
+    -o             Output file (required)
+    --format       jsonl, with every source's full result, or tsv, with summary columns (default: jsonl)
+    --sources      Comma-separated sources (default: vep,oncokb,gene,gnomad,prism,clinvar)
+    --chunk-size   Variants per checkpointed chunk (default: 500)
+    --in-flight    Chunks annotated at the same time (default: 2)
+    --concurrency  Batches in flight for a source, e.g. gnomad=4 (repeatable)
+    --batch-size   Variants per batch for a source, e.g. vep=200 (repeatable)
+    --reference    GRCh37 2bit or indexed FASTA used to normalize indels (default: $REFERENCE_GENOME)
+    --restart      Ignore an existing checkpoint and start over
+
+The vep results use the compact format of QueryVep: scores and classifications are aligned to
+QueryVep.get_tool_table().compact. The oncokb source needs the OncoKB API key in $API_KEY.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_functions'))
+import Metrics
+import QueryGeneInformation
+import QueryGnomAD
+import QueryOncoKb
+import QueryPrism
+import QueryVcfFromAthena
+import QueryVep
+import VariantNormalizer
+from VepAnnotation import get_transcript_consequences_batch
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-i', required=True, help="Input VCF, optionally (b)gzipped")
+parser.add_argument('-o', required=True, help="Output file")
+parser.add_argument('--format', choices=['jsonl', 'tsv'], default='jsonl', help="jsonl or tsv (default: jsonl)")
+parser.add_argument('--sources', default='vep,oncokb,gene,gnomad,prism,clinvar', help="Comma-separated sources")
+parser.add_argument('--chunk-size', type=int, default=500, help="Variants per checkpointed chunk")
+parser.add_argument('--in-flight', type=int, default=2, help="Chunks annotated at the same time")
+parser.add_argument('--concurrency', action='append', default=[], help="Batches in flight for a source, e.g. gnomad=4")
+parser.add_argument('--batch-size', action='append', default=[], help="Variants per batch for a source, e.g. vep=200")
+parser.add_argument('--reference', help="GRCh37 2bit or indexed FASTA used to normalize indels")
+parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint")
+
+def call(handler, body=None, params=None):
+    """
+    invoke a lambda_handler directly. returns the decoded response body and
+    raises RuntimeError if the handler did not answer with a 200.
+    """
+    response = handler({'body': json.dumps(body) if body is not None else None,
+                        'queryStringParameters': params}, None)
+    data = json.loads(response['body'])
+    if str(response['statusCode']) != '200':
+        raise RuntimeError(data.get('error') if isinstance(data, dict) else data)
+    return data
+
+def coordinates(variant):
+    return {'chromosome': variant['chromosome'], 'position': variant['position'],
+            'reference': variant['reference'], 'variant': variant['alternate']}
+
+def coordinate_key(variant):
+    return "-".join(str(x) for x in coordinates(variant).values())
+
+def annotate_vep(variants):
+    notations = [x['hgvsg'] for x in variants]
+    results = call(QueryVep.lambda_handler, {'hgvsg': notations, 'format': 'compact'})['results']
+    return {x['id']: results[x['hgvsg']] for x in variants}
+
+def annotate_oncokb(variants):
+    results = call(QueryOncoKb.lambda_handler, {'hgvsg': [x['hgvsg'] for x in variants]})
+    return {x['id']: results[x['hgvsg']] for x in variants}
+
+def annotate_gene(variants):
+    genes = {x['id']: QueryGeneInformation.get_gene_symbol(x['hgvsg']) for x in variants}
+    summaries = QueryGeneInformation.get_summaries(list({x['entrez'] for x in genes.values() if x and x['entrez']}))
+    results = {}
+    for variant_id, gene in genes.items():
+        if not gene:
+            results[variant_id] = {'gene': None, 'gene_id': None, 'summary': 'Gene Symbol not found'}
+        else:
+            summary = summaries.get(gene['entrez'], {'summary': 'Gene Id not found'})
+            results[variant_id] = {'gene': gene['symbol'], 'gene_id': gene['entrez'], 'summary': summary['summary']}
+    return results
+
+def annotate_gnomad(variants):
+    results = call(QueryGnomAD.lambda_handler, {'variants': [coordinates(x) for x in variants]})
+    return {x['id']: results[coordinate_key(x)][QueryGnomAD.DEFAULT_DATASET] for x in variants}
+
+def annotate_prism(variants):
+    # the beacon has no batch query
+    return {x['id']: call(QueryPrism.lambda_handler, params=coordinates(x))['results'] for x in variants}
+
+def annotate_clinvar(variants):
+    results = call(QueryVcfFromAthena.lambda_handler, {'variants': [coordinates(x) for x in variants]})
+    return {x['id']: results[coordinate_key(x)] for x in variants}
+
+# source -> (annotate function, variants per batch, batches in flight, whether it reads VEP annotations).
+# sources that read VEP annotations take a g. notation, so they skip variants without one
+SOURCES = {
+    'vep': (annotate_vep, 200, 2, True),
+    'oncokb': (annotate_oncokb, 100, 2, True),
+    'gene': (annotate_gene, 200, 2, True),
+    'gnomad': (annotate_gnomad, 100, 4, False),
+    'prism': (annotate_prism, 20, 4, False),
+    'clinvar': (annotate_clinvar, 250, 2, False),
+}
+
+def first(value, *path):
+    """
+    follows a path of keys and indices into a result, '' if any step is missing
+    """
+    try:
+        for step in path:
+            value = value[step]
+    except (KeyError, IndexError, TypeError):
+        return ''
+    return '' if value is None else value
+
+def max_percent_pathogenic(consequences):
+    percents = [x['percent_pathogenic'] for x in consequences] if isinstance(consequences, list) else []
+    return max(percents) if percents else ''
+
+# TSV columns of each source: (column, function of the source's result)
+TSV_COLUMNS = {
+    'vep': [('vep_transcripts', lambda x: len(x) if isinstance(x, list) else ''),
+            ('vep_max_percent_pathogenic', max_percent_pathogenic)],
+    'oncokb': [('oncokb_oncogenicity', lambda x: first(x, 0, 'oncogenecity')),
+               ('oncokb_sensitivity', lambda x: first(x, 0, 'sensitivity'))],
+    'gene': [('gene', lambda x: first(x, 'gene')),
+             ('gene_id', lambda x: first(x, 'gene_id'))],
+    'gnomad': [('gnomad_exome_af', lambda x: first(x, 'summary', 'exome', 'exome_af')),
+               ('gnomad_genome_af', lambda x: first(x, 'summary', 'genome', 'genome_af'))],
+    'prism': [('prism_exists', lambda x: first(x, 'exists'))],
+    'clinvar': [('clinvar_significance', lambda x: first(x, 'significance')),
+                ('clinvar_accession', lambda x: first(x, 'accession'))],
+}
+
+def open_vcf(infile):
+    with open(infile, 'rb') as handle:
+        magic = handle.read(2)
+    if magic == b'\x1f\x8b':
+        # bgzip files are concatenated gzip members, which gzip reads in one stream
+        return gzip.open(infile, 'rt')
+    return open(infile)
+
+def read_variants(infile, skip):
+    """
+    yields (record number, variants) for every record after the first skip records.
+    symbolic, missing and spanning-deletion alleles are left out.
+    """
+    with open_vcf(infile) as vcf:
+        record = 0
+        for line in vcf:
+            if line.startswith('#'):
+                continue
+            record += 1
+            if record <= skip:
+                continue
+            data = line.rstrip('\n').split('\t', 8)
+            chrom, position, _, reference, alternates = data[:5]
+            variants = []
+            for alternate in alternates.split(','):
+                if not alternate or alternate[0] in '<.*' or '[' in alternate or ']' in alternate:
+                    continue
+                normalized = VariantNormalizer.canonical_variant(chrom, position, reference, alternate)
+                try:
+                    hgvsg = VariantNormalizer.format_hgvsg(*normalized, VariantNormalizer.get_reference())
+                except ValueError:
+                    hgvsg = None
+                # the record number keeps the ids of repeated records apart, as results are keyed by id
+                variants.append({'id': f"{record}:{chrom}-{position}-{reference}-{alternate}",
+                                 'chromosome': normalized[0], 'position': normalized[1],
+                                 'reference': normalized[2], 'alternate': normalized[3],
+                                 'hgvsg': hgvsg})
+            yield record, variants
+
+def read_chunks(infile, skip, chunk_size):
+    """
+    yields (records read so far, variants) chunks of at least chunk_size variants. chunks end
+    on record boundaries, so a checkpoint never splits the alleles of a record.
+    """
+    chunk = []
+    record = done = skip
+    for record, variants in read_variants(infile, skip):
+        chunk += variants
+        if len(chunk) >= chunk_size:
+            yield record, chunk
+            chunk, done = [], record
+    # the last chunk may hold only records without annotatable alleles
+    if record > done:
+        yield record, chunk
+
+def source_settings(values, option, defaults):
+    """
+    applies source=number overrides, e.g. from --concurrency, to the per-source defaults
+    """
+    settings = dict(defaults)
+    for value in values:
+        source, _, number = value.partition('=')
+        if source not in SOURCES or not number.isdigit() or int(number) < 1:
+            parser.error(f"{option} expects source=number with a source from {', '.join(SOURCES)}")
+        settings[source] = int(number)
+    return settings
+
+class Annotator:
+    """
+    runs the batches of every source on one executor per source, sized to its concurrency limit
+    """
+    def __init__(self, sources, batch_sizes, concurrency):
+        self.sources = sources
+        self.batch_sizes = batch_sizes
+        self.executors = {source: ThreadPoolExecutor(concurrency[source]) for source in sources}
+        # one batched VEP lookup per chunk fills the cache read by every source that needs VEP
+        self.prefetch = (ThreadPoolExecutor(1) if any(SOURCES[x][3] for x in sources) else None)
+
+    def submit(self, variants):
+        """
+        starts annotating a chunk. returns a list of (source, batch, future).
+        """
+        annotated = [x for x in variants if x['hgvsg']]
+        prefetched = (self.prefetch.submit(get_transcript_consequences_batch, [x['hgvsg'] for x in annotated])
+                      if self.prefetch and annotated else None)
+        tasks = []
+        for source in self.sources:
+            annotate, _, _, needs_vep = SOURCES[source]
+            size = self.batch_sizes[source]
+            selected = annotated if needs_vep else variants
+            for i in range(0, len(selected), size):
+                batch = selected[i:i + size]
+                tasks.append((source, batch, self.executors[source].submit(
+                    self.run, annotate, batch, prefetched if needs_vep else None)))
+        return tasks
+
+    @staticmethod
+    def run(annotate, batch, prefetched):
+        if prefetched is not None:
+            prefetched.exception()
+        return annotate(batch)
+
+    @staticmethod
+    def collect(variants, tasks):
+        """
+        waits for a chunk. a failed batch is reported as an error on each of its variants.
+        """
+        results = {x['id']: {} for x in variants}
+        for source, batch, future in tasks:
+            try:
+                annotations = future.result()
+            except Exception as e:
+                annotations = {x['id']: {'error': f"{type(e).__name__}: {e}"} for x in batch}
+            for variant in batch:
+                results[variant['id']][source] = annotations.get(variant['id'])
+        return results
+
+    def shutdown(self):
+        for executor in self.executors.values():
+            executor.shutdown()
+        if self.prefetch:
+            self.prefetch.shutdown()
+
+def format_lines(variants, results, output_format, sources):
+    lines = []
+    for variant in variants:
+        annotations = results[variant['id']]
+        if output_format == 'jsonl':
+            lines.append(json.dumps({**variant, **annotations}))
+        else:
+            values = [variant['id'], variant['hgvsg'] or '']
+            for source in sources:
+                values += [str(column(annotations.get(source))) for _, column in TSV_COLUMNS[source]]
+            lines.append("\t".join(x.replace('\t', ' ').replace('\n', ' ') for x in values))
+    return "".join(x + "\n" for x in lines).encode('utf-8')
+
+def tsv_header(sources):
+    return "\t".join(['variant', 'hgvsg'] + [name for source in sources for name, _ in TSV_COLUMNS[source]]) + "\n"
+
+def read_checkpoint(path, settings):
+    """
+    returns (records, output bytes) to resume from, (0, 0) without a checkpoint
+    """
+    if not os.path.exists(path):
+        return 0, 0
+    with open(path) as infile:
+        checkpoint = json.load(infile)
+    if checkpoint['settings'] != settings:
+        parser.error(f"{path} was written for another input or other options; use --restart to start over")
+    return checkpoint['records'], checkpoint['output_bytes']
+
+def write_checkpoint(path, settings, records, output_bytes):
+    # written next to the checkpoint and renamed, so a crash never leaves half a checkpoint
+    with open(path + '.tmp', 'w') as outfile:
+        json.dump({'settings': settings, 'records': records, 'output_bytes': output_bytes}, outfile)
+    os.replace(path + '.tmp', path)
+
+def main(args):
+    sources = [x for x in args.sources.split(',') if x]
+    unknown = [x for x in sources if x not in SOURCES]
+    if unknown:
+        parser.error(f"unknown sources {', '.join(unknown)}; choose from {', '.join(SOURCES)}")
+    if 'oncokb' in sources and not os.environ.get('API_KEY'):
+        parser.error("the oncokb source needs the OncoKB API key in $API_KEY")
+    if args.reference:
+        if not os.path.exists(args.reference):
+            parser.error(f"reference genome {args.reference} not found")
+        # the handlers may already have opened $REFERENCE_GENOME, e.g. with EAGER_INIT=1
+        VariantNormalizer.use_reference(args.reference)
+    # the lambda functions' metric lines would be mixed into the progress output
+    Metrics.ENABLED = False
+
+    checkpoint = args.o + '.checkpoint'
+    settings = {'input': os.path.abspath(args.i), 'input_size': os.path.getsize(args.i),
+                'format': args.format, 'sources': sources}
+    if args.restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    skip, output_bytes = read_checkpoint(checkpoint, settings)
+    if skip:
+        print(f"Resuming after record {skip}", file=sys.stderr)
+    with open(args.o, 'ab') as outfile:
+        # drop whatever was written after the last checkpoint
+        outfile.truncate(output_bytes)
+    annotator = Annotator(sources,
+                          source_settings(args.batch_size, '--batch-size', {x: y[1] for x, y in SOURCES.items()}),
+                          source_settings(args.concurrency, '--concurrency', {x: y[2] for x, y in SOURCES.items()}))
+    started = time.monotonic()
+    annotated = 0
+    pending = deque()
+    try:
+        with open(args.o, 'ab') as outfile:
+            if output_bytes == 0 and args.format == 'tsv':
+                outfile.write(tsv_header(sources).encode('utf-8'))
+
+            def finish(records, variants, tasks):
+                nonlocal annotated
+                outfile.write(format_lines(variants, annotator.collect(variants, tasks), args.format, sources))
+                outfile.flush()
+                os.fsync(outfile.fileno())
+                write_checkpoint(checkpoint, settings, records, outfile.tell())
+                annotated += len(variants)
+                print(f"{records} records, {annotated} variants annotated "
+                      f"({annotated / (time.monotonic() - started):.1f} variants/s)", file=sys.stderr)
+
+            for records, variants in read_chunks(args.i, skip, args.chunk_size):
+                pending.append((records, variants, annotator.submit(variants)))
+                if len(pending) >= args.in_flight:
+                    finish(*pending.popleft())
+            while pending:
+                finish(*pending.popleft())
+    finally:
+        annotator.shutdown()
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    print(f"Wrote {annotated} variants to {args.o}", file=sys.stderr)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,67 @@
+"""
+BuildClinvarStore.py
+This script converts the TSV written by ParseClinvarVcf.py or ParseClinvarXml.py into the
+memory-mapped store read by lambda_functions/ClinvarStore.py.
+Usage:
+    python BuildClinvarStore.py -i <input_file> -o <output_file>
+
+Arguments:
+    -i  Input ClinVar TSV (required)
+    -o  Output store file (required)
+    --block-size  Number of records per index block (default: 64)
+"""
+import argparse
+import os
+import sys
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_functions'))
+from ClinvarStore import BLOCK_SIZE, STORE_KIND, chromosome_order, encode_key, normalize_chromosome, read_tsv_rows
+from MappedStore import write_store
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-i', required=True, help="Input ClinVar TSV")
+parser.add_argument('-o', required=True, help="Output store file")
+parser.add_argument('--block-size', type=int, default=BLOCK_SIZE, help="Records per index block")
+
+def read_records(infile):
+    """
+    Reads the ClinVar TSV, skipping the header and records without coordinates.
+    Returns:
+        list: (chrom, position, reference, alternate, line) tuples.
+    """
+    records = []
+    for fields in read_tsv_rows(infile):
+        fields[0] = normalize_chromosome(fields[0])
+        records.append((fields[0], int(fields[1]), fields[2], fields[3], '\t'.join(fields)))
+    return records
+
+def build_store(records, outfile, block_size=BLOCK_SIZE):
+    chromosomes = sorted({x[0] for x in records}, key=chromosome_order)
+    codes = {c: i for i, c in enumerate(chromosomes)}
+    records.sort(key=lambda x: (codes[x[0]], x[1], x[2], x[3]))
+
+    block_keys = array('Q')
+    block_offsets = array('Q')
+    data = bytearray()
+    for i, (chrom, position, _, _, line) in enumerate(records):
+        if not i % block_size:
+            block_keys.append(encode_key(codes[chrom], position))
+            block_offsets.append(len(data))
+        data += line.encode('utf-8') + b'\n'
+    block_offsets.append(len(data))
+
+    write_store(outfile, STORE_KIND,
+                {'chromosomes': chromosomes, 'records': len(records), 'block_size': block_size},
+                [('block_keys', 'Q', block_keys),
+                 ('block_offsets', 'Q', block_offsets),
+                 ('data', 'B', data)])
+
+def main(args):
+    records = read_records(args.i)
+    build_store(records, args.o, args.block_size)
+    print(f"Wrote {len(records)} records to {args.o}")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
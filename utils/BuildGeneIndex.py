@@ -0,0 +1,129 @@
+"""
+BuildGeneIndex.py
+This script converts a GRCh37 RefSeq or Ensembl GTF into the gene interval store read by
+lambda_functions/GeneIntervalStore.py. A gene spans every feature that carries its gene_id, so GTFs
+without gene lines work too. Entrez IDs come from the GeneID db_xref of RefSeq GTFs; for Ensembl GTFs
+they are looked up by symbol in an NCBI gene_info file when one is given.
+Usage:
+    python BuildGeneIndex.py -i <gtf> -o <output_file> [--gene-info <gene_info.gz>] [--tax-id 9606]
+
+Arguments:
+    -i           Input GTF, optionally gzipped (required)
+    -o           Output store file (required)
+    --gene-info  NCBI gene_info file used to map symbols to Entrez IDs
+    --tax-id     Taxonomy ID of the genes to keep from gene_info (default: 9606)
+"""
+import argparse
+import gzip
+import os
+import re
+import sys
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_functions'))
+from ClinvarStore import chromosome_order, encode_key
+from GeneIntervalStore import STORE_KIND
+from MappedStore import write_store
+from VariantNormalizer import chromosome_name
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-i', required=True, help="Input GTF")
+parser.add_argument('-o', required=True, help="Output store file")
+parser.add_argument('--gene-info', help="NCBI gene_info file to map symbols to Entrez IDs")
+parser.add_argument('--tax-id', default='9606', help="Taxonomy ID to keep from gene_info")
+
+ATTRIBUTE = re.compile(r'\s*([^\s;]+)\s+"([^"]*)"')
+
+def open_text(infile):
+    with open(infile, 'rb') as handle:
+        magic = handle.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(infile, 'rt', encoding='utf-8')
+    return open(infile, encoding='utf-8')
+
+def parse_attributes(attributes):
+    fields = {}
+    for key, value in ATTRIBUTE.findall(attributes):
+        # db_xref is repeated, keep the GeneID one
+        if key == 'db_xref' and not value.startswith('GeneID:'):
+            continue
+        fields.setdefault(key, value)
+    return fields
+
+def read_genes(infile):
+    """
+    Reads the extent, symbol and Entrez ID of every gene in a GTF.
+    Returns:
+        dict: (chrom, gene_id) -> [start, end, symbol, entrez].
+    """
+    genes = {}
+    with open_text(infile) as gtf:
+        for line in gtf:
+            if line.startswith('#'):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 9:
+                continue
+            attributes = parse_attributes(fields[8])
+            gene_id = attributes.get('gene_id')
+            if not gene_id:
+                continue
+            chrom, start, end = chromosome_name(fields[0]), int(fields[3]), int(fields[4])
+            gene = genes.get((chrom, gene_id))
+            if gene is None:
+                symbol = attributes.get('gene_name') or attributes.get('gene') or gene_id
+                entrez = attributes.get('db_xref', '').replace('GeneID:', '') or (gene_id if gene_id.isdigit() else '')
+                genes[(chrom, gene_id)] = [start, end, symbol, entrez]
+            else:
+                gene[0], gene[1] = min(gene[0], start), max(gene[1], end)
+    return genes
+
+def read_entrez_ids(infile, tax_id):
+    """
+    Reads symbol -> GeneID for the genes of one species from an NCBI gene_info file.
+    """
+    entrez = {}
+    with open_text(infile) as gene_info:
+        for line in gene_info:
+            if line.startswith('#'):
+                continue
+            fields = line.split('\t', 3)
+            if fields[0] == tax_id:
+                entrez.setdefault(fields[2].strip(), fields[1])
+    return entrez
+
+def build_store(genes, outfile):
+    chromosomes = sorted({chrom for chrom, _ in genes}, key=chromosome_order)
+    codes = {c: i for i, c in enumerate(chromosomes)}
+    records = sorted((encode_key(codes[chrom], start), encode_key(codes[chrom], end), symbol, entrez)
+                     for (chrom, _), (start, end, symbol, entrez) in genes.items())
+    starts, ends, max_ends, name_offsets = array('Q'), array('Q'), array('Q'), array('Q')
+    names = bytearray()
+    for start, end, symbol, entrez in records:
+        starts.append(start)
+        ends.append(end)
+        max_ends.append(max(end, max_ends[-1] if max_ends else 0))
+        name_offsets.append(len(names))
+        names += f"{symbol}\t{entrez}".encode('utf-8')
+    name_offsets.append(len(names))
+    write_store(outfile, STORE_KIND,
+                {'chromosomes': chromosomes, 'genes': len(records)},
+                [('starts', 'Q', starts),
+                 ('ends', 'Q', ends),
+                 ('max_ends', 'Q', max_ends),
+                 ('name_offsets', 'Q', name_offsets),
+                 ('names', 'B', names)])
+
+def main(args):
+    genes = read_genes(args.i)
+    if args.gene_info:
+        entrez = read_entrez_ids(args.gene_info, args.tax_id)
+        for gene in genes.values():
+            gene[3] = gene[3] or entrez.get(gene[2], '')
+    build_store(genes, args.o)
+    print(f"Wrote {len(genes)} genes to {args.o}, "
+          f"{sum(1 for x in genes.values() if x[3])} with an Entrez ID")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
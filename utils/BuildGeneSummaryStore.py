@@ -0,0 +1,101 @@
+"""
+BuildGeneSummaryStore.py
+This script bulk-loads NCBI Gene summaries into the memory-mapped store read by
+lambda_functions/GeneSummaryStore.py, so QueryGeneInformation only calls E-utilities on a miss.
+Summaries come from a tab-separated dump of GeneID and summary, from batched esummary requests for
+the genes of an NCBI gene_info file, or both: genes missing from the dump are then fetched.
+Usage:
+    python BuildGeneSummaryStore.py -o <output_file> [--summaries <tsv>] [--gene-info <gene_info.gz>] [--tax-id 9606]
+
+Arguments:
+    -o           Output store file (required)
+    --summaries  Tab-separated GeneID and summary, optionally gzipped, with or without a header
+    --gene-info  NCBI gene_info file, optionally gzipped; summaries of its genes are fetched with esummary
+    --tax-id     Taxonomy ID of the genes to keep from gene_info (default: 9606)
+    --api-key    NCBI API key for the esummary requests (default: $NCBI_API_KEY)
+"""
+import argparse
+import gzip
+import os
+import sys
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_functions'))
+from GeneSummaryStore import STORE_KIND, entrez_id
+from MappedStore import write_store
+from QueryGeneInformation import ESUMMARY_BATCH, fetch_summaries
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-o', required=True, help="Output store file")
+parser.add_argument('--summaries', help="Tab-separated GeneID and summary")
+parser.add_argument('--gene-info', help="NCBI gene_info file")
+parser.add_argument('--tax-id', default='9606', help="Taxonomy ID to keep from gene_info")
+parser.add_argument('--api-key', default=os.environ.get('NCBI_API_KEY'), help="NCBI API key")
+
+def open_text(infile):
+    with open(infile, 'rb') as handle:
+        magic = handle.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(infile, 'rt', encoding='utf-8')
+    return open(infile, encoding='utf-8')
+
+def read_summaries(infile):
+    """
+    Reads GeneID and summary columns. Lines whose first column is not a gene ID (headers) are skipped.
+    Returns:
+        dict: Entrez Gene ID -> summary.
+    """
+    summaries = {}
+    with open_text(infile) as tsv:
+        for line in tsv:
+            gene_id, _, summary = line.rstrip('\n').partition('\t')
+            key = entrez_id(gene_id)
+            if key is not None:
+                summaries[key] = summary.strip()
+    return summaries
+
+def read_gene_ids(infile, tax_id):
+    """
+    Reads the GeneID column of the genes of one species from an NCBI gene_info file.
+    """
+    gene_ids = []
+    with open_text(infile) as gene_info:
+        for line in gene_info:
+            if line.startswith('#'):
+                continue
+            fields = line.split('\t', 2)
+            if fields[0] == tax_id:
+                gene_ids.append(int(fields[1]))
+    return gene_ids
+
+def build_store(summaries, outfile, metadata):
+    ids = array('Q', sorted(summaries))
+    offsets = array('Q')
+    data = bytearray()
+    for gene_id in ids:
+        offsets.append(len(data))
+        data += summaries[gene_id].encode('utf-8')
+    offsets.append(len(data))
+    write_store(outfile, STORE_KIND, {**metadata, 'genes': len(ids)},
+                [('ids', 'Q', ids),
+                 ('offsets', 'Q', offsets),
+                 ('data', 'B', data)])
+
+def main(args):
+    if not args.summaries and not args.gene_info:
+        parser.error("at least one of --summaries and --gene-info is required")
+    summaries = read_summaries(args.summaries) if args.summaries else {}
+    missing = []
+    if args.gene_info:
+        missing = [x for x in read_gene_ids(args.gene_info, args.tax_id) if x not in summaries]
+        print(f"Fetching {len(missing)} summaries in {-(-len(missing) // ESUMMARY_BATCH)} esummary requests")
+        summaries.update((gene_id, summary) for gene_id, summary in fetch_summaries(missing, args.api_key).items()
+                         if summary is not None)
+    unresolved = len([x for x in missing if x not in summaries])
+    build_store(summaries, args.o, {'sources': [x for x in (args.summaries, args.gene_info) if x]})
+    print(f"Wrote {len(summaries)} genes to {args.o}"
+          + (f", {unresolved} genes could not be fetched" if unresolved else ""))
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,232 @@
+"""
+BuildGnomadStore.py
+This script converts a gnomAD sites VCF into the memory-mapped store read by lambda_functions/GnomadStore.py.
+Build one store for the exomes and one for the genomes of a release. Only one chromosome is held in memory:
+each is written to temporary column files next to the output as soon as the VCF moves on to the next one,
+so the VCF must keep every chromosome's records together, as sorted sites VCFs do.
+Usage:
+    python BuildGnomadStore.py -i <sites_vcf> -o <output_file> --data-type exome|genome [--dataset gnomad_r2_1]
+
+Arguments:
+    -i           Input gnomAD sites VCF, optionally bgzipped (required)
+    -o           Output store file (required)
+    --data-type  exome or genome (required)
+    --dataset    gnomAD dataset the VCF belongs to (default: gnomad_r2_1)
+    --pass-only  Skip sites that do not pass the gnomAD filters
+"""
+import argparse
+import gzip
+import math
+import os
+import shutil
+import sys
+import tempfile
+from array import array
+from contextlib import ExitStack
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_functions'))
+from ClinvarStore import encode_key, normalize_chromosome
+from GnomadStore import MISSING_POPULATION, STORE_KIND
+from MappedStore import write_store
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-i', required=True, help="Input gnomAD sites VCF")
+parser.add_argument('-o', required=True, help="Output store file")
+parser.add_argument('--data-type', required=True, choices=['exome', 'genome'], help="exome or genome")
+parser.add_argument('--dataset', default='gnomad_r2_1', help="gnomAD dataset of the VCF")
+parser.add_argument('--pass-only', action='store_true', help="Skip sites that do not pass filters")
+
+POPULATIONS = ['afr', 'amr', 'asj', 'eas', 'fin', 'nfe', 'oth', 'sas']
+# populations of the filtering allele frequency popmax; like gnomAD, it leaves out the bottlenecked
+# asj and fin populations and the unassigned oth
+POPMAX_POPULATIONS = ['afr', 'amr', 'eas', 'nfe', 'sas']
+CHROMOSOMES = [str(x) for x in range(1, 23)] + ['X', 'Y', 'MT']
+# fixed-width columns, in store order after the alleles
+COLUMNS = [('keys', 'Q'), ('ac', 'I'), ('an', 'I'), ('af', 'd'), ('ac_hom', 'I'), ('ac_hemi', 'I'),
+           ('population_ac', 'I'), ('population_an', 'I'), ('faf99_popmax', 'd'), ('faf99_popmax_population', 'b')]
+
+def open_vcf(infile):
+    with open(infile, 'rb') as handle:
+        magic = handle.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(infile, 'rt')
+    return open(infile)
+
+def parse_info(info):
+    fields = {}
+    for item in info.split(';'):
+        key, _, value = item.partition('=')
+        fields[key] = value
+    return fields
+
+def allele_value(fields, key, allele, cast, default):
+    """
+    returns the value of a per-allele INFO field for one ALT allele
+    """
+    value = fields.get(key)
+    if not value:
+        return default
+    values = value.split(',')
+    value = values[allele] if allele < len(values) else values[0]
+    try:
+        return cast(value)
+    except ValueError:
+        return default
+
+class Columns:
+    """
+    Accumulates the store columns of one chromosome while the VCF is read.
+    """
+    def __init__(self, populations, hemizygous):
+        self.populations = populations
+        self.popmax_populations = [i for i, x in enumerate(populations) if x in POPMAX_POPULATIONS]
+        # chromosome codes where male allele counts are hemizygous
+        self.hemizygous = hemizygous
+        for name, typecode in COLUMNS:
+            setattr(self, name, array(typecode))
+        self.alleles = bytearray()
+        self.allele_lengths = array('I')
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, reference, alternate, fields, allele):
+        self.keys.append(key)
+        encoded = f"{reference}\t{alternate}".encode('utf-8')
+        self.alleles += encoded
+        self.allele_lengths.append(len(encoded))
+        ac = allele_value(fields, 'AC', allele, int, 0)
+        an = allele_value(fields, 'AN', allele, int, 0)
+        self.ac.append(ac)
+        self.an.append(an)
+        self.af.append(allele_value(fields, 'AF', allele, float, ac / an if an else 0.0))
+        self.ac_hom.append(allele_value(fields, 'nhomalt', allele, int, 0))
+        self.ac_hemi.append(allele_value(fields, 'AC_male', allele, int, 0)
+                            if key >> 32 in self.hemizygous else 0)
+        for population in self.populations:
+            self.population_ac.append(allele_value(fields, f'AC_{population}', allele, int, 0))
+            self.population_an.append(allele_value(fields, f'AN_{population}', allele, int, 0))
+        popmax, popmax_population = math.nan, MISSING_POPULATION
+        for i in self.popmax_populations:
+            faf = allele_value(fields, f'faf99_{self.populations[i]}', allele, float, math.nan)
+            if faf == faf and (popmax_population == MISSING_POPULATION or faf > popmax):
+                popmax, popmax_population = faf, i
+        self.faf99_popmax.append(popmax)
+        self.faf99_popmax_population.append(popmax_population)
+
+    def sort(self):
+        """
+        reorders every column by key; sites VCFs are sorted within each chromosome already
+        """
+        if all(self.keys[i] <= self.keys[i + 1] for i in range(len(self.keys) - 1)):
+            return
+        offsets = [0]
+        for length in self.allele_lengths:
+            offsets.append(offsets[-1] + length)
+        allele = lambda i: self.alleles[offsets[i]:offsets[i + 1]]
+        order = sorted(range(len(self.keys)), key=lambda i: (self.keys[i], allele(i)))
+        width = len(self.populations)
+        for name, typecode in COLUMNS + [('allele_lengths', 'I')]:
+            column = getattr(self, name)
+            if name.startswith('population_'):
+                column = array(typecode, (column[i * width + j] for i in order for j in range(width)))
+            else:
+                column = array(typecode, (column[i] for i in order))
+            setattr(self, name, column)
+        self.alleles = bytearray(b''.join(allele(i) for i in order))
+
+    def write(self, prefix):
+        """
+        writes every column to a <prefix>.<column> file
+        """
+        for name, _ in COLUMNS + [('allele_lengths', 'I')]:
+            with open(f'{prefix}.{name}', 'wb') as outfile:
+                getattr(self, name).tofile(outfile)
+        with open(f'{prefix}.alleles', 'wb') as outfile:
+            outfile.write(self.alleles)
+
+def concatenate(tmp, codes, name):
+    """
+    joins the <code>.<name> files of the chromosomes in code order into one file, deleting the parts
+    """
+    path = os.path.join(tmp, name)
+    with open(path, 'wb') as outfile:
+        for code in codes:
+            part = os.path.join(tmp, f'{code}.{name}')
+            with open(part, 'rb') as infile:
+                shutil.copyfileobj(infile, outfile, 1024 * 1024)
+            os.remove(part)
+    return path
+
+def write_allele_offsets(tmp, codes):
+    path = os.path.join(tmp, 'allele_offsets')
+    offset = 0
+    with open(path, 'wb') as outfile:
+        for code in codes:
+            lengths = array('I')
+            with open(os.path.join(tmp, f'{code}.allele_lengths'), 'rb') as infile:
+                lengths.frombytes(infile.read())
+            offsets = array('Q')
+            for length in lengths:
+                offsets.append(offset)
+                offset += length
+            offsets.tofile(outfile)
+        array('Q', [offset]).tofile(outfile)
+    return path
+
+def main(args):
+    codes = {c: i for i, c in enumerate(CHROMOSOMES)}
+    hemizygous = {codes['X'], codes['Y']}
+    # one chromosome is held in memory at a time and written to temporary column files, which are
+    # joined in chromosome order once the VCF has been read
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(args.o))) as tmp:
+        written, seen, records = [], set(), 0
+        columns, current = Columns(POPULATIONS, hemizygous), None
+
+        def flush():
+            nonlocal columns, records
+            if len(columns):
+                columns.sort()
+                columns.write(os.path.join(tmp, str(codes[current])))
+                written.append(codes[current])
+                records += len(columns)
+            columns = Columns(POPULATIONS, hemizygous)
+
+        with open_vcf(args.i) as vcf:
+            for line in vcf:
+                if line.startswith('#'):
+                    continue
+                data = line.rstrip('\n').split('\t')
+                chrom = normalize_chromosome(data[0])
+                if chrom != current:
+                    flush()
+                    if chrom in seen:
+                        raise ValueError(f"{args.i} is not grouped by chromosome: {data[0]} appears again "
+                                         f"after other chromosomes")
+                    seen.add(chrom)
+                    codes.setdefault(chrom, len(codes))
+                    current = chrom
+                if args.pass_only and data[6] not in ('PASS', '.'):
+                    continue
+                fields = parse_info(data[7])
+                key = encode_key(codes[chrom], int(data[1]))
+                for allele, alternate in enumerate(data[4].split(',')):
+                    columns.add(key, data[3].upper(), alternate.upper(), fields, allele)
+        flush()
+
+        written.sort()
+        sections = [('keys', 'Q', concatenate(tmp, written, 'keys')),
+                    ('allele_offsets', 'Q', write_allele_offsets(tmp, written)),
+                    ('alleles', 'B', concatenate(tmp, written, 'alleles'))]
+        sections += [(name, typecode, concatenate(tmp, written, name)) for name, typecode in COLUMNS[1:]]
+        with ExitStack() as stack:
+            write_store(args.o, STORE_KIND,
+                        {'dataset': args.dataset, 'data_type': args.data_type, 'populations': POPULATIONS,
+                         'chromosomes': sorted(codes, key=codes.get), 'records': records},
+                        [(name, typecode, stack.enter_context(open(path, 'rb')))
+                         for name, typecode, path in sections])
+    print(f"Wrote {records} variants to {args.o}")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
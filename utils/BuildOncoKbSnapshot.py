@@ -0,0 +1,44 @@
+"""
+BuildOncoKbSnapshot.py
+This script builds the binary snapshot of the OncoKB cancer gene list that is packaged
+with the QueryOncoKb deployment, so that cold starts do not need to download the list from S3.
+Usage:
+    python BuildOncoKbSnapshot.py -o <output_file> [-i <input_file> --etag <etag>]
+
+Arguments:
+    -i      Local copy of cancerGeneList_Athena.tsv. Downloaded from S3 if omitted.
+    --etag  S3 ETag of the local copy, used by the lambda to revalidate the snapshot.
+    -o      Output snapshot file (required)
+"""
+import argparse
+import os
+import pickle
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_functions'))
+from QueryOncoKb import ONCOKB_BUCKET, ONCOKB_GENE_LIST, parse_gene_list
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-i', help="Local OncoKB cancer gene list")
+parser.add_argument('--etag', help="S3 ETag of the local gene list")
+parser.add_argument('-o', required=True, help="Output snapshot file")
+
+def main(args):
+    if args.i:
+        with open(args.i, 'rb') as infile:
+            data = infile.read()
+        etag = args.etag
+    else:
+        import boto3
+        obj = boto3.client('s3').get_object(Bucket=ONCOKB_BUCKET, Key=ONCOKB_GENE_LIST)
+        data = obj['Body'].read()
+        etag = obj['ETag']
+    genes, refseq = parse_gene_list(data)
+    with open(args.o, 'wb') as outfile:
+        pickle.dump({'etag': etag, 'genes': genes, 'refseq': refseq}, outfile,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    print(f"Wrote {len(genes)} genes to {args.o}")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
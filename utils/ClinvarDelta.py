@@ -0,0 +1,191 @@
+"""
+ClinvarDelta.py
+This script compares a new ClinVar release against the previous build and applies the differences
+to the existing outputs, so that a monthly refresh only rewrites what changed.
+Records are keyed by VariationID plus coordinates. Conditions are compared as a set, since their
+order in the TSV is not stable between runs.
+Usage:
+    python ClinvarDelta.py diff -p <previous_tsv> -n <new_tsv> -o <delta_directory>
+    python ClinvarDelta.py apply -d <delta_directory> [--tsv <tsv>] [--parquet <directory>]
+
+Arguments:
+    diff
+        -p  TSV of the previous build (required)
+        -n  TSV of the new release (required)
+        -o  Output directory for added.tsv, removed.tsv, changed.tsv and manifest.json (required)
+    apply
+        -d          Delta directory written by diff (required)
+        --tsv       TSV to update. Rebuild the local store from it with BuildClinvarStore.py.
+        --parquet   Partitioned dataset written by ClinvarParquet.py. Only the partitions
+                    holding changed records are rewritten.
+
+Functions:
+    read_tsv_rows(infile)
+        generator: lists of the eight TSV columns, skipping the header. Imported from ClinvarStore.
+    record_key(row)
+        tuple: VariationID, chromosome, position, reference and alternate.
+    diff_releases(previous, current, outdir)
+        dict: The manifest of the delta.
+    apply_tsv(delta, infile)
+        Rewrites a TSV with the delta applied.
+    apply_parquet(delta, outdir)
+        Rewrites the partitions touched by the delta.
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_functions'))
+from ClinvarStore import COLUMNS, normalize_chromosome, position_bin, read_tsv_rows
+
+parser = argparse.ArgumentParser()
+subparsers = parser.add_subparsers(dest='command', required=True)
+diff_parser = subparsers.add_parser('diff', help="Compare two releases")
+diff_parser.add_argument('-p', required=True, help="TSV of the previous build")
+diff_parser.add_argument('-n', required=True, help="TSV of the new release")
+diff_parser.add_argument('-o', required=True, help="Output delta directory")
+apply_parser = subparsers.add_parser('apply', help="Apply a delta")
+apply_parser.add_argument('-d', required=True, help="Delta directory")
+apply_parser.add_argument('--tsv', help="TSV to update")
+apply_parser.add_argument('--parquet', help="Partitioned Parquet dataset to update")
+
+DELTA_FILES = ('added', 'removed', 'changed')
+
+def record_key(row):
+    return (row[4], normalize_chromosome(row[0]), row[1], row[2], row[3])
+
+def record_digest(row):
+    assertions, review_status, disease = row[5:8]
+    value = '\t'.join([assertions, review_status, ','.join(sorted(disease.split(',')))])
+    return hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest()
+
+def write_row(outfile, row):
+    outfile.write('\t'.join(row) + '\n')
+
+def diff_releases(previous, current, outdir):
+    """
+    Writes the records added, removed and changed between two releases.
+    Args:
+        previous (str): TSV of the previous build.
+        current (str): TSV of the new release.
+        outdir (str): Output directory.
+    Returns:
+        dict: The manifest, also written to manifest.json.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    # only a key -> digest map of the previous build is held in memory
+    remaining = {record_key(row): record_digest(row) for row in read_tsv_rows(previous)}
+    counts = dict.fromkeys(DELTA_FILES + ('unchanged',), 0)
+    partitions = set()
+    handles = {name: open(os.path.join(outdir, f'{name}.tsv'), 'w') for name in DELTA_FILES}
+    try:
+        for row in read_tsv_rows(current):
+            key = record_key(row)
+            digest = remaining.pop(key, None)
+            if digest == record_digest(row):
+                counts['unchanged'] += 1
+                continue
+            name = 'added' if digest is None else 'changed'
+            write_row(handles[name], row)
+            counts[name] += 1
+            partitions.add((key[1], position_bin(key[2])))
+        if remaining:
+            for row in read_tsv_rows(previous):
+                if record_key(row) in remaining:
+                    write_row(handles['removed'], row)
+                    counts['removed'] += 1
+                    partitions.add((normalize_chromosome(row[0]), position_bin(row[1])))
+    finally:
+        for handle in handles.values():
+            handle.close()
+    manifest = {'previous': os.path.abspath(previous),
+                'current': os.path.abspath(current),
+                'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'counts': counts,
+                'partitions': sorted(partitions)}
+    with open(os.path.join(outdir, 'manifest.json'), 'w') as outfile:
+        json.dump(manifest, outfile, indent=2)
+    return manifest
+
+def load_delta(deltadir):
+    """
+    Reads a delta directory.
+    Returns:
+        tuple: The manifest, the set of keys to drop, and the rows to insert.
+    """
+    with open(os.path.join(deltadir, 'manifest.json')) as infile:
+        manifest = json.load(infile)
+    drop = set()
+    insert = []
+    for name in DELTA_FILES:
+        for row in read_tsv_rows(os.path.join(deltadir, f'{name}.tsv')):
+            if name != 'added':
+                drop.add(record_key(row))
+            if name != 'removed':
+                insert.append(row)
+    return manifest, drop, insert
+
+def apply_tsv(delta, infile):
+    """
+    Applies a delta to a TSV, keeping its header. Inserted records are appended,
+    BuildClinvarStore.py sorts them when the store is rebuilt.
+    """
+    manifest, drop, insert = delta
+    temporary = infile + '.tmp'
+    with open(infile) as tsv, open(temporary, 'w') as outfile:
+        for line in tsv:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) >= 8 and fields[1].isdigit() and record_key(fields) in drop:
+                continue
+            outfile.write(line)
+        for row in insert:
+            write_row(outfile, row)
+    os.replace(temporary, infile)
+
+def apply_parquet(delta, outdir):
+    """
+    Applies a delta to a partitioned Parquet dataset by rewriting only the
+    chrom/pos_bin partitions listed in the manifest.
+    """
+    import pyarrow.parquet as pq
+    from ClinvarParquet import SCHEMA, write_partitioned
+
+    manifest, drop, insert = delta
+    data_columns = [name for name in COLUMNS if name != 'chrom']
+    for chrom, pos_bin in manifest['partitions']:
+        partition = os.path.join(outdir, f'chrom={chrom}', f'pos_bin={pos_bin}')
+        rows = []
+        if os.path.isdir(partition):
+            table = pq.read_table(partition, schema=SCHEMA.remove(SCHEMA.get_field_index('pos_bin'))
+                                                             .remove(SCHEMA.get_field_index('chrom')))
+            for record in table.to_pylist():
+                row = [chrom] + [record[name] for name in data_columns]
+                if record_key(row) not in drop:
+                    rows.append(row)
+        rows += [row for row in insert
+                 if normalize_chromosome(row[0]) == chrom and position_bin(row[1]) == pos_bin]
+        # write_partitioned replaces the files of every partition it writes
+        if rows:
+            write_partitioned(rows, outdir)
+        elif os.path.isdir(partition):
+            for name in os.listdir(partition):
+                os.remove(os.path.join(partition, name))
+            os.rmdir(partition)
+
+def main(args):
+    if args.command == 'diff':
+        manifest = diff_releases(args.p, args.n, args.o)
+        print(json.dumps(manifest['counts']))
+    else:
+        delta = load_delta(args.d)
+        if args.tsv:
+            apply_tsv(delta, args.tsv)
+        if args.parquet:
+            apply_parquet(delta, args.parquet)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
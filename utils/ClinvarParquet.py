@@ -0,0 +1,140 @@
+"""
+ClinvarParquet.py
+This script converts the TSV written by ParseClinvarVcf.py or ParseClinvarXml.py into Parquet,
+partitioned by chromosome and bucketed by position bin, so that Athena only scans the partition
+holding a variant. Disease, assertion and review status strings are dictionary encoded. Rows are
+buffered per partition and written as a row group of ROW_GROUP_SIZE rows whenever a partition has
+that many, so memory is bounded by the number of partitions rather than the size of the release.
+Usage:
+    python ClinvarParquet.py -i <input_file> -o <output_directory> [--location <s3_location>]
+
+Arguments:
+    -i          Input ClinVar TSV (required)
+    -o          Output directory, written as chrom=<chrom>/pos_bin=<bin>/ partitions (required)
+    --location  S3 location of the uploaded output. Prints the Athena table definition.
+
+Functions:
+    read_tsv_rows(infile)
+        generator: lists of the eight TSV columns, skipping the header. Imported from ClinvarStore.
+    write_partitioned(rows, outdir)
+        Writes the rows as a partitioned Parquet dataset, replacing the files of every partition it writes.
+    create_table_statement(location)
+        str: Athena DDL for the dataset, using partition projection.
+"""
+import argparse
+import os
+import sys
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_functions'))
+from ClinvarStore import COLUMNS, POSITION_BIN_SIZE, normalize_chromosome, position_bin, read_tsv_rows
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-i', required=True, help="Input ClinVar TSV")
+parser.add_argument('-o', required=True, help="Output directory")
+parser.add_argument('--location', help="S3 location of the dataset, prints the Athena table definition")
+
+DICTIONARY_COLUMNS = ['assertions', 'review_status', 'disease']
+# the existing table stores every column as a string; chrom and pos_bin become partitions
+SCHEMA = pa.schema([(name, pa.dictionary(pa.int32(), pa.string()) if name in DICTIONARY_COLUMNS else pa.string())
+                    for name in COLUMNS if name != 'chrom'] +
+                   [('chrom', pa.string()), ('pos_bin', pa.int32())])
+# columns stored in the files; chrom and pos_bin are in the partition paths
+FILE_SCHEMA = pa.schema([field for field in SCHEMA if field.name not in ('chrom', 'pos_bin')])
+# rows buffered per partition before they are written as a row group
+ROW_GROUP_SIZE = 50000
+
+class PartitionWriter:
+    """
+    Buffers the rows of one chrom/pos_bin partition and writes them as row groups of one Parquet
+    file. The files already in the partition are deleted when the first row group is written.
+    """
+    def __init__(self, outdir, chrom, pos_bin):
+        self.path = os.path.join(outdir, f'chrom={chrom}', f'pos_bin={pos_bin}')
+        self.columns = {name: [] for name in FILE_SCHEMA.names}
+        self.rows = 0
+        self.writer = None
+
+    def append(self, record):
+        for name, values in self.columns.items():
+            values.append(record[name])
+        self.rows += 1
+        if self.rows >= ROW_GROUP_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.writer is None:
+            os.makedirs(self.path, exist_ok=True)
+            for name in os.listdir(self.path):
+                os.remove(os.path.join(self.path, name))
+            self.writer = pq.ParquetWriter(os.path.join(self.path, 'part-0.parquet'), FILE_SCHEMA,
+                                           use_dictionary=DICTIONARY_COLUMNS, compression='snappy')
+        arrays = [pa.array(values).dictionary_encode() if name in DICTIONARY_COLUMNS
+                  else pa.array(values, type=FILE_SCHEMA.field(name).type) for name, values in self.columns.items()]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=FILE_SCHEMA))
+        self.columns = {name: [] for name in FILE_SCHEMA.names}
+        self.rows = 0
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+
+def write_partitioned(rows, outdir):
+    """
+    Writes records as Parquet partitioned by chromosome and position bin.
+    Args:
+        rows (iterable): Lists of the eight TSV columns.
+        outdir (str): The output directory.
+    Returns:
+        int: The number of records written.
+    """
+    partitions = {}
+    records = 0
+    try:
+        for row in rows:
+            record = dict(zip(COLUMNS, row))
+            key = (normalize_chromosome(record['chrom']), position_bin(record['position']))
+            partition = partitions.get(key)
+            if partition is None:
+                partition = partitions[key] = PartitionWriter(outdir, *key)
+            partition.append(record)
+            records += 1
+    finally:
+        for partition in partitions.values():
+            partition.close()
+    return records
+
+def create_table_statement(location, database='clinvar_vcf', table='current'):
+    """
+    Athena table definition for the partitioned dataset. Partition projection
+    lets Athena resolve partitions from the query predicates without a crawler.
+    """
+    columns = ",\n  ".join(f"`{name}` string" for name in COLUMNS if name != 'chrom')
+    return (f"CREATE EXTERNAL TABLE `{database}`.`{table}` (\n  {columns}\n)\n"
+            f"PARTITIONED BY (`chrom` string, `pos_bin` int)\n"
+            f"STORED AS PARQUET\n"
+            f"LOCATION '{location}'\n"
+            f"TBLPROPERTIES (\n"
+            f"  'projection.enabled'='true',\n"
+            f"  'projection.chrom.type'='enum',\n"
+            f"  'projection.chrom.values'='{','.join([str(x) for x in range(1, 23)] + ['X', 'Y', 'MT'])}',\n"
+            f"  'projection.pos_bin.type'='integer',\n"
+            f"  'projection.pos_bin.range'='0,{250000000 // POSITION_BIN_SIZE}',\n"
+            f"  'storage.location.template'='{location.rstrip('/')}/chrom=${{chrom}}/pos_bin=${{pos_bin}}'\n"
+            f")")
+
+def main(args):
+    records = write_partitioned(read_tsv_rows(args.i), args.o)
+    print(f"Wrote {records} records to {args.o}")
+    if args.location:
+        print(create_table_statement(args.location))
+        print("After creating the table, set CLINVAR_POSITION_BINS=1 on QueryVcfFromAthena to prune partitions")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
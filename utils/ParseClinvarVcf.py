@@ -1,29 +1,173 @@
+"""
+ParseClinvarVcf.py
+This script converts a ClinVar VCF release into the TSV read by BuildClinvarStore.py and Athena, or into
+partitioned Parquet. Plain, gzipped and bgzipped releases are streamed: decompression runs on its own
+thread, which hands whole lines to the parser in large decoded blocks, so inflating the next block
+overlaps parsing the current one. The CLNSIG, CLNREVSTAT and CLNDN keys are located in the INFO field
+with string searches instead of splitting it into entries, and output is written in large blocks.
+A record with several ALT alleles gives one row per allele.
+Usage:
+    python ParseClinvarVcf.py -i <vcf> -o <output> [--format tsv|parquet]
+
+Arguments:
+    -i        Input ClinVar VCF, optionally (b)gzipped (required)
+    -o        Output file, or output directory for parquet (required)
+    --format  tsv, or parquet partitioned by chromosome and position bin (default: tsv)
+"""
 import argparse
+import queue
+import threading
+import zlib
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-i', required=True, help="Input Clinvar VCF file")
-parser.add_argument('-o', required=True, help="Output file")
+parser.add_argument('-o', required=True, help="Output file, or output directory for parquet")
+parser.add_argument('--format', choices=['tsv', 'parquet'], default='tsv',
+                    help="tsv, or parquet partitioned by chromosome and position bin (default: tsv)")
+
+HEADER = ('chrom\tposition\treference\talternate\t'
+          'variation_id\tassertions\treview_status\tdisease\n')
+# compressed bytes per read, decompressed bytes per block handed to the parser, and blocks read ahead of it
+READ_SIZE = 1024 * 1024
+BLOCK_SIZE = 4 * 1024 * 1024
+READ_AHEAD = 4
+# records per output write
+WRITE_BATCH = 20000
+# INFO keys of the assertions, review status and conditions columns
+INFO_KEYS = ('CLNSIG', 'CLNREVSTAT', 'CLNDN')
+
+def is_gzip(infile):
+    with open(infile, 'rb') as handle:
+        return handle.read(2) == b'\x1f\x8b'
+
+def decompress(infile, blocks, stop):
+    """
+    Puts blocks of whole decoded lines on the queue, then None, or the exception that ended the read.
+    """
+    try:
+        # zlib directly rather than gzip.open, whose small reads keep the thread holding the GIL
+        with open(infile, 'rb') as vcf:
+            inflate = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            pending, rest = [], b''
+            size = 0
+            in_member = False
+            while not stop.is_set():
+                compressed = vcf.read(READ_SIZE)
+                if not compressed:
+                    break
+                while compressed:
+                    in_member = True
+                    data = inflate.decompress(compressed)
+                    pending.append(data)
+                    size += len(data)
+                    # bgzip files are concatenated gzip members; start a new stream after each one
+                    compressed = inflate.unused_data if inflate.eof else b''
+                    if inflate.eof:
+                        inflate = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                        in_member = False
+                if size >= BLOCK_SIZE:
+                    data = rest + b''.join(pending)
+                    end = data.rfind(b'\n') + 1
+                    # cutting at a newline keeps multi-byte characters whole
+                    blocks.put(data[:end].decode('utf-8'))
+                    pending, rest, size = [], data[end:], 0
+            if in_member and not stop.is_set():
+                raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+            data = rest + b''.join(pending)
+            if data:
+                blocks.put(data.decode('utf-8'))
+        blocks.put(None)
+    except Exception as e:
+        blocks.put(e)
+
+def read_lines(infile):
+    """
+    Yields the lines of a plain or (b)gzipped file, without their line endings.
+    """
+    if not is_gzip(infile):
+        with open(infile, encoding='utf-8') as vcf:
+            for line in vcf:
+                yield line.rstrip('\r\n')
+        return
+    blocks = queue.Queue(READ_AHEAD)
+    stop = threading.Event()
+    thread = threading.Thread(target=decompress, args=(infile, blocks, stop), daemon=True)
+    thread.start()
+    try:
+        while True:
+            block = blocks.get()
+            if block is None:
+                return
+            if isinstance(block, Exception):
+                raise block
+            if '\r' in block:
+                block = block.replace('\r\n', '\n')
+            lines = block.split('\n')
+            # blocks end with a newline except for an unterminated last line
+            if not lines[-1]:
+                lines.pop()
+            yield from lines
+    finally:
+        stop.set()
+        # unblock the thread if it is waiting for room on the queue
+        while thread.is_alive():
+            try:
+                blocks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+def parse_info(info):
+    """
+    returns the assertions, review status and conditions of an INFO field, each comma-joined in
+    the order their keys appear. Keys are matched by prefix, so CLNSIG also collects CLNSIGCONF and
+    CLNSIGINCL and CLNDN collects CLNDNINCL, and a value ends at the next '='.
+    """
+    columns = []
+    for key in INFO_KEYS:
+        # find the key in place instead of splitting every INFO entry
+        values = []
+        start = info.find(key)
+        while start != -1:
+            if start == 0 or info[start - 1] == ';':
+                equals = info.find('=', start) + 1
+                end = info.find(';', equals)
+                value = info[equals:end] if end != -1 else info[equals:]
+                if '=' in value:
+                    value = value.split('=', 1)[0]
+                values.append(value)
+            start = info.find(key, start + 1)
+        columns.append(','.join(values))
+    return columns
+
+def parse_records(infile):
+    for line in read_lines(infile):
+        if not line or line[0] == '#':
+            continue
+        data = line.split('\t', 8)
+        chromosome, position, variant_id, reference, alternates = data[0:5]
+        assertions, review_status, conditions = parse_info(data[7])
+        for alternate in alternates.split(','):
+            yield [chromosome, position, reference, alternate, variant_id,
+                   assertions, review_status, conditions]
 
 def main(args):
-    with open(args.o, 'w') as outfile:
-        outfile.write(('chrom\tposition\treference\talternate\t'
-                        'variation_id\tassertions\treview_status\tdisease\n'))
-        try:
-            with open(args.i) as infile:
-                for line in infile:
-                    if not line.startswith('#'):
-                        data = line.strip().split('\t')
-                        chromosome, position, variant_id, reference, alternate = data[0:5]
-                        info = data[7].split(';')
-                        review_status = [x.split('=')[1] for x in info if x.startswith('CLNREVSTAT')]
-                        assertions = [x.split('=')[1] for x in info if x.startswith('CLNSIG')]
-                        conditions = [x.split('=')[1] for x in info if x.startswith('CLNDN')]
-                        outline = '\t'.join([chromosome, position, reference, alternate, variant_id, 
-                                            ','.join(assertions), ','.join(review_status), ','.join(conditions)])
-                        outfile.write(outline + '\n')
-        except IOError:
-            raise
+    if args.format == 'parquet':
+        from ClinvarParquet import write_partitioned
+        write_partitioned(parse_records(args.i), args.o)
+        return
+    with open(args.o, 'w', encoding='utf-8', buffering=BLOCK_SIZE) as outfile:
+        outfile.write(HEADER)
+        lines = []
+        for record in parse_records(args.i):
+            lines.append('\t'.join(record))
+            if len(lines) == WRITE_BATCH:
+                lines.append('')
+                outfile.write('\n'.join(lines))
+                lines = []
+        if lines:
+            lines.append('')
+            outfile.write('\n'.join(lines))
 
 if __name__ == "__main__":
     args = parser.parse_args()
-    main(args)
\ No newline at end of file
+    main(args)
@@ -1,160 +1,237 @@
 """
 ParseClinvarXml.py
 This script parses a Clinvar XML file and outputs the parsed content to a specified output file.
+The XML is streamed one VariationArchive at a time, so peak memory is bounded by the largest
+record rather than the size of the release.
 Usage:
-    python ParseClinvarXml.py -i <input_file> -o <output_file>
+    python ParseClinvarXml.py -i <input_file> -o <output_file> [--workers <n>] [--order input|coordinate]
 
 Arguments:
-    -i  Input Clinvar XML file (required)
+    -i  Input Clinvar XML file, optionally gzipped (required)
     -o  Output file (required)
+    --workers  Number of worker processes. The input is split into chunks at VariationArchive
+               boundaries by byte offset, which needs an uncompressed XML file (default: 1)
+    --order    Order of the merged output, input or coordinate (default: input)
+    --format   tsv, or parquet partitioned by chromosome and position bin, in which case
+               -o is the output directory (default: tsv)
 
 Functions:
-    create_soup(infile)
-    extract_variation_id(soup)
-        Placeholder function to extract variation IDs from the BeautifulSoup object.
-            soup (BeautifulSoup): A BeautifulSoup object representing the parsed XML.
-    split_records(soup)
-    extract_variation_id(record)
-    extract_coordinates(record)
-        tuple: The coordinates (chromosome, position, reference allele, alternate allele).
-    extract_review_status(record)
-        tuple: A tuple containing two lists - classification and review status.
-    extract_conditions(record)
-        set: A set of conditions.
+    open_xml(infile)
+        file: A binary file handle, decompressing gzipped input.
+    iter_records(infile)
+        generator: 'VariationArchive' elements, each freed once the caller moves on.
+    local_name(tag)
+        str: The tag name without its namespace.
+    element_text(element)
+        str: The text of an element and all of its descendants.
     process_record(record)
         dict: A dictionary containing the extracted information (variation_id, coordinates, review_status, conditions).
+    format_record(record)
+        str: A processed record as a line of the output file.
+    export_record(record, outfile)
+        Writes a processed record to the output file.
+    find_chunk_offsets(infile, chunks)
+        tuple: Document prefix, suffix and the (start, end) byte offsets of each chunk.
+    process_chunk(infile, worker, start, end, prefix, suffix, outfile, order)
+        tuple: Parses one chunk into a part file and returns the worker's record count and elapsed time.
+    merge_parts(parts, outfile, order)
+        Merges the part files in input or coordinate order.
     Main function that parses the input XML file and writes the extracted information to the output file.
         args (argparse.Namespace): Command-line arguments.
 
 """
 import argparse
-from bs4 import BeautifulSoup as bs
+import gzip
+import heapq
+import logging
+import os
+import shutil
+import sys
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_functions'))
+from ClinvarStore import chromosome_order
 
 
 parser = argparse.ArgumentParser()
-parser.add_argument('-i', 
-                    help="Input Clinvar XML file", 
+parser.add_argument('-i',
+                    help="Input Clinvar XML file",
                     required=True)
-parser.add_argument('-o', 
-                    help="Output file", 
+parser.add_argument('-o',
+                    help="Output file",
                     required=True)
+parser.add_argument('--workers',
+                    help="Number of worker processes (default: 1)",
+                    type=int,
+                    default=1)
+parser.add_argument('--order',
+                    help="Order of the merged output (default: input)",
+                    choices=['input', 'coordinate'],
+                    default='input')
+parser.add_argument('--format',
+                    help="tsv, or parquet partitioned by chromosome and position bin (default: tsv)",
+                    choices=['tsv', 'parquet'],
+                    default='tsv')
+
+ASSEMBLY = "GRCh37"
+READ_SIZE = 1 << 22
+RECORD_TAG = b'<VariationArchive'
+ROOT_END_TAG = b'</ClinVarVariationRelease'
+# seconds between progress reports of each worker
+PROGRESS_INTERVAL = 30
 
-def create_soup(infile):
+logger = logging.getLogger('ParseClinvarXml')
+
+def open_xml(infile):
     """
-    Parses an XML file and creates a BeautifulSoup object.
+    Opens an XML file for streaming.
 
     Args:
         infile (str): The path to the input XML file.
 
     Returns:
-        BeautifulSoup: A BeautifulSoup object representing the parsed XML.
+        file: A binary file handle.
 
     Raises:
         IOError: If the file cannot be opened.
     """
-    try:
-        with open(args.i, 'r') as infile:
-            contents = infile.read()
-    except IOError:
-        raise
-    else:
-        contents = contents.decode('utf-8')
-        soup = bs(contents, 'xml')
-    return soup
-def split_records(soup):
-    """
-    Extracts all 'VariationArchive' elements from a BeautifulSoup object.
-        Xml file uses VariationArchive to demarcate a record
+    with open(infile, 'rb') as handle:
+        magic = handle.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(infile, 'rb')
+    return open(infile, 'rb')
+
+def local_name(tag):
+    """
+    Removes the namespace from an element tag.
     Args:
-        soup (BeautifulSoup): A BeautifulSoup object containing XML data.
+        tag (str): An element tag.
     Returns:
-        list: A list of 'VariationArchive' elements found in the XML data.
+        str: The tag name.
     """
-    variation_id = soup.find_all('VariationArchive')
-    return variation_id
+    return tag.rpartition('}')[2]
 
-def extract_variation_id(record):
+def parse_blocks(blocks):
     """
-    Extracts the variation ID from a 'VariationArchive' element.
+    Streams 'VariationArchive' elements from blocks of XML bytes.
+        Each record is cleared from the tree once the caller requests the next one.
     Args:
-        record (Tag): A 'VariationArchive' element.
-    Returns:
-        str: The variation ID.
+        blocks (iterable): Consecutive byte strings of one XML document.
+    Yields:
+        Element: A 'VariationArchive' element.
     """
-    variation_id = record.get('VariationID')
-    return variation_id
-def extract_coordinates(record):
+    pull_parser = ET.XMLPullParser(events=('start', 'end'))
+    root = None
+    for block in blocks:
+        pull_parser.feed(block)
+        for event, element in pull_parser.read_events():
+            if root is None:
+                root = element
+            elif event == 'end' and local_name(element.tag) == 'VariationArchive':
+                yield element
+                element.clear()
+                root.clear()
+    pull_parser.close()
+
+def read_blocks(handle, start=0, end=None):
     """
-    Extracts the coordinates from a 'VariationArchive' element.
+    Reads a file in blocks of READ_SIZE bytes.
     Args:
-        record (Tag): A 'VariationArchive' element.
-    Returns:
-        tuple: The coordinates.
-        None if no coordinates are found.
-    """
-    ASSEMBLY = "GRCh37"
-    coordinates = record.find_all('SequenceLocation')
-    coordinates = [x for x in coordinates if x.get('Assembly') == ASSEMBLY and \
-                    x.get('positionVCF')]
-    if coordinates:
-        vcf_position = coordinates[0].get('positionVCF')
-        vcf_reference = coordinates[0].get('referenceAlleleVCF')
-        vcf_alternate = coordinates[0].get('alternateAlleleVCF')
-        vcf_chromosome = coordinates[0].get('Chr')
-        return (vcf_chromosome, vcf_position, vcf_reference, vcf_alternate)
-    return 
-def extract_review_status(record):
-    """
-    Extracts the review status from a 'VariationArchive' element.
-    Args:
-        record (Tag): A 'VariationArchive' element.
-    Returns:
-        list: The review status.
+        handle (file): A binary file handle.
+        start (int): Offset of the first byte.
+        end (int): Offset after the last byte, or None to read to the end of the file.
+    Yields:
+        bytes: The next block.
     """
-    classifications = record.find_all('Classifications')
-    review_status = [x.find_all('ReviewStatus') for x in classifications][0]
-    review_status = [x.text for x in review_status]
+    if start:
+        handle.seek(start)
+    remaining = None if end is None else end - start
+    while remaining is None or remaining > 0:
+        block = handle.read(READ_SIZE if remaining is None else min(READ_SIZE, remaining))
+        if not block:
+            return
+        if remaining is not None:
+            remaining -= len(block)
+        yield block
 
-    classification = [x.find_all('Description') for x in classifications][0]
-    classification = [x.text for x in classification]
+def iter_records(infile):
+    """
+    Streams 'VariationArchive' elements from a ClinVar XML file.
+        Xml file uses VariationArchive to demarcate a record.
+    Args:
+        infile (str): The path to the input XML file.
+    Yields:
+        Element: A 'VariationArchive' element.
+    """
+    with open_xml(infile) as handle:
+        yield from parse_blocks(read_blocks(handle))
 
-    return (classification, review_status)
-def extract_conditions(record):
+def element_text(element):
     """
-    Extracts the conditions from a 'VariationArchive' element.
+    Extracts the text of an element and its descendants.
     Args:
-        record (Tag): A 'VariationArchive' element.
+        element (Element): An XML element.
     Returns:
-        set: Conditions.
-    """
-    conditions = record.find_all('TraitSet')
-    conditions = [x.find_all('Trait') for x in conditions]
-    conditions = [x for sublist in conditions for x in sublist]
-    conditions = [x.find_all('Name') for x in conditions]
-    conditions = set([x.text.strip().upper() for sublist in conditions for x in sublist])
-    return conditions
+        str: The concatenated text.
+    """
+    return ''.join(element.itertext())
+
 def process_record(record):
     """
-    Processes a 'VariationArchive' element and extracts relevant information.
+    Processes a 'VariationArchive' element and extracts relevant information
+    in a single pass over the record.
+        coordinates: the first GRCh37 SequenceLocation with a VCF position.
+        review_status: Description and ReviewStatus values of the first Classifications element.
+        conditions: Names of every Trait within a TraitSet, without repeats, in document order.
     Args:
-        record (Tag): A 'VariationArchive' element.
+        record (Element): A 'VariationArchive' element.
     Returns:
         dict: A dictionary containing the extracted information.
     """
-    variation_id = extract_variation_id(record)
-    coordinates = extract_coordinates(record)
-    review_status = extract_review_status(record)
-    conditions = extract_conditions(record)
-    return {"variation_id": variation_id,
+    coordinates = None
+    classification = []
+    review_status = []
+    conditions = []
+    classifications_seen = False
+
+    def visit(element, in_classifications, traitset_depth, trait_depth):
+        nonlocal coordinates, classifications_seen
+        tag = local_name(element.tag)
+        if tag == 'SequenceLocation':
+            if coordinates is None and element.get('Assembly') == ASSEMBLY and element.get('positionVCF'):
+                coordinates = (element.get('Chr'), element.get('positionVCF'),
+                               element.get('referenceAlleleVCF'), element.get('alternateAlleleVCF'))
+        elif tag == 'Classifications' and not classifications_seen and not in_classifications:
+            classifications_seen = True
+            in_classifications = True
+        elif in_classifications and tag == 'ReviewStatus':
+            review_status.append(element_text(element))
+        elif in_classifications and tag == 'Description':
+            classification.append(element_text(element))
+        if tag == 'TraitSet':
+            traitset_depth += 1
+        elif tag == 'Trait' and traitset_depth:
+            trait_depth += 1
+        elif tag == 'Name' and trait_depth:
+            conditions.append(element_text(element).strip().upper())
+        for child in element:
+            visit(child, in_classifications, traitset_depth, trait_depth)
+
+    visit(record, False, 0, 0)
+    return {"variation_id": record.get('VariationID'),
             "coordinates": coordinates,
-            "review_status": review_status,
-            "conditions": list(conditions)}
-def export_record(record, outfile):
+            "review_status": (classification, review_status),
+            "conditions": list(dict.fromkeys(conditions))}
+def format_record(record):
     """
-    Exports a record to a file.
+    Formats a record as a line of the output file.
     Args:
         record (dict): A dictionary containing the record information.
-        outfile (str): The output file handle.
+    Returns:
+        str: The tab-separated line.
     """
     chrom, position, reference, alterate = record['coordinates']
     variation_id = record['variation_id']
@@ -163,19 +240,201 @@ def export_record(record, outfile):
     outline = (f"{chrom}\t{position}\t{reference}\t{alterate}\t{variation_id}\t"
                 f"{','.join(classification)}\t{','.join(review_status)}\t"
                 f"{','.join(conditions)}\n")
-    outfile.write(outline)
+    return outline
+def export_record(record, outfile):
+    """
+    Exports a record to a file.
+    Args:
+        record (dict): A dictionary containing the record information.
+        outfile (str): The output file handle.
+    """
+    outfile.write(format_record(record))
+
+class Progress:
+    """
+    Logs the number of records processed and the throughput of a worker
+    every PROGRESS_INTERVAL seconds.
+    """
+    def __init__(self, worker):
+        self.worker = worker
+        self.records = 0
+        self.started = time.monotonic()
+        self.reported = self.started
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def update(self):
+        self.records += 1
+        now = time.monotonic()
+        if now - self.reported >= PROGRESS_INTERVAL:
+            self.reported = now
+            self.log()
+
+    def log(self):
+        elapsed = self.elapsed
+        logger.info(f"worker {self.worker}: {self.records} records in {elapsed:.1f}s "
+                    f"({self.records / elapsed if elapsed else 0:.1f} records/s)")
+
+def find_record_offset(handle, offset, end):
+    """
+    Finds the first 'VariationArchive' start tag at or after an offset.
+    Args:
+        handle (file): A binary file handle.
+        offset (int): Offset to search from.
+        end (int): Offset at which the search stops.
+    Returns:
+        int: The offset of the start tag, or end if there is none.
+    """
+    overlap = len(RECORD_TAG) - 1
+    while offset < end:
+        handle.seek(offset)
+        block = handle.read(min(READ_SIZE, end - offset) + overlap)
+        found = block.find(RECORD_TAG)
+        if found != -1:
+            return offset + found
+        offset += READ_SIZE
+    return end
+
+def find_chunk_offsets(infile, chunks):
+    """
+    Splits an XML file into chunks that start at 'VariationArchive' boundaries.
+    Args:
+        infile (str): The path to an uncompressed XML file.
+        chunks (int): The number of chunks.
+    Returns:
+        tuple: The document prefix and suffix (the bytes before the first record
+        and after the last record), and a list of (start, end) byte offsets.
+    Raises:
+        ValueError: If the file does not end with the closing root tag.
+    """
+    size = os.path.getsize(infile)
+    with open(infile, 'rb') as handle:
+        handle.seek(max(size - READ_SIZE, 0))
+        tail = handle.read()
+        root_end = tail.rfind(ROOT_END_TAG)
+        if root_end == -1:
+            raise ValueError(f"{infile} does not end with {ROOT_END_TAG.decode()}>: the release is truncated "
+                             f"or has a different root element, and records would be dropped")
+        end = size - len(tail) + root_end
+        first = find_record_offset(handle, 0, end)
+        starts = [first] + [find_record_offset(handle, first + (end - first) * i // chunks, end)
+                            for i in range(1, chunks)]
+        handle.seek(0)
+        prefix = handle.read(first)
+        handle.seek(end)
+        suffix = handle.read()
+    starts = sorted(set(starts + [end]))
+    return prefix, suffix, list(zip(starts[:-1], starts[1:]))
+
+def coordinate_key(line):
+    chrom, position, _ = line.split('\t', 2)
+    return (chromosome_order(chrom), int(position))
+
+def process_chunk(infile, worker, start, end, prefix, suffix, outfile, order):
+    """
+    Parses the records between two byte offsets and writes them to a part file.
+    Args:
+        infile (str): The path to the input XML file.
+        worker (int): The worker number, used in progress reports.
+        start (int): Offset of the first record.
+        end (int): Offset after the last record.
+        prefix (bytes): Document prefix, declares the root element and its namespaces.
+        suffix (bytes): Document suffix, closes the root element.
+        outfile (str): The part file.
+        order (str): 'coordinate' to sort the part file.
+    Returns:
+        tuple: The worker number, number of records and elapsed seconds.
+    """
+    progress = Progress(worker)
+    lines = []
+    with open(infile, 'rb') as handle, open(outfile, 'w') as part:
+        # wrap the chunk in the original root element so that namespaces resolve
+        blocks = [[prefix], read_blocks(handle, start, end), [suffix]]
+        for var in parse_blocks(chain.from_iterable(blocks)):
+            record = process_record(var)
+            progress.update()
+            if not record['coordinates']:
+                continue
+            if order == 'coordinate':
+                lines.append(format_record(record))
+            else:
+                export_record(record, part)
+        if order == 'coordinate':
+            lines.sort(key=coordinate_key)
+            part.writelines(lines)
+    progress.log()
+    return worker, progress.records, progress.elapsed
+
+def merge_parts(parts, outfile, order):
+    """
+    Merges the part files of every worker into the output file.
+    Args:
+        parts (list): Part files in input order.
+        outfile (str): The output file.
+        order (str): 'input' to concatenate the parts, 'coordinate' to merge the sorted parts.
+    """
+    with open(outfile, 'w') as merged:
+        if order == 'coordinate':
+            handles = [open(part) for part in parts]
+            merged.writelines(heapq.merge(*handles, key=coordinate_key))
+            for handle in handles:
+                handle.close()
+        else:
+            for part in parts:
+                with open(part) as handle:
+                    shutil.copyfileobj(handle, merged)
+    for part in parts:
+        os.remove(part)
+
+def parallel_main(args):
+    with open(args.i, 'rb') as handle:
+        if handle.read(2) == b'\x1f\x8b':
+            raise ValueError("Parallel ingestion splits the input by byte offset and needs an uncompressed XML file")
+    prefix, suffix, chunks = find_chunk_offsets(args.i, args.workers)
+    parts = [f"{args.o}.part{worker}" for worker in range(len(chunks))]
+    started = time.monotonic()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(process_chunk, args.i, worker, start, end, prefix, suffix, part, args.order)
+                   for worker, ((start, end), part) in enumerate(zip(chunks, parts))]
+        results = [future.result() for future in futures]
+    merge_parts(parts, args.o, args.order)
+    elapsed = time.monotonic() - started
+    total = sum(records for _, records, _ in results)
+    for worker, records, seconds in results:
+        logger.info(f"worker {worker}: {records} records, {records / seconds if seconds else 0:.1f} records/s")
+    logger.info(f"Processed {total} records in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f} records/s)")
 
 def main(args):
-    soup = create_soup(args.i)
-    variation_ids = split_records(soup)
-    TOTAL_RECORDS = len(variation_ids)
+    if args.format == 'parquet':
+        from ClinvarParquet import read_tsv_rows, write_partitioned
+        tsv = args.o.rstrip('/') + '.tsv'
+        main(argparse.Namespace(**{**vars(args), 'o': tsv, 'format': 'tsv'}))
+        write_partitioned(read_tsv_rows(tsv), args.o)
+        os.remove(tsv)
+        return
+    if args.workers > 1:
+        return parallel_main(args)
+    progress = Progress(0)
+    lines = []
     with open(args.o, 'w') as outfile:
-        for lineno, var in enumerate(variation_ids, start = 1):
-            if not lineno % 1000:
-                print(f"Processed {lineno} records of {TOTAL_RECORDS}")
+        for var in iter_records(args.i):
             record = process_record(var)
-            export_record(record, outfile)
+            progress.update()
+            # records without GRCh37 VCF coordinates cannot be placed in the table
+            if not record['coordinates']:
+                continue
+            if args.order == 'coordinate':
+                lines.append(format_record(record))
+            else:
+                export_record(record, outfile)
+        # sorted like the part file of a single worker of parallel_main
+        lines.sort(key=coordinate_key)
+        outfile.writelines(lines)
+    progress.log()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
     args = parser.parse_args()
-    main(args)
\ No newline at end of file
+    main(args)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the scripts import the lambda functions' modules as top-level modules
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS, '..', '..', 'lambda_functions'))
+sys.path.insert(0, os.path.join(TESTS, '..'))
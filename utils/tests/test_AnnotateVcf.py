@@ -0,0 +1,71 @@
+import json
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('urllib3')
+if sys.version_info < (3, 12):
+    # AnnotateVcf imports QueryOncoKb, which nests quotes in an f-string
+    pytest.skip('AnnotateVcf requires Python 3.12', allow_module_level=True)
+import AnnotateVcf
+import Metrics
+
+VCF = "##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n" + "".join(
+    f"1\t{100 * i}\t.\tA\tG,T\t.\t.\t.\n" for i in range(1, 8))
+
+@pytest.fixture
+def gnomad(monkeypatch):
+    """
+    a gnomad source that records the variants it annotates and fails
+    with KeyboardInterrupt on a variant in gnomad.interrupt
+    """
+    gnomad = SimpleNamespace(batches=[], interrupt=set())
+    def annotate(variants):
+        gnomad.batches.append([x['id'] for x in variants])
+        if any(x['id'] in gnomad.interrupt for x in variants):
+            raise KeyboardInterrupt
+        return {x['id']: {'position': x['position']} for x in variants}
+    monkeypatch.setitem(AnnotateVcf.SOURCES, 'gnomad', (annotate, 100, 1, False))
+    monkeypatch.setattr(Metrics, 'ENABLED', Metrics.ENABLED)
+    return gnomad
+
+def run(vcf, output, *options):
+    AnnotateVcf.main(AnnotateVcf.parser.parse_args(
+        ['-i', str(vcf), '-o', str(output), '--sources', 'gnomad', '--chunk-size', '4', '--in-flight', '1', *options]))
+
+def test_resumes_from_the_checkpoint(tmp_path, gnomad):
+    vcf = tmp_path / 'input.vcf'
+    vcf.write_text(VCF)
+    run(vcf, tmp_path / 'expected.jsonl')
+    gnomad.batches.clear()
+
+    output = tmp_path / 'output.jsonl'
+    gnomad.interrupt = {'5:1-500-A-T'}
+    with pytest.raises(KeyboardInterrupt):
+        run(vcf, output)
+    checkpoint = json.loads((tmp_path / 'output.jsonl.checkpoint').read_text())
+    assert checkpoint['records'] == 4
+    assert checkpoint['output_bytes'] == output.stat().st_size
+    # a chunk partly written when the run stopped is dropped on resume
+    with open(output, 'a') as outfile:
+        outfile.write('{"id": "5:1-500-A-G"')
+
+    gnomad.batches.clear()
+    gnomad.interrupt = set()
+    run(vcf, output)
+    assert gnomad.batches[0][0] == '5:1-500-A-G'
+    assert output.read_bytes() == (tmp_path / 'expected.jsonl').read_bytes()
+    assert not (tmp_path / 'output.jsonl.checkpoint').exists()
+
+def test_checkpoint_of_other_options_is_refused(tmp_path, gnomad):
+    vcf = tmp_path / 'input.vcf'
+    vcf.write_text(VCF)
+    gnomad.interrupt = {'5:1-500-A-T'}
+    with pytest.raises(KeyboardInterrupt):
+        run(vcf, tmp_path / 'output.jsonl')
+    with pytest.raises(SystemExit):
+        run(vcf, tmp_path / 'output.jsonl', '--format', 'tsv')
+    gnomad.interrupt = set()
+    run(vcf, tmp_path / 'output.jsonl', '--format', 'tsv', '--restart')
+    assert (tmp_path / 'output.jsonl').read_text().count('\n') == 1 + 14
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from ClinvarDelta import apply_parquet, apply_tsv, diff_releases, load_delta, record_digest, record_key
+from ClinvarStore import COLUMNS, read_tsv_rows
+
+HEADER = '\t'.join(COLUMNS) + '\n'
+
+PREVIOUS = [
+    ['1', '100', 'A', 'G', '1', 'Pathogenic', 'reviewed by expert panel', 'Disease A,Disease B'],
+    ['1', '200', 'C', 'T', '2', 'Benign', 'criteria provided, single submitter', 'Disease C'],
+    ['chr2', '300', 'G', 'A', '3', 'Uncertain significance', 'no assertion criteria provided', 'not provided'],
+    ['X', '20000000', 'T', 'C', '4', 'Likely benign', 'criteria provided, single submitter', 'Disease D'],
+]
+CURRENT = [
+    # the conditions in another order are unchanged
+    ['1', '100', 'A', 'G', '1', 'Pathogenic', 'reviewed by expert panel', 'Disease B,Disease A'],
+    # reclassified
+    ['1', '200', 'C', 'T', '2', 'Likely benign', 'criteria provided, single submitter', 'Disease C'],
+    ['2', '300', 'G', 'A', '3', 'Uncertain significance', 'no assertion criteria provided', 'not provided'],
+    ['1', '150', 'T', 'G', '5', 'Pathogenic', 'criteria provided, single submitter', 'Disease E'],
+]
+
+def write_tsv(path, rows):
+    with open(path, 'w', encoding='utf-8') as outfile:
+        outfile.write(HEADER)
+        for row in rows:
+            outfile.write('\t'.join(row) + '\n')
+    return str(path)
+
+def contents(rows):
+    return {record_key(row): record_digest(row) for row in rows}
+
+def test_diff_releases(tmp_path):
+    previous, current = write_tsv(tmp_path / 'previous.tsv', PREVIOUS), write_tsv(tmp_path / 'current.tsv', CURRENT)
+    manifest = diff_releases(previous, current, str(tmp_path / 'delta'))
+    assert manifest['counts'] == {'added': 1, 'removed': 1, 'changed': 1, 'unchanged': 2}
+    assert manifest['partitions'] == [('1', 0), ('X', 2)]
+    with open(tmp_path / 'delta' / 'manifest.json') as infile:
+        assert json.load(infile)['counts'] == manifest['counts']
+    assert [row[4] for row in read_tsv_rows(str(tmp_path / 'delta' / 'added.tsv'))] == ['5']
+    assert [row[4] for row in read_tsv_rows(str(tmp_path / 'delta' / 'removed.tsv'))] == ['4']
+    assert [row[5] for row in read_tsv_rows(str(tmp_path / 'delta' / 'changed.tsv'))] == ['Likely benign']
+
+def test_apply_tsv_reproduces_the_new_release(tmp_path):
+    previous, current = write_tsv(tmp_path / 'previous.tsv', PREVIOUS), write_tsv(tmp_path / 'current.tsv', CURRENT)
+    diff_releases(previous, current, str(tmp_path / 'delta'))
+    apply_tsv(load_delta(str(tmp_path / 'delta')), previous)
+    with open(previous, encoding='utf-8') as infile:
+        assert infile.readline() == HEADER
+    assert contents(read_tsv_rows(previous)) == contents(CURRENT)
+
+def test_identical_releases_give_an_empty_delta(tmp_path):
+    previous, current = write_tsv(tmp_path / 'previous.tsv', PREVIOUS), write_tsv(tmp_path / 'current.tsv', PREVIOUS)
+    manifest = diff_releases(previous, current, str(tmp_path / 'delta'))
+    assert manifest['counts'] == {'added': 0, 'removed': 0, 'changed': 0, 'unchanged': len(PREVIOUS)}
+    assert manifest['partitions'] == []
+
+def test_apply_parquet_rewrites_the_touched_partitions(tmp_path):
+    pytest.importorskip('pyarrow')
+    from ClinvarParquet import write_partitioned
+    previous, current = write_tsv(tmp_path / 'previous.tsv', PREVIOUS), write_tsv(tmp_path / 'current.tsv', CURRENT)
+    dataset, expected = tmp_path / 'dataset', tmp_path / 'expected'
+    write_partitioned(read_tsv_rows(previous), str(dataset))
+    write_partitioned(read_tsv_rows(current), str(expected))
+    diff_releases(previous, current, str(tmp_path / 'delta'))
+    apply_parquet(load_delta(str(tmp_path / 'delta')), str(dataset))
+    import pyarrow.parquet as pq
+    read = lambda path: contents([[record['chrom']] + [record[name] for name in COLUMNS[1:]]
+                                  for record in pq.read_table(str(path)).to_pylist()])
+    assert read(dataset) == read(expected)
+    # the X partition only held the removed record
+    assert not (dataset / 'chrom=X').exists() or not any((dataset / 'chrom=X').iterdir())
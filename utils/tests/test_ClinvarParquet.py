@@ -0,0 +1,34 @@
+import pytest
+
+pytest.importorskip('pyarrow')
+import pyarrow.parquet as pq
+
+import ClinvarParquet
+from ClinvarStore import COLUMNS
+
+def rows(chrom, positions):
+    return [[chrom, str(position), 'A', 'G', str(position), 'Pathogenic', 'reviewed by expert panel', 'Disease A']
+            for position in positions]
+
+def read(path):
+    return sorted((str(record['chrom']), record['position']) for record in pq.read_table(str(path)).to_pylist())
+
+def test_partitions_are_written_in_row_groups(tmp_path, monkeypatch):
+    monkeypatch.setattr(ClinvarParquet, 'ROW_GROUP_SIZE', 3)
+    records = rows('chr1', range(100, 107)) + rows('X', [5, 20000001]) + rows('1', [30])
+    assert ClinvarParquet.write_partitioned(records, str(tmp_path)) == len(records)
+    assert read(tmp_path) == sorted((row[0].replace('chr', ''), row[1]) for row in records)
+    partition = tmp_path / 'chrom=1' / 'pos_bin=0'
+    assert [x.name for x in partition.iterdir()] == ['part-0.parquet']
+    metadata = pq.ParquetFile(str(partition / 'part-0.parquet')).metadata
+    assert [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)] == [3, 3, 2]
+    assert pq.read_schema(str(partition / 'part-0.parquet')).names == [x for x in COLUMNS if x != 'chrom']
+
+def test_written_partitions_are_replaced(tmp_path):
+    ClinvarParquet.write_partitioned(rows('1', [100, 200]) + rows('2', [300]), str(tmp_path))
+    # a file of an earlier writer, e.g. pyarrow's write_to_dataset
+    (tmp_path / 'chrom=1' / 'pos_bin=0' / 'old.parquet').write_bytes(
+        (tmp_path / 'chrom=2' / 'pos_bin=0' / 'part-0.parquet').read_bytes())
+    ClinvarParquet.write_partitioned(rows('1', [400]), str(tmp_path))
+    assert [x.name for x in (tmp_path / 'chrom=1' / 'pos_bin=0').iterdir()] == ['part-0.parquet']
+    assert read(tmp_path) == [('1', '400'), ('2', '300')]
@@ -0,0 +1,52 @@
+import gzip
+import random
+
+import pytest
+
+import ParseClinvarXml
+
+CHROMOSOMES = ['1', '2', '10', 'X', 'MT']
+
+def variation_archive(variation_id, rng):
+    chrom, position = rng.choice(CHROMOSOMES), rng.randint(1, 50) * 1000
+    locations = f'<SequenceLocation Assembly="GRCh38" Chr="{chrom}" positionVCF="{position + 7}" referenceAlleleVCF="A" alternateAlleleVCF="T"/>'
+    # some records only have GRCh38 coordinates and are left out
+    if rng.random() < 0.8:
+        locations += f'<SequenceLocation Assembly="GRCh37" Chr="{chrom}" positionVCF="{position}" referenceAlleleVCF="A" alternateAlleleVCF="G"/>'
+    traits = "".join(f'<Trait><Name><ElementValue>Disease {x}</ElementValue></Name></Trait>'
+                     for x in rng.sample('ABCDEF', 3))
+    return (f'<VariationArchive VariationID="{variation_id}"><ClassifiedRecord><SimpleAllele><Location>{locations}'
+            f'</Location></SimpleAllele><Classifications><GermlineClassification><ReviewStatus>criteria provided, '
+            f'single submitter</ReviewStatus><Description>Pathogenic</Description></GermlineClassification>'
+            f'</Classifications><ClinicalAssertionList><TraitSet>{traits}</TraitSet></ClinicalAssertionList>'
+            f'</ClassifiedRecord></VariationArchive>\n')
+
+@pytest.fixture
+def release(tmp_path):
+    rng = random.Random(7)
+    path = tmp_path / 'release.xml'
+    path.write_text('<?xml version="1.0" encoding="UTF-8"?>\n<ClinVarVariationRelease ReleaseDate="2024-01-01">\n'
+                    + "".join(variation_archive(i, rng) for i in range(1, 200)) + '</ClinVarVariationRelease>\n')
+    return path
+
+def parse(infile, outfile, *options):
+    ParseClinvarXml.main(ParseClinvarXml.parser.parse_args(['-i', str(infile), '-o', str(outfile), *options]))
+    return outfile.read_bytes()
+
+@pytest.mark.parametrize('order', ['input', 'coordinate'])
+def test_parallel_output_matches_serial_output(release, tmp_path, order):
+    serial = parse(release, tmp_path / 'serial.tsv', '--order', order)
+    assert serial.count(b'\n') > 100
+    assert parse(release, tmp_path / 'parallel.tsv', '--order', order, '--workers', '3') == serial
+
+def test_input_order_and_coordinate_order(release, tmp_path):
+    lines = parse(release, tmp_path / 'input.tsv').decode().splitlines()
+    assert [int(x.split('\t')[4]) for x in lines] == sorted(int(x.split('\t')[4]) for x in lines)
+    ordered = parse(release, tmp_path / 'coordinate.tsv', '--order', 'coordinate').decode().splitlines()
+    assert ordered == sorted(lines, key=lambda x: ParseClinvarXml.coordinate_key(x + '\n'))
+
+def test_one_worker_streams_gzipped_input_in_coordinate_order(release, tmp_path):
+    compressed = tmp_path / 'release.xml.gz'
+    compressed.write_bytes(gzip.compress(release.read_bytes()))
+    assert (parse(compressed, tmp_path / 'compressed.tsv', '--order', 'coordinate') ==
+            parse(release, tmp_path / 'plain.tsv', '--order', 'coordinate'))